@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""
+Measures the resident memory used per process in a DAG.
+
+Builds a DAG of GridProcesses shaped like the trident segmenter examples
+(one chunk file, one shared file and one output per process) and reports
+the growth of the resident set size divided by the number of processes.
+
+Usage: memory_per_node.py [number of processes]
+"""
+
+
+def resident_set_size():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    raise Exception("VmRSS not found in /proc/self/status")
+
+
+def main(num_processes):
+    import gc
+    import dag
+
+    gc.collect()
+    before = resident_set_size()
+    the_dag = dag.DAG(dag.Engine.LSF)
+    for i in range(num_processes):
+        input_files = [dag.File("/data/run/.CLUSTER/segmented-%d" % i,
+                                temporary_file=True),
+                       dag.File("/data/run/mirna.fa")]
+        output_files = [dag.File("/data/run/out-%d.txt" % i)]
+        proc = dag.GridProcess("trident", input_files, output_files,
+                               "-sc 140 -out out-%d.txt" % i)
+        proc.workunit_name = "trident-%d" % i
+        the_dag.add_process(proc)
+    gc.collect()
+    after = resident_set_size()
+    print("%d processes: %d bytes per process"
+          % (num_processes, (after - before) // num_processes))
+
+
+if __name__ == "__main__":
+    from sys import argv
+    num_processes = 100000
+    if len(argv) > 1:
+        num_processes = int(argv[1])
+    main(num_processes)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Measures the startup time of the command line tools.
+
+Times "import dag", "update_dag --version" and "update_dag state CREATED
+--count" on a DAG of LSF processes, with and without a resident server
+(update_dag serve). Each command is run several times and the median
+wall clock time is reported. The scripts and modules of this source tree
+are used, rather than installed copies.
+
+Usage: startup.py [number of processes] [number of runs]
+"""
+import os.path as OP
+
+ROOT = OP.dirname(OP.dirname(OP.abspath(__file__)))
+UPDATE_DAG = OP.join(ROOT, "scripts", "update_dag")
+
+
+def median_time(command, runs, env):
+    import subprocess
+    import time
+    times = []
+    with open("/dev/null", "w") as devnull:
+        for i in range(runs):
+            start = time.time()
+            subprocess.check_call(command, stdout=devnull, env=env)
+            times.append(time.time() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def make_dag(filename, num_processes):
+    import dag
+    the_dag = dag.DAG(dag.Engine.LSF)
+    for i in range(num_processes):
+        proc = dag.GridProcess("trident",
+                               [dag.File("segmented-%d" % i)],
+                               [dag.File("out-%d.txt" % i)],
+                               "-sc 140 -out out-%d.txt" % i)
+        proc.workunit_name = "trident-%d" % i
+        the_dag.add_process(proc)
+    the_dag.save(filename)
+
+
+def main(num_processes, runs):
+    import os
+    import shutil
+    import subprocess
+    import sys
+    import tempfile
+    import time
+    from dag.resident import socket_path
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([ROOT, env.get("PYTHONPATH", "")])
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        open(".dagrc", "w").close()
+        env["HOME"] = workdir  # Empty init file
+        make_dag("jobs.dag", num_processes)
+        state = [sys.executable, UPDATE_DAG, "state", "CREATED", "--count"]
+        commands = [
+            ("python -c pass", [sys.executable, "-c", "pass"]),
+            ("import dag", [sys.executable, "-c", "import dag"]),
+            ("update_dag --version",
+             [sys.executable, UPDATE_DAG, "--version"]),
+            ("update_dag state (%d processes)" % num_processes, state)]
+        for (name, command) in commands:
+            print("%-40s %7.1f ms"
+                  % (name, 1000 * median_time(command, runs, env)))
+
+        server = subprocess.Popen([sys.executable, UPDATE_DAG, "serve"],
+                                  env=env)
+        try:
+            while not OP.exists(socket_path("jobs.dag")):
+                time.sleep(0.1)
+            print("%-40s %7.1f ms"
+                  % ("update_dag state (resident server)",
+                     1000 * median_time(state, runs, env)))
+        finally:
+            server.terminate()
+            server.wait()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    from sys import argv
+    num_processes = 10000
+    runs = 10
+    if len(argv) > 1:
+        num_processes = int(argv[1])
+    if len(argv) > 2:
+        runs = int(argv[2])
+    main(num_processes, runs)
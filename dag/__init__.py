@@ -13,8 +13,27 @@ Creates and manages a Directed Acyclic Graph of embarrassingly parallel
 DEFAULT_DAGFILE_NAME = "jobs.dag"
 DEFAULT_DAG_CONFIG_FILE = ".dagrc"
 
+# Runtime estimates, in seconds, used to order runnable processes.
+DEFAULT_RUNTIME_ESTIMATE = 60
+# Floating point operations per second assumed when converting
+# rsc_fpops_est into a runtime estimate.
+DEFAULT_FLOPS = 10 ** 9
+
+
+# Read by setup.py. Kept literal, so that importing dag does not have to
+# look up the installed distribution.
+__version__ = "1.7.0"
+
 
 def get_version():
+    """
+    Returns the version of the installed distribution. This is slow, as
+     pkg_resources scans sys.path, so __version__ should be used instead
+     where possible.
+
+    @return: Installed version, or __version__ if dag is not installed
+    @rtype: str
+    """
     import pkg_resources
     try:
         dist = pkg_resources.get_distribution("dag")
@@ -22,12 +41,9 @@ def get_version():
             return dist.version
     except pkg_resources.DistributionNotFound:
         pass
-    return "0.0"
+    return __version__
 
 
-__version__ = get_version()
- 
-
 class DagException(Exception):
     """
     Generic Exception for DAG related problems.
@@ -43,14 +59,24 @@ class MissingDAGFile(DagException):
     pass
 
 
+class DependencyCycle(DagException):
+    """
+    Raised when the dependencies of processes form a cycle, so that the
+    processes in it can never run.
+    """
+    pass
+
+
 def enum(*sequential, **vals):
     the_enums = dict(zip(sequential, range(len(sequential))), **vals)
     return type('Enumeration', (), the_enums)
 
 
 Engine = enum('BOINC', 'LSF', 'SHELL', 'NUM_ENGINES')
-States = enum('CREATED', 'STAGED', 'RUNNING', 'SUCCESS', 'FAIL', 'NUM_STATES')
-WAITING_STATES = (States.CREATED, States.STAGED)
+States = enum('CREATED', 'STAGED', 'RUNNING', 'SUCCESS', 'FAIL', 'RETRY',
+              'NUM_STATES')
+# RETRY: Failed with retries left, waiting to be run again (see dag.retry)
+WAITING_STATES = (States.CREATED, States.STAGED, States.RETRY)
 RUNNING_STATES = (States.RUNNING)
 FINISHED_STATES = (States.SUCCESS, States.FAIL) 
 
@@ -125,10 +151,51 @@ def intstate(state):
     return string2enum(States, state)
 
 
-class File:
+def intern_string(value):
+    """
+    Interns a string, so that equal strings share one object in memory.
+     Values that cannot be interned, such as unicode strings, are returned
+     unchanged.
+
+    @param value: String to be interned
+    @type value: str
+    @return: Interned string
+    @rtype: str
+    """
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
+_slot_names = {}
+
+
+def slot_names(cls):
+    """
+    Returns the names of the slots of a class and of its base classes.
+
+    @param cls: Class
+    @type cls: type
+    @return: Slot names
+    @rtype: list
+    """
+    if cls not in _slot_names:
+        names = []
+        for klass in cls.__mro__:
+            for name in klass.__dict__.get("__slots__", ()):
+                if name in ("__dict__", "__weakref__") or name in names:
+                    continue
+                names.append(name)
+        _slot_names[cls] = names
+    return _slot_names[cls]
+
+
+class File(object):
     """
     File description abstraction
 
+    Directory and file names are interned, since many files share them.
+
     Attributes:
     @ivar physical_name: Base name of the actual file on disk
     @type physical_name: str
@@ -142,17 +209,29 @@ class File:
      Null string indicates the file is in the same directory as the dag file.
     @type dir: str
     """
-    def __init__(self, physical_name, logical_name=None, temporary_file=False,
-                 max_nbytes=15000000):
+    __slots__ = ("physical_name", "logical_name", "temp_file", "max_nbytes",
+                 "dir")
+
+    # physical_name has a default so that pickles of File, from when it
+    # was an old-style class, can be loaded.
+    def __init__(self, physical_name="", logical_name=None,
+                 temporary_file=False, max_nbytes=15000000):
         import os.path as OP
-        self.physical_name = OP.basename(physical_name)
+        self.physical_name = intern_string(OP.basename(physical_name))
         if logical_name is None:
             self.logical_name = self.physical_name
         else:
-            self.logical_name = logical_name
+            self.logical_name = intern_string(logical_name)
         self.temp_file = temporary_file
         self.max_nbytes = max_nbytes
-        self.dir = OP.dirname(physical_name)
+        self.dir = intern_string(OP.dirname(physical_name))
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for (name, value) in state.items():
+            setattr(self, name, intern_string(value))
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
@@ -206,9 +285,38 @@ class Process(object):
     @type state: dag.States
     @ivar temp_files: Optional list of temporary files
     @type temp_files: list
-    @ivar uuid: Unique ID of process
+    @ivar uuid: Unique ID of process, stored as a 128-bit integer
     @type uuid: uuid.UUID
+    @ivar priority: Manual scheduling priority. Runnable processes with a
+     higher priority are started first, regardless of their critical path.
+    @type priority: int
+    @ivar start_time: Epoch time at which the process was last started
+    @type start_time: float
+    @ivar end_time: Epoch time at which the process last finished
+    @type end_time: float
+    @ivar level: Topological level, i.e. the length of the longest chain of
+     parents above the process. Set by DAG.validate. None if the process
+     is part of, or depends on, a cycle.
+    @type level: int
+    @ivar retries: Optional number of times the process is run again after
+     it fails (see dag.retry)
+    @type retries: int
+    @ivar attempts: Number of retries so far
+    @type attempts: int
+    @ivar failure_reason: Optional reason the last run was stopped, e.g.
+     because it passed its deadline (see dag.shell.ShellProcess)
+    @type failure_reason: str
+
+    Attributes that every process uses are kept in slots, rather than in
+    a per-instance dict. Subclasses list their own attributes in
+    __slots__. Other attributes, such as those set by user parsers, are
+    still allowed and are stored in __dict__.
     """
+    __slots__ = ("input_files", "output_files", "state", "children",
+                 "temp_files", "_uuid", "priority", "start_time", "end_time",
+                 "cmd", "args", "workunit_name", "cacheable", "level",
+                 "__dict__")
+
     def __init__(self):
         import uuid
         self.input_files = []
@@ -217,6 +325,37 @@ class Process(object):
         self.children = []
         self.temp_files = []
         self.uuid = uuid.uuid4()
+        self.priority = 0
+        self.start_time = None
+        self.end_time = None
+        self.level = None
+
+    def _get_uuid(self):
+        import uuid
+        return uuid.UUID(int=self._uuid)
+
+    def _set_uuid(self, value):
+        self._uuid = value.int
+
+    uuid = property(_get_uuid, _set_uuid)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for name in slot_names(type(self)):
+            try:
+                state[name] = getattr(self, name)
+            except AttributeError:
+                pass  # Slot was never set
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        if "uuid" in state:  # Pickled before UUIDs were stored as integers
+            self.uuid = state.pop("uuid")
+        if "cmd" in state:
+            state["cmd"] = intern_string(state["cmd"])
+        for (name, value) in state.items():
+            setattr(self, name, value)
 
     def __str__(self):
         raise DagException("String function must be overloaded classes"
@@ -273,6 +412,8 @@ class InternalProcess(Process):
     @ivar cmd: Python code to be run
     @type cmd: str
     """
+    __slots__ = ()
+
     def __init__(self, command):
         super(InternalProcess, self).__init__()
         self.cmd = command
@@ -324,11 +465,14 @@ class GridProcess(Process):
     @ivar deadline: limit of CPU time in seconds
     @type deadline: int
     """
+    __slots__ = ("workunit_template", "result_template", "rsc_fpops_est",
+                 "rsc_fpops_bound", "rsc_memory_bound", "deadline")
+
     def __init__(self, cmd, input_files, output_files, arguments,
                  rsc_fpops_est=10 ** 10, rsc_fpops_bound=10 ** 11,
                  rsc_memory_bound=536870912, deadline=None):
         super(GridProcess, self).__init__()
-        self.cmd = cmd
+        self.cmd = intern_string(cmd)
         self.input_files = input_files
         self.output_files = output_files
         self.workunit_name = ""
@@ -396,7 +540,7 @@ class Graph(dict):
         @type proc: dag.Process
         """
         for filename in proc.output_files:
-            if filename not in self.keys():
+            if filename not in self:
                 self[filename] = [proc]
             else:
                 self[filename].append(proc)
@@ -433,6 +577,18 @@ class DAG:
     @type engine: dag.Engine
     @ivar num_cores: Optional number of cores used in local multiprocessing
     @type num_cores: int
+    @ivar memory: Optional bytes of memory used in local multiprocessing.
+     If None, the physical memory of the machine is used.
+    @type memory: int
+    @ivar history_filename: Optional path to the database of past runs.
+     If None, dag.history.default_history_filename() is used.
+    @type history_filename: str
+    @ivar incremental: Whether or not processes whose fingerprint is
+     unchanged since they last succeeded are skipped (see dag.fingerprint).
+    @type incremental: bool
+    @ivar version: Number of times the DAG has been saved. It is compared
+     with the version on disk to detect concurrent writers (see save).
+    @type version: int
     """
     def __init__(self, engine=Engine.BOINC):
         self.processes = []
@@ -440,16 +596,53 @@ class DAG:
         self.filename = ""
         self.engine = engine
         self.num_cores = None
+        self.memory = None
+        self.history_filename = None
+        self.incremental = True
+        self.version = 0
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop("_files", None)
+        state.pop("saved_identity", None)
+        return state
+
+    def shared_file(self, new_file):
+        """
+        Returns the File in the DAG that is identical to new_file, so that
+         processes using the same file share one File object. If there is
+         no such File, new_file is added to the DAG and returned.
+
+        @param new_file: File
+        @type new_file: dag.File
+        @return: Shared File
+        @rtype: dag.File
+        """
+        files = self.__dict__.get("_files")
+        if files is None:
+            # Not pickled. Rebuilt from the processes when first needed.
+            files = self._files = {}
+            for proc in self.processes:
+                for f in proc.input_files + proc.output_files:
+                    files.setdefault((f.logical_name, f.physical_name, f.dir,
+                                      f.temp_file, f.max_nbytes), f)
+        key = (new_file.logical_name, new_file.physical_name, new_file.dir,
+               new_file.temp_file, new_file.max_nbytes)
+        return files.setdefault(key, new_file)
 
     def add_process(self, proc):
         """
-        Adds a process to the DAG.
+        Adds a process to the DAG. Input and output files that are
+         identical to files of other processes are replaced by the
+         File objects of those processes.
 
         @param proc: Process to be added
         @type proc: dag.Process
         @return: Process added to graph
         @rtype: dag.Process
         """
+        proc.input_files = [self.shared_file(f) for f in proc.input_files]
+        proc.output_files = [self.shared_file(f) for f in proc.output_files]
         self.processes.append(proc)
         self.graph.add_process(proc)
         return proc
@@ -464,11 +657,16 @@ class DAG:
         @return: Process
         @rtype: dag.Process
         """
+        import uuid
         for i in self.processes:
             if i.workunit_name == wuname:
                 return i
+        try:
+            uuid_int = uuid.UUID(wuname).int
+        except (TypeError, ValueError):
+            return None
         for i in self.processes:
-            if str(i.uuid) == wuname:
+            if i._uuid == uuid_int:
                 return i
         return None
 
@@ -484,6 +682,98 @@ class DAG:
             return [proc for proc in self.processes if proc.state in state]
         return [proc for proc in self.processes if proc.state == state]
 
+    def select(self, selectors, unmatched=None):
+        """
+        Finds the processes matching any of a list of selectors.
+
+        A selector is a comma separated list of terms, all of which must
+         match. Terms are "state=NAME", "name=PATTERN", "cmd=PATTERN"
+         or "uuid=UUID". Patterns may contain shell style wildcards.
+         A selector without "=" is a workunit name or UUID, as in
+         get_process. Names and UUIDs without wildcards are looked up in
+         an index. All other selectors are matched in a single pass over
+         the processes.
+
+        @param selectors: Selector strings
+        @type selectors: list
+        @param unmatched: Optional list to which selectors that match no
+         process are appended
+        @type unmatched: list
+        @return: Matching processes, in DAG order
+        @rtype: list
+        @raise DagException: If a selector is invalid
+        """
+        from fnmatch import fnmatchcase
+
+        def has_wildcard(pattern):
+            return any([c in pattern for c in "*?["])
+
+        index = {}
+        if any(["=" not in s or s.split("=", 1)[0] in ["name", "uuid"]
+                for s in selectors]):
+            for proc in self.processes:
+                index[str(proc.uuid)] = proc
+            for proc in self.processes:
+                if proc.workunit_name:
+                    index.setdefault(proc.workunit_name, proc)
+
+        def matches(proc, terms):
+            for (key, value) in terms:
+                if key == "state":
+                    if proc.state != value:
+                        return False
+                elif key == "name":
+                    if not fnmatchcase(str(proc.workunit_name), value):
+                        return False
+                elif key == "cmd":
+                    if not fnmatchcase(str(proc.cmd), value):
+                        return False
+                elif str(proc.uuid) != value:
+                    return False
+            return True
+
+        selected = set()
+        scanned = []  # (selector, terms) needing a pass over processes
+        for selector in selectors:
+            if "=" not in selector:
+                selector_terms = [("name", selector)]
+            else:
+                selector_terms = []
+                for term in selector.split(","):
+                    (key, _, value) = term.partition("=")
+                    key = key.strip().lower()
+                    if key == "state":
+                        value = intstate(value.strip().upper())
+                        if value is None:
+                            raise DagException("Invalid state in selector"
+                                               " '%s'" % selector)
+                    elif key not in ["name", "cmd", "uuid"]:
+                        raise DagException("Invalid selector '%s'. Selectors"
+                                           " are state=, name=, cmd= and"
+                                           " uuid=" % selector)
+                    selector_terms.append((key, value))
+            if (len(selector_terms) == 1
+                    and selector_terms[0][0] in ["name", "uuid"]
+                    and not has_wildcard(selector_terms[0][1])):
+                proc = index.get(selector_terms[0][1])
+                if proc is not None:
+                    selected.add(proc)
+                elif unmatched is not None:
+                    unmatched.append(selector)
+                continue
+            scanned.append((selector, selector_terms))
+
+        found = set()
+        if scanned:
+            for proc in self.processes:
+                for (selector, selector_terms) in scanned:
+                    if matches(proc, selector_terms):
+                        selected.add(proc)
+                        found.add(selector)
+        if unmatched is not None:
+            unmatched.extend([s for (s, t) in scanned if s not in found])
+        return [proc for proc in self.processes if proc in selected]
+
     def is_empty(self):
         """
         Determines whether or not a DAG is empty.
@@ -497,13 +787,28 @@ class DAG:
         """
         Serializes the DAG
 
+        The DAG is written to a temporary file in the same directory, which
+        is then renamed over the DAG file. Readers therefore always see
+        either the previous or the new snapshot, and never need a lock.
+        Writers are serialized by a lock on the DAG file.
+
+        Each save increments the version of the DAG, which is written
+        ahead of the DAG (see read_version). Before replacing the file
+        that the DAG was loaded from, or last saved to, the version on
+        disk is compared with that of the DAG. If they differ, another
+        writer has saved since, and its changes would be lost, so the DAG
+        is not saved.
+
         @param filename: File name to be save
         @type filename: str
-        @param backup_first: Whether or not the DAG file should be backed up
-         before overwritting. Default: True
+        @param backup_first: Ignored. Retained for compatibility, since the
+         rename makes a backup copy unnecessary.
         @type backup_first: bool
         @return: File name of DAG
         @rtype: str
+        @raise DagException: If the DAG file is locked by another writer,
+         was saved by another writer since this DAG was loaded or cannot
+         be written.
         """
         import cPickle
         import tempfile
@@ -511,7 +816,6 @@ class DAG:
         import os.path as OP
         import lockfile
 
-        outfile = None
         # Check filename.
         # * If filename is None *and* self.filename is None,
         #   use a temporary file
@@ -519,53 +823,88 @@ class DAG:
         #   to self.filename, we are changing self.filename.
         if not filename:
             if not self.filename:
-                outfile = tempfile.NamedTemporaryFile(mode='wb', delete=False,
-                                                      dir=os.getcwd())
-        elif (self.filename != filename):
-            self.filename = filename
+                (handle, filename) = tempfile.mkstemp(dir=os.getcwd())
+                os.close(handle)
+            else:
+                filename = self.filename
+        # Only the file that this DAG came from is checked for newer saves.
+        same_file = bool(self.filename) and (OP.abspath(filename)
+                                             == OP.abspath(self.filename))
+        self.filename = OP.abspath(filename)  # Update filename
 
         lock = lockfile.FileLock(self.filename)
-
         try:
             lock.acquire(timeout=10)
         except lockfile.LockTimeout:
             raise DagException("Error saving DAG. DAG file %s is locked."
                                % self.filename)
 
-        backup_filename = self.filename + ".bak"
-        if outfile is None:
-            try:
-                # Backup in case of problems
-                if (backup_first and OP.isfile(self.filename)
-                   and not OP.isfile(backup_filename)):
-                    import shutil
-                    shutil.copyfile(self.filename, backup_filename)
-                outfile = open(self.filename, "wb")
-            except Exception as e:
-                raise DagException("Saving DAG failed.\nCWD: %s\nMessage: %s"
-                                   % (os.getcwd(), e.message))
-
-        self.filename = OP.abspath(outfile.name)  # Update filename
-
-        # Dump the pickle
-        cPickle.dump(self, outfile)
-        retval = outfile.name
-        outfile.close()
-        if backup_first and OP.isfile(backup_filename):
-            try:
-                os.remove(backup_filename)
-            except Exception as e:
-                raise DagException("Could not remove backup DAG file '%s'.\n"
-                                   "Reason: %s" % (backup_filename, e.message))
-        lock.release()
-
-        return retval
-
-    def incomplete_prereqs(self, proc):
+        outfile = None
+        version = getattr(self, "version", 0)
+        try:
+            on_disk = None
+            if same_file:
+                on_disk = read_version(self.filename)
+            if on_disk is not None and on_disk != version:
+                raise DagException("DAG file %s was saved by another writer"
+                                   " (version %d, loaded version %d). Load"
+                                   " it again and repeat the changes."
+                                   % (self.filename, on_disk, version))
+            # Keep the permissions of the file being replaced. New files
+            # get the permissions open() would give them.
+            if OP.isfile(self.filename):
+                mode = os.stat(self.filename).st_mode & 0777
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                mode = 0666 & ~umask
+            outfile = tempfile.NamedTemporaryFile(
+                mode='wb', delete=False, dir=OP.dirname(self.filename),
+                prefix=OP.basename(self.filename) + ".", suffix=".tmp")
+            self.version = version + 1
+            cPickle.dump(self.version, outfile, cPickle.HIGHEST_PROTOCOL)
+            cPickle.dump(self, outfile, cPickle.HIGHEST_PROTOCOL)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+            outfile.close()
+            os.chmod(outfile.name, mode)
+            st = os.stat(outfile.name)
+            os.rename(outfile.name, self.filename)
+            # Lets a reader tell whether the file on disk is still this save.
+            self.saved_identity = (st.st_dev, st.st_ino, st.st_mtime,
+                                   st.st_size)
+        except DagException:
+            raise
+        except Exception as e:
+            self.version = version
+            if outfile is not None and OP.isfile(outfile.name):
+                outfile.close()
+                os.unlink(outfile.name)
+            raise DagException("Saving DAG failed.\nCWD: %s\nMessage: %s"
+                               % (os.getcwd(), e))
+        finally:
+            lock.release()
+
+        return filename
+
+    def incomplete_prereqs(self, proc, parents=None, file_cache=None):
         """
         Checks a process instance within a DAG to see if all
          of its prerequisites are met.
 
+        Without a parent map, every process in the DAG is searched for
+         explicit dependencies. Callers checking many processes should
+         build the map once, using dependency_map.
+
+        @param proc: Process to be checked
+        @type proc: dag.Process
+        @param parents: Optional parent map from dependency_map
+        @type parents: dict
+        @param file_cache: Optional cache used to check that input files
+         exist. If its assume_outputs flag is set, output files of
+         successful processes are not checked. Default: files are checked
+         with stat.
+        @type file_cache: dag.filecache.FileCache
         @return: Indication of there being missing prerequisite
             processes or files
         @rtype: list
@@ -574,63 +913,363 @@ class DAG:
         from os import path as OP
         uncompleted_prereqs = []
         for infile in proc.input_files:
+            produced = False
             if infile in self.graph:
+                produced = True
                 for parent in self.graph[infile]:
                     if parent.state != States.SUCCESS:
                         uncompleted_prereqs.append(parent)
-            if not OP.isfile(infile.full_path()):
+                        produced = False
+            if file_cache is None:
+                exists = OP.isfile(infile.full_path())
+            elif produced and file_cache.assume_outputs:
+                exists = True
+            else:
+                exists = file_cache.isfile(infile.full_path())
+            if not exists:
                 uncompleted_prereqs.append(infile)
-        for p in self.processes:
+        if parents is None:
+            explicit_parents = [p for p in self.processes
+                                if proc in p.children]
+        else:
+            explicit_parents = parents.get(proc, [])
+        for p in explicit_parents:
             if p in uncompleted_prereqs:
                 continue
-            if proc in p.children and p.state != States.SUCCESS:
+            if p.state != States.SUCCESS:
                 uncompleted_prereqs.append(p)
         return uncompleted_prereqs
 
+    def dependency_map(self):
+        """
+        Builds the parent and child lists of every process in one pass.
+         Edges come from both file dependencies and explicit children.
+
+        @return: Tuple of dicts mapping each process to its parents and
+         to its children, respectively.
+        @rtype: tuple
+        """
+        parents = dict((proc, []) for proc in self.processes)
+        children = dict((proc, []) for proc in self.processes)
+
+        def link(parent, child):
+            if child not in children[parent]:
+                children[parent].append(child)
+                parents[child].append(parent)
+
+        for proc in self.processes:
+            for infile in proc.input_files:
+                for parent in self.graph.get(infile, []):
+                    if parent in children and parent is not proc:
+                        link(parent, proc)
+            for child in proc.children:
+                if child in parents:
+                    link(proc, child)
+        return (parents, children)
+
+    def estimate_runtime(self, proc):
+        """
+        Estimates the number of seconds a process will run. The estimate
+         is the average runtime of past runs of the same command, if any
+         are in the run history. Otherwise, it is based on rsc_fpops_est,
+         if the process has one.
+
+        @param proc: Process to be estimated
+        @type proc: dag.Process
+        @return: Estimated runtime in seconds
+        @rtype: float
+        """
+        from dag.history import get_history
+        history = get_history(getattr(self, "history_filename", None))
+        estimate = history.estimate(proc)
+        if estimate is not None:
+            return estimate
+        fpops = getattr(proc, "rsc_fpops_est", None)
+        if fpops:
+            return float(fpops) / DEFAULT_FLOPS
+        return float(DEFAULT_RUNTIME_ESTIMATE)
+
+    def critical_path_lengths(self, children=None, estimator=None):
+        """
+        Calculates the length of the longest path from each process to the
+         end of the DAG, in estimated seconds. The length of a process
+         includes its own runtime estimate. Finished processes contribute
+         no runtime.
+
+        @param children: Optional child map from dependency_map
+        @type children: dict
+        @param estimator: Optional function returning the runtime of a
+         process. Default: DAG.estimate_runtime
+        @type estimator: function
+        @return: Dict mapping each process to its critical path length
+        @rtype: dict
+        """
+        if children is None:
+            children = self.dependency_map()[1]
+        if estimator is None:
+            estimator = self.estimate_runtime
+        lengths = {}
+        in_progress = set()
+        for root in self.processes:
+            if root in lengths:
+                continue
+            # Iterative post-order traversal, to avoid recursion limits
+            # on long chains.
+            stack = [(root, False)]
+            while stack:
+                (proc, expanded) = stack.pop()
+                if expanded:
+                    in_progress.discard(proc)
+                    longest = 0.0
+                    for child in children[proc]:
+                        longest = max(longest, lengths.get(child, 0.0))
+                    if proc.state in FINISHED_STATES:
+                        own = 0.0
+                    else:
+                        own = estimator(proc)
+                    lengths[proc] = own + longest
+                    continue
+                if proc in lengths or proc in in_progress:
+                    continue  # Already done or part of a cycle
+                in_progress.add(proc)
+                stack.append((proc, True))
+                for child in children[proc]:
+                    if child not in lengths and child not in in_progress:
+                        stack.append((child, False))
+        return lengths
+
+    def assign_levels(self, parents=None, children=None):
+        """
+        Sets the topological level of every process, using Kahn's
+         algorithm. Processes that are part of, or depend on, a cycle are
+         never reached and get no level.
+
+        @param parents: Optional parent map from dependency_map
+        @type parents: dict
+        @param children: Optional child map from dependency_map
+        @type children: dict
+        @return: Processes that were not reached
+        @rtype: set
+        """
+        if parents is None or children is None:
+            (parents, children) = self.dependency_map()
+        in_degree = dict((proc, len(parents[proc])) for proc in self.processes)
+        for proc in self.processes:
+            proc.level = None
+        queue = [proc for proc in self.processes if not in_degree[proc]]
+        for proc in queue:
+            proc.level = 0
+        # The queue grows while it is read.
+        for proc in queue:
+            for child in children[proc]:
+                child.level = max(child.level or 0, proc.level + 1)
+                in_degree[child] -= 1
+                if not in_degree[child]:
+                    queue.append(child)
+        unsorted = set(proc for proc in self.processes if in_degree[proc])
+        for proc in unsorted:
+            proc.level = None
+        return unsorted
+
+    def validate(self, check_files=True):
+        """
+        Checks the dependencies of the DAG in linear time and sets the
+         topological level of every process (see assign_levels).
+         Processes that are never reached by the topological sort are
+         part of, or depend on, a cycle.
+
+        gsub validates new DAGs and the shell engine validates the DAG when
+         it starts. Loading a DAG does not, so that readers stay fast.
+
+        The result contains:
+         - "cycles": Lists of processes that depend on each other, in DAG
+           order.
+         - "orphan_inputs": Dict mapping waiting processes to their input
+           files that no process produces and that do not exist.
+         - "dead_ends": Processes, other than those in cycles, that can
+           never start because they depend on a cycle or on a missing
+           input file.
+
+        @param check_files: Whether or not input files are checked for
+         orphans. Default: True
+        @type check_files: bool
+        @return: Dict of problems found
+        @rtype: dict
+        """
+        import os.path as OP
+
+        (parents, children) = self.dependency_map()
+        unsorted = self.assign_levels(parents, children)
+        order = dict((proc, index)
+                     for (index, proc) in enumerate(self.processes))
+        cycles = []
+        for component in strongly_connected(unsorted, children):
+            if len(component) > 1 or component[0] in children[component[0]]:
+                cycles.append(sorted(component, key=order.get))
+        cycles.sort(key=lambda cycle: order[cycle[0]])
+
+        orphan_inputs = {}
+        if check_files:
+            for proc in self.get_processes_by_state(WAITING_STATES):
+                missing = [f for f in proc.input_files
+                           if not self.graph.get(f)
+                           and not OP.isfile(f.full_path())]
+                if missing:
+                    orphan_inputs[proc] = missing
+
+        in_cycle = set(proc for cycle in cycles for proc in cycle)
+        blocked = set()
+        stack = list(in_cycle) + list(orphan_inputs)
+        while stack:
+            for child in children[stack.pop()]:
+                if child not in blocked:
+                    blocked.add(child)
+                    stack.append(child)
+        dead_ends = sorted(blocked - in_cycle, key=order.get)
+        return {"cycles": cycles, "orphan_inputs": orphan_inputs,
+                "dead_ends": dead_ends}
+
     def generate_runnable_list(self):
-        runnable = self.get_processes_by_state((States.CREATED, States.STAGED))
-        not_runnable = []
-        for process in runnable:
-            if self.incomplete_prereqs(process):
-                not_runnable.append(process)
-        for stalled in not_runnable:
-            runnable.remove(stalled)
+        """
+        Returns the processes whose prerequisites are met, in the order
+         in which they should be started. Processes with a higher priority
+         come first. Among equal priorities, processes on the longest
+         critical path come first, followed by those requesting the most
+         cores and memory, and then those at the lowest topological level
+         (see DAG.validate).
+
+        If the DAG is incremental, runnable processes that are up to date
+         are marked SUCCESS instead of being returned. Only the children
+         of skipped processes are then checked in turn, so that a long
+         chain of up to date processes is skipped in linear time.
+
+        Failed processes with retries left are first re-queued
+         (see dag.retry.requeue_failures).
+
+        @return: Runnable processes
+        @rtype: list
+        """
+        from dag.filecache import get_file_cache
+        from dag.retry import requeue_failures
+
+        requeue_failures(self)
+        (parents, children) = self.dependency_map()
+        file_cache = get_file_cache()
+        file_cache.refresh()
+
+        def find_runnable():
+            return [process for process
+                    in self.get_processes_by_state((States.CREATED,
+                                                    States.STAGED))
+                    if not self.incomplete_prereqs(process, parents,
+                                                   file_cache)]
+
+        runnable = find_runnable()
+        if getattr(self, "incremental", True):
+            from dag.fingerprint import skip_up_to_date
+            seen = set(runnable)
+            pending = runnable
+            runnable = []
+            while pending:
+                skipped = set(skip_up_to_date(self, pending))
+                runnable.extend([proc for proc in pending
+                                 if proc not in skipped])
+                # Only children of skipped processes may have become ready.
+                pending = []
+                for proc in skipped:
+                    for child in children[proc]:
+                        if (child not in seen
+                                and child.state in (States.CREATED,
+                                                    States.STAGED)
+                                and not self.incomplete_prereqs(
+                                    child, parents, file_cache)):
+                            seen.add(child)
+                            pending.append(child)
+        if len(runnable) > 1:
+            # Levels are missing from DAGs saved before they were kept and
+            # from processes added since the last validation.
+            if any([getattr(proc, "level", None) is None
+                    for proc in runnable]):
+                self.assign_levels(parents, children)
+            lengths = self.critical_path_lengths(children)
+            runnable.sort(key=lambda proc: (getattr(proc, "priority", 0),
+                                            lengths.get(proc, 0.0),
+                                            getattr(proc, "cores", 1),
+                                            getattr(proc, "memory", 0),
+                                            -(getattr(proc, "level", 0)
+                                              or 0)),
+                          reverse=True)
         return runnable
 
-    def __str__(self):
-        import os.path as OP
-        from sys import stderr
+    def process_report(self, proc, parents=None):
+        """
+        Creates the report of one process that is used by DAG.__str__.
+
+        @param proc: Process to be reported
+        @type proc: dag.Process
+        @param parents: Optional parent map from dependency_map
+        @type parents: dict
+        @return: Report of the process
+        @rtype: str
+        """
+        lines = ["------------", str(proc)]
+        if getattr(proc, "retries", 0):
+            lines.append("Retries: %d of %d"
+                         % (getattr(proc, "attempts", 0), proc.retries))
+        if (proc.state == States.FAIL
+                and getattr(proc, "failure_reason", None)):
+            lines.append("Failure reason: %s" % proc.failure_reason)
+        for f in proc.input_files:
+            if f in self.graph:
+                lines.append("Depends on: %s"
+                             % ",".join([i.cmd for i in self.graph[f]]))
+
+        proc_prereqs = self.incomplete_prereqs(proc, parents)
+        if proc_prereqs:
+            lines.append("Unfinished Dependencies")
+            for i in proc_prereqs:
+                if isinstance(i, File):
+                    lines.append("File: %s" % i.logical_name)
+                elif isinstance(i, GridProcess):
+                    lines.append("Process: %s" % i.workunit_name)
+                elif isinstance(i, InternalProcess):
+                    lines.append("Python Code")
+                else:
+                    lines.append("%s" % i)
+        return "\n".join(lines) + "\n\n\n"
+
+    def report(self, processes=None):
+        """
+        Generates the report of DAG.__str__ one process at a time, so that
+         the report of a large DAG may be written as it is produced.
+
+        @param processes: Optional iterable of the processes to be
+         reported. Default: all processes
+        @type processes: iterable
+        @return: Generator of report strings
+        @rtype: generator
+        """
         if self.is_empty():
-            return "Empty"
-        retval = ""
-        for proc in self.processes:
-            retval += "------------\n"
-            retval += str(proc) + "\n"
-            for f in proc.input_files:
-                    if f in self.graph.keys():
-                        retval += ("Depends on: %s\n"
-                                   % ",".join([i.cmd for i in self.graph[f]]))
-
-            proc_prereqs = self.incomplete_prereqs(proc)
-            if proc_prereqs:
-                retval += "Unfinished Dependencies\n"
-                for i in proc_prereqs:
-                    if isinstance(i, File):
-                        retval += "File: %s\n" % i.logical_name
-                    elif isinstance(i, GridProcess):
-                        retval += "Process: %s\n" % i.workunit_name
-                    elif isinstance(i, InternalProcess):
-                        retval += "Python Code\n"
-                    else:
-                        retval += "%s\n" % i
-            retval += "\n\n"
-        return retval
+            yield "Empty"
+            return
+        parents = self.dependency_map()[0]
+        if processes is None:
+            processes = self.processes
+        for proc in processes:
+            yield self.process_report(proc, parents)
+
+    def __str__(self):
+        return "".join(self.report())
 
 
 def load(pickle_filename=None):
     """
     Loads a DAG object saved in a file.
 
+    No lock is taken. DAG.save replaces the file by renaming a complete
+    snapshot over it, so the file that is opened is always whole, even
+    while another process is saving.
+
     @param pickle_filename: File name
     @type pickle_filename: str
     @return: DAG object
@@ -638,24 +1277,109 @@ def load(pickle_filename=None):
     """
 
     import cPickle
-    import types
-    import lockfile
 
     if not pickle_filename:
         pickle_filename = DEFAULT_DAGFILE_NAME
 
-    lock = lockfile.FileLock(pickle_filename)
+    with open(pickle_filename, "rb") as infile:
+        the_dag = cPickle.load(infile)
+        if not isinstance(the_dag, DAG):  # Version, followed by the DAG
+            version = the_dag
+            the_dag = cPickle.load(infile)
+            the_dag.version = version
+    return the_dag
+
+
+def read_version(pickle_filename):
+    """
+    Reads the version of a saved DAG, without loading the DAG.
+
+    @param pickle_filename: File name
+    @type pickle_filename: str
+    @return: Version, or None if the file does not exist or was saved
+     before versions were written ahead of the DAG
+    @rtype: int
+    """
+    import cPickle
     try:
-        lock.acquire(timeout=10)
-    except lockfile.LockTimeout:
-        raise DagException("Error saving DAG. DAG file %s is locked."
-                           % pickle_filename)
-
-    infile = open(pickle_filename, "rb")
-    retval = cPickle.load(infile)
-    infile.close()
-    lock.release()
-    return retval
+        with open(pickle_filename, "rb") as infile:
+            version = cPickle.load(infile)
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        return None
+    if isinstance(version, DAG):
+        return None
+    return version
+
+
+def strongly_connected(nodes, children):
+    """
+    Finds the strongly connected components of part of a graph, using an
+    iterative form of Tarjan's algorithm so that long chains do not reach
+    the recursion limit.
+
+    @param nodes: Nodes to be searched. Edges to other nodes are ignored.
+    @type nodes: set
+    @param children: Child map, e.g. from DAG.dependency_map
+    @type children: dict
+    @return: List of components, each a list of nodes
+    @rtype: list
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(children[root]))]
+        while work:
+            (node, remaining) = work[-1]
+            descended = False
+            for child in remaining:
+                if child not in nodes:
+                    continue
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(children[child])))
+                    descended = True
+                    break
+                if child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            if descended:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member is node:
+                        break
+                components.append(component)
+    return components
+
+
+def format_cycles(cycles):
+    """
+    Describes dependency cycles for error messages.
+
+    @param cycles: Cycles from DAG.validate
+    @type cycles: list
+    @rtype: str
+    """
+    return ", ".join(["[%s]" % ", ".join([str(proc.workunit_name)
+                                          for proc in cycle])
+                      for cycle in cycles])
 
 
 def make_file_list(files):
@@ -0,0 +1,687 @@
+"""
+dag.agent
+=========
+
+@author: David Coss, PhD
+@date: October 19, 2026
+@license: GPL version 3 (see COPYING or
+ http://www.gnu.org/licenses/gpl.html for details)
+
+Worker agents for the SHELL engine. Agents run on other hosts, or as
+extra local processes, connect to the master over TCP, advertise their
+cores and memory and run the shell processes the master sends them.
+The master is the shell engine loop in dag.shell.create_work, which
+listens for agents when the DAG has an agent address (see "gsub --agents").
+
+Messages are JSON objects, one per line (NDJSON). Agents send "hello",
+"heartbeat" and "finished" messages. The master sends "run", "kill" and
+"shutdown" messages. An agent that has not been heard from for
+HEARTBEAT_TIMEOUT seconds is considered lost and its processes are
+returned to the CREATED state, so that they are started again elsewhere.
+
+Agents run commands in the working directory of the master, which must
+therefore be on a filesystem shared by the hosts.
+
+Anyone who can talk to the master as an agent can run commands there, so
+the master and its agents share a token, taken from the environment
+variable DAG_AGENT_TOKEN. The "hello" message of an agent must carry the
+token, or the master drops the connection, and nothing is sent to an
+agent before its "hello". The token is sent in the clear, so the master
+should listen on a private interface, e.g. that of a cluster network,
+rather than one reachable from outside.
+"""
+import logging
+
+L = logging.getLogger("dag.agent")
+
+DEFAULT_AGENT_PORT = 7714
+# Seconds between heartbeats sent by agents
+HEARTBEAT_PERIOD = 10
+# Seconds of silence after which an agent is considered lost
+HEARTBEAT_TIMEOUT = 60
+# Seconds an agent waits before reconnecting to the master
+RECONNECT_PERIOD = 10
+# Environment variable holding the token shared by the master and agents
+TOKEN_VARIABLE = "DAG_AGENT_TOKEN"
+
+
+def get_token():
+    """
+    Returns the token shared by the master and its agents.
+
+    @return: Token
+    @rtype: str
+    @raise dag.DagException: If TOKEN_VARIABLE is not set
+    """
+    import os
+    from dag import DagException
+    token = os.environ.get(TOKEN_VARIABLE)
+    if not token:
+        raise DagException("Agents need a shared token. Set %s to the same"
+                           " secret for the master and its agents."
+                           % TOKEN_VARIABLE)
+    return token
+
+
+def check_token(token, expected):
+    """
+    Compares a token with the expected one in constant time.
+
+    @rtype: bool
+    """
+    import hmac
+    if not isinstance(token, basestring):
+        return False
+    if isinstance(token, unicode):
+        token = token.encode("utf-8")
+    if isinstance(expected, unicode):
+        expected = expected.encode("utf-8")
+    return hmac.compare_digest(token, expected)
+
+
+def parse_address(address):
+    """
+    Splits an address of the form HOST:PORT. If the port is omitted,
+    DEFAULT_AGENT_PORT is used.
+
+    @param address: Address string
+    @type address: str
+    @return: Host and port
+    @rtype: tuple
+    @raise dag.DagException: If the port is not a number
+    """
+    from dag import DagException
+    (host, _, port) = address.rpartition(":")
+    if not host:
+        return (port or "", DEFAULT_AGENT_PORT)
+    try:
+        return (host, int(port))
+    except ValueError:
+        raise DagException("Invalid agent address: %s" % address)
+
+
+class Connection(object):
+    """
+    Line oriented JSON messages over a socket.
+
+    @ivar sock: Connected socket
+    @type sock: socket.socket
+    @ivar last_heard: Epoch time at which data was last received
+    @type last_heard: float
+    """
+    def __init__(self, sock):
+        import time
+        self.sock = sock
+        self.sock.setblocking(0)
+        self.inbuf = b""
+        self.last_heard = time.time()
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, message):
+        """
+        Sends a message. The connection is closed if it fails.
+
+        @param message: Message
+        @type message: dict
+        @return: Whether or not the message was sent
+        @rtype: bool
+        """
+        import json
+        import socket
+        if self.closed:
+            return False
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        try:
+            self.sock.setblocking(1)
+            self.sock.sendall(data)
+            self.sock.setblocking(0)
+        except socket.error as e:
+            L.debug("Could not send to %s: %s" % (self.fileno(), e))
+            self.close()
+            return False
+        return True
+
+    def read_messages(self):
+        """
+        Reads the complete messages available, without blocking.
+
+        @return: Messages
+        @rtype: list
+        """
+        import errno
+        import json
+        import socket
+        import time
+        while not self.closed:
+            try:
+                data = self.sock.recv(64 * 1024)
+            except socket.error as e:
+                if e.args[0] in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    break
+                self.close()
+                break
+            if not data:
+                self.close()
+                break
+            self.inbuf += data
+            self.last_heard = time.time()
+        messages = []
+        while b"\n" in self.inbuf:
+            (line, self.inbuf) = self.inbuf.split(b"\n", 1)
+            if not line.strip():
+                continue
+            try:
+                messages.append(json.loads(line.decode("utf-8")))
+            except ValueError:
+                L.warning("Ignoring invalid message: %r" % line[0:80])
+        return messages
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.sock.close()
+            except Exception:
+                pass
+
+
+class RemoteAgent(object):
+    """
+    Master side record of a connected agent.
+
+    @ivar name: Name given by the agent, usually its host name
+    @type name: str
+    @ivar cores: Cores advertised by the agent
+    @type cores: int
+    @ivar memory: Bytes of memory advertised by the agent, or None
+    @type memory: int
+    @ivar running: Names of the workunits running on the agent
+    @type running: dict
+    @ivar authenticated: Whether or not the agent sent a valid "hello"
+    @type authenticated: bool
+    """
+    def __init__(self, connection, address):
+        self.connection = connection
+        self.name = "%s:%d" % address[0:2]
+        self.authenticated = False
+        self.cores = 0
+        self.memory = None
+        self.running = {}  # workunit name -> (cores, bytes of memory)
+
+    def free_resources(self):
+        """
+        @return: Free cores and bytes of memory
+        @rtype: tuple
+        """
+        free_cores = self.cores
+        free_memory = self.memory
+        for (cores, memory) in self.running.values():
+            free_cores -= cores
+            if free_memory is not None:
+                free_memory -= memory
+        return (free_cores, free_memory)
+
+
+class AgentServer(object):
+    """
+    Master side of the agent protocol. The shell engine loop calls poll and
+    dispatch on every pass.
+
+    @ivar root_dag: DAG whose processes are run
+    @type root_dag: dag.DAG
+    @ivar agents: Connected agents
+    @type agents: list
+    @ivar assignments: Agent running each workunit, by workunit name
+    @type assignments: dict
+    """
+    def __init__(self, root_dag, address, token=None):
+        """
+        @param root_dag: DAG whose processes are run
+        @type root_dag: dag.DAG
+        @param address: HOST:PORT on which to listen. HOST should be a
+         private interface (see the module documentation)
+        @type address: str
+        @param token: Token that agents must send. Default: get_token()
+        @type token: str
+        @raise dag.DagException: If there is no token
+        """
+        import os
+        import socket
+        self.root_dag = root_dag
+        self.token = token or get_token()
+        (host, port) = parse_address(address)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(16)
+        self.listener.setblocking(0)
+        self.agents = []
+        self.assignments = {}
+        self.cwd = os.getcwd()
+        L.info("Listening for agents on %s:%d" % (host, port))
+
+    def accept(self):
+        import errno
+        import socket
+        while True:
+            try:
+                (sock, address) = self.listener.accept()
+            except socket.error as e:
+                if e.args[0] in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    return
+                raise
+            L.debug("Agent connected from %s:%d" % address[0:2])
+            self.agents.append(RemoteAgent(Connection(sock), address))
+
+    def poll(self, timeout=0):
+        """
+        Accepts new agents, handles their messages and removes agents that
+        disconnected or stopped sending heartbeats.
+
+        @param timeout: Seconds to wait for activity
+        @type timeout: float
+        @return: Processes that finished
+        @rtype: list
+        """
+        import select
+        import time
+        try:
+            select.select([self.listener] + [a.connection for a in self.agents],
+                          [], [], timeout)
+        except select.error:
+            pass
+        self.accept()
+        finished = []
+        now = time.time()
+        for agent in list(self.agents):
+            for message in agent.connection.read_messages():
+                proc = self.handle(agent, message)
+                if proc is not None:
+                    finished.append(proc)
+            if agent.connection.closed:
+                L.warning("Lost agent %s" % agent.name)
+                self.remove(agent)
+            elif now - agent.connection.last_heard > HEARTBEAT_TIMEOUT:
+                L.warning("Agent %s missed its heartbeats" % agent.name)
+                self.remove(agent)
+        return finished
+
+    def handle(self, agent, message):
+        """
+        Acts on a message from an agent.
+
+        @return: Process that finished, if any
+        @rtype: dag.Process
+        """
+        from dag import States
+        from dag.shell import get_process
+        kind = message.get("type")
+        if not agent.authenticated:
+            if kind != "hello" or not check_token(message.get("token"),
+                                                  self.token):
+                L.warning("Rejecting agent %s, which did not send the token"
+                          % agent.name)
+                agent.connection.close()
+                return None
+            agent.authenticated = True
+        if kind == "hello":
+            agent.name = message.get("name", agent.name)
+            agent.cores = int(message.get("cores", 1))
+            agent.memory = message.get("memory")
+            L.info("Agent %s offers %d cores" % (agent.name, agent.cores))
+        elif kind == "finished":
+            wuname = message.get("workunit_name")
+            agent.running.pop(wuname, None)
+            if self.assignments.get(wuname) is not agent:
+                return None
+            del self.assignments[wuname]
+            proc = get_process(self.root_dag, wuname)
+            if proc is None:
+                return None
+            exit_code = message.get("exit_code")
+            proc.failure_reason = message.get("failure_reason")
+            if exit_code == 0 and not proc.failure_reason:
+                proc.state = States.SUCCESS
+            else:
+                proc.state = States.FAIL
+            proc.end_time = message.get("end_time")
+            self.record(proc, message)
+            return proc
+        elif kind != "heartbeat":
+            L.debug("Unknown message from %s: %s" % (agent.name, kind))
+        return None
+
+    def record(self, proc, message):
+        """
+        Adds a finished run reported by an agent to the run history and
+        fingerprints the process if it succeeded.
+        """
+        from dag import States
+        from dag.fingerprint import record
+        from dag.history import get_history
+        history_filename = getattr(self.root_dag, "history_filename", None)
+        get_history(history_filename).record(
+            proc, message.get("start_time"), message.get("end_time"),
+            message.get("exit_code"), message.get("max_rss"),
+            message.get("cpu_time"))
+        if proc.state == States.SUCCESS:
+            record(proc, history_filename)
+
+    def remove(self, agent):
+        """
+        Disconnects an agent and returns its processes to the CREATED state.
+        """
+        from dag import States
+        from dag.shell import get_process
+        agent.connection.close()
+        if agent in self.agents:
+            self.agents.remove(agent)
+        for wuname in list(agent.running):
+            self.assignments.pop(wuname, None)
+            proc = get_process(self.root_dag, wuname)
+            if proc is not None and proc.state == States.RUNNING:
+                L.info("Re-queueing %s" % wuname)
+                proc.state = States.CREATED
+        agent.running = {}
+
+    def dispatch(self, runnable):
+        """
+        Sends runnable processes to agents with free resources.
+
+        @param runnable: Processes that are ready, in dispatch order
+        @type runnable: list
+        @return: Processes that were sent to agents
+        @rtype: list
+        """
+        import time
+        from dag import States
+        from dag.shell import (limit_settings, pack_processes,
+                               resource_request, SweepInstance,
+                               sweep_instances)
+        started = []
+        remaining = list(runnable)
+        for agent in self.agents:
+            if not remaining or agent.cores <= 0:
+                continue
+            (free_cores, free_memory) = agent.free_resources()
+            for proc in pack_processes(remaining, free_cores, free_memory,
+                                       agent.cores, agent.memory):
+                message = {"type": "run",
+                           "workunit_name": proc.workunit_name,
+                           "cmd": proc.cmd,
+                           "args": proc.args,
+                           "nice": getattr(proc, "nice", 0),
+                           "cwd": self.cwd,
+                           "log_store": getattr(self.root_dag, "log_store",
+                                                None)}
+                message.update(limit_settings(proc))
+                if not agent.connection.send(message):
+                    break
+                agent.running[proc.workunit_name] = resource_request(
+                    proc, agent.cores, agent.memory)
+                self.assignments[proc.workunit_name] = agent
+                if isinstance(proc, SweepInstance):
+                    sweep_instances[proc.workunit_name] = proc
+                proc.state = States.RUNNING
+                proc.start_time = time.time()
+                remaining.remove(proc)
+                started.append(proc)
+        return started
+
+    def free_cores(self):
+        """
+        @return: Number of cores not in use on all agents
+        @rtype: int
+        """
+        return sum([max(agent.free_resources()[0], 0)
+                    for agent in self.agents])
+
+    def cancel(self, proc):
+        """
+        Asks the agent running a process to stop it.
+
+        @return: Whether or not the process was running on an agent
+        @rtype: bool
+        """
+        agent = self.assignments.get(proc.workunit_name)
+        if agent is None:
+            return False
+        agent.connection.send({"type": "kill",
+                               "workunit_name": proc.workunit_name})
+        return True
+
+    def close(self):
+        """
+        Stops the processes running on agents and disconnects them.
+        """
+        for agent in self.agents:
+            agent.connection.send({"type": "shutdown"})
+            agent.connection.close()
+        self.agents = []
+        self.assignments = {}
+        self.listener.close()
+
+
+class AgentProcess(object):
+    """
+    Agent side record of a running command. The limits in the "run"
+    message are enforced as the shell engine does (see dag.shell.ShellProcess).
+
+    @ivar failure_reason: Limit that stopped the command, if any
+    @type failure_reason: str
+    """
+    def __init__(self, message):
+        import os
+        import subprocess
+        import time
+        from dag.logstore import open_outputs, close_outputs
+        from dag.shell import resource_limits, set_resource_limits
+        self.workunit_name = message["workunit_name"]
+        cwd = message.get("cwd") or os.getcwd()
+        nice = message.get("nice", 0)
+        self.cpu_limit = message.get("cpu_limit")
+        limits = resource_limits(self.cpu_limit, message.get("memory_limit"))
+
+        def prepare_child():
+            # The command leads a process group, so that kill reaches
+            # everything it starts.
+            os.setpgid(0, 0)
+            if nice:
+                os.nice(nice)
+            set_resource_limits(limits)
+
+        # Output files are closed when the command has finished, so that
+        # output may then be appended to the log store (see dag.logstore).
+        self.log_store = message.get("log_store")
+        self.outputs = open_outputs(self.workunit_name, self.log_store, cwd)
+        self.start_time = time.time()
+        self.kill_time = None  # Time after which SIGKILL is sent
+        self.deadline = message.get("deadline")
+        self.failure_reason = None
+        try:
+            self.popen = subprocess.Popen([message["cmd"]] + message["args"],
+                                          cwd=cwd, close_fds=True,
+                                          preexec_fn=prepare_child,
+                                          stdout=self.outputs[0],
+                                          stderr=self.outputs[1])
+        except OSError:
+            close_outputs(self.workunit_name, self.outputs)
+            raise
+
+    def poll(self):
+        """
+        Checks whether the command has finished.
+
+        @return: "finished" message, or None if it is still running
+        @rtype: dict
+        """
+        import os
+        import signal
+        import time
+        from dag.logstore import close_outputs
+        from dag.shell import (limit_failure, signal_group,
+                               status_to_returncode, REASON_DEADLINE)
+        now = time.time()
+        if self.kill_time is not None and now > self.kill_time:
+            signal_group(self.popen.pid, signal.SIGKILL)
+            self.kill_time = None
+        elif (self.deadline and self.failure_reason is None
+                and now > self.start_time + self.deadline):
+            L.info("%s passed its deadline of %d seconds"
+                   % (self.workunit_name, self.deadline))
+            self.failure_reason = REASON_DEADLINE
+            self.kill()
+        (pid, status, rusage) = os.wait4(self.popen.pid, os.WNOHANG)
+        if not pid:
+            return None
+        if self.kill_time is not None:
+            # Processes left in the group of a killed command
+            signal_group(self.popen.pid, signal.SIGKILL)
+        close_outputs(self.workunit_name, self.outputs, self.log_store)
+        if self.failure_reason is None:
+            self.failure_reason = limit_failure(status, rusage,
+                                                self.cpu_limit)
+        return {"type": "finished",
+                "workunit_name": self.workunit_name,
+                "exit_code": status_to_returncode(status),
+                "failure_reason": self.failure_reason,
+                "start_time": self.start_time,
+                "end_time": time.time(),
+                "max_rss": rusage.ru_maxrss * 1024,
+                "cpu_time": rusage.ru_utime + rusage.ru_stime}
+
+    def kill(self):
+        """
+        Sends SIGTERM to the process group of the command. poll sends
+        SIGKILL if it has not stopped after the grace period.
+        """
+        import signal
+        import time
+        from dag.shell import CANCEL_GRACE_PERIOD, signal_group
+        if self.kill_time is None:
+            self.kill_time = time.time() + CANCEL_GRACE_PERIOD
+        signal_group(self.popen.pid, signal.SIGTERM)
+
+    def wait(self):
+        """
+        Waits for the command to stop.
+        """
+        import time
+        while self.poll() is None:
+            time.sleep(0.1)
+
+
+def serve(connection, cores, memory, name, token):
+    """
+    Runs the commands sent by the master on one connection, until the
+    connection is lost or the master sends "shutdown".
+
+    @return: Whether or not the master asked the agent to shut down
+    @rtype: bool
+    """
+    import select
+    import time
+    running = {}
+    connection.send({"type": "hello", "name": name, "cores": cores,
+                     "memory": memory, "token": token})
+    last_heartbeat = time.time()
+    shutdown = False
+    try:
+        while not connection.closed and not shutdown:
+            try:
+                select.select([connection], [], [], 1)
+            except select.error:
+                pass
+            for message in connection.read_messages():
+                kind = message.get("type")
+                if kind == "run":
+                    L.info("Starting %s" % message["workunit_name"])
+                    try:
+                        proc = AgentProcess(message)
+                    except (OSError, IOError) as e:
+                        L.warning("Could not start %s: %s"
+                                  % (message["workunit_name"], e))
+                        connection.send({"type": "finished",
+                                         "workunit_name":
+                                         message["workunit_name"],
+                                         "exit_code": 127,
+                                         "start_time": time.time(),
+                                         "end_time": time.time()})
+                        continue
+                    running[proc.workunit_name] = proc
+                elif kind == "kill":
+                    proc = running.get(message.get("workunit_name"))
+                    if proc is not None:
+                        proc.kill()
+                elif kind == "shutdown":
+                    shutdown = True
+            for (wuname, proc) in list(running.items()):
+                result = proc.poll()
+                if result is not None:
+                    del running[wuname]
+                    L.info("%s finished with exit code %d"
+                           % (wuname, result["exit_code"]))
+                    connection.send(result)
+            if time.time() - last_heartbeat >= HEARTBEAT_PERIOD:
+                connection.send({"type": "heartbeat",
+                                 "running": sorted(running)})
+                last_heartbeat = time.time()
+    finally:
+        # The master re-queues the processes of a lost agent.
+        for proc in running.values():
+            proc.kill()
+        for proc in running.values():
+            proc.wait()
+    return shutdown
+
+
+def run_agent(address, cores=1, memory=None, name=None, reconnect=True,
+              token=None):
+    """
+    Connects to a master and runs the processes it sends. If the
+    connection is lost, the agent reconnects, unless reconnect is False.
+
+    @param address: Address of the master, HOST:PORT
+    @type address: str
+    @param cores: Number of cores offered to the master
+    @type cores: int
+    @param memory: Bytes of memory offered. Default: physical memory
+    @type memory: int
+    @param name: Name of the agent. Default: host name and PID
+    @type name: str
+    @param reconnect: Whether or not to reconnect after losing the master
+    @type reconnect: bool
+    @param token: Token shared with the master. Default: get_token()
+    @type token: str
+    @raise dag.DagException: If there is no token
+    """
+    import os
+    import socket
+    import time
+    from dag.shell import get_physical_memory
+
+    (host, port) = parse_address(address)
+    if not token:
+        token = get_token()
+    if memory is None:
+        memory = get_physical_memory()
+    if name is None:
+        name = "%s-%d" % (socket.gethostname(), os.getpid())
+    while True:
+        try:
+            sock = socket.create_connection((host, port))
+        except socket.error as e:
+            if not reconnect:
+                raise
+            L.info("Could not connect to %s:%d: %s" % (host, port, e))
+            time.sleep(RECONNECT_PERIOD)
+            continue
+        L.info("Connected to %s:%d" % (host, port))
+        if (serve(Connection(sock), cores, memory, name, token)
+                or not reconnect):
+            return
+        L.info("Lost master %s:%d" % (host, port))
+        time.sleep(RECONNECT_PERIOD)
@@ -350,6 +350,12 @@ def create_work(the_dag, dagfile, show_progress=False):
 
     Sets the workunit information in the dag.Process objects
 
+    Failed processes with retries left are submitted again at once,
+     since BOINC cannot delay the start of a workunit (see dag.retry).
+     Since BOINC workunit names must be unique, each retry gets a new
+     UUID. Processes whose pool is
+     full are left for a later call (see dag.pools).
+
     @type the_dag: dag.DAG
     @param dagfile: Path to DAG file
     @type dagfile: str
@@ -358,8 +364,11 @@ def create_work(the_dag, dagfile, show_progress=False):
     """
     import os.path as OP
     import random
+    import uuid
     import dag
     import stat
+    from dag.pools import admit, pool_usage
+    from dag.retry import requeue_failures
 
     progress_bar = None
     progress_bar_counter = 0
@@ -367,6 +376,10 @@ def create_work(the_dag, dagfile, show_progress=False):
     if the_dag.processes is None:
         return
 
+    for proc in requeue_failures(the_dag, wait=False)[1]:
+        proc.uuid = uuid.uuid4()
+    usage = pool_usage(the_dag)
+
     if show_progress:
         from progressbar import ProgressBar, Percentage, Bar
         progress_bar = ProgressBar(widgets=[Percentage(), Bar()],
@@ -411,6 +424,9 @@ def create_work(the_dag, dagfile, show_progress=False):
                 print("%s (%s)" % (i.physical_name, i.logical_name))
             raise dag.DagException("Missing File")
 
+        # Processes whose pool is full (see dag.pools) wait for the next
+        # call, once a running member of the pool has ended.
+        defer = not admit(the_dag, [proc], usage)
         if defer:
             continue
 
@@ -429,6 +445,8 @@ def create_work(the_dag, dagfile, show_progress=False):
                 proc.state = dag.States.FAIL
                 the_dag.save()
                 raise e
+            from dag.fingerprint import record
+            record(proc, getattr(the_dag, "history_filename", None))
 
         the_dag.save()
 
@@ -0,0 +1,464 @@
+"""
+dag.bundle
+==========
+
+@author: David Coss, PhD
+@date: October 19, 2026
+@license: GPL version 3 (see COPYING or
+ http://www.gnu.org/licenses/gpl.html for details)
+
+Bundling of short processes. Every process pays the overhead of its
+engine: a fork for SHELL, a bsub and a notifier job for LSF. Runnable
+processes are independent of each other, so short ones with the same
+resource requirements may be grouped into a bundle, whose estimated
+duration is close to a target, and run one after another as one job.
+
+Linear chains of processes, A -> B -> C, where each process is the only
+child of the one before it and has no other parent, may likewise be
+fused into one job. The steps run in sequence and the job stops at the
+first step that fails, so no step waits for a scheduler round trip
+after its parent.
+
+The members of a bundle or chain are described in a manifest file,
+which the runner in this module executes, along with the deadline and
+CPU and memory limits of each member. The runner writes one JSON line per
+member, with its exit code, failure reason and times, to a results file.
+apply_results then sets the state of each member in the DAG.
+
+Bundling is enabled with "gsub --bundle SECONDS" and fusion with
+"gsub --fuse". BOINC workunits run only the application of their
+project, so BOINC processes are never bundled or fused.
+
+Runner usage: python -m dag.bundle <manifest> <results>
+"""
+import logging
+
+L = logging.getLogger("dag.bundle")
+
+# Target duration, in seconds, of a bundle
+DEFAULT_BUNDLE_DURATION = 300
+
+
+def bundle_key(proc):
+    """
+    Returns the requirements of a process that must match for processes
+    to share a bundle.
+
+    @rtype: tuple
+    """
+    return (type(proc).__name__,
+            getattr(proc, "cores", 1),
+            getattr(proc, "memory", 0),
+            getattr(proc, "nice", 0),
+            getattr(proc, "rsc_memory_bound", None),
+            getattr(proc, "project_name", None),
+            getattr(proc, "app_profile", None),
+            getattr(proc, "host", None))
+
+
+def can_bundle(proc):
+    """
+    Determines whether or not a process may be run by the bundle runner.
+    Python code, sweeps and processes that watch local PIDs may not.
+
+    @rtype: bool
+    """
+    from dag import InternalProcess
+    from dag.shell import SweepProcess, Waiter
+    return not isinstance(proc, (InternalProcess, SweepProcess, Waiter))
+
+
+def make_bundles(root_dag, runnable, target_duration, slots=1):
+    """
+    Groups runnable processes into bundles. Processes whose estimated
+    runtime is less than the target duration are grouped with processes
+    of the same requirements, in the given order, until the estimated
+    duration of the bundle reaches the target. So that bundling never
+    leaves slots idle, a group of n processes is split into at least
+    "slots" bundles, where possible.
+
+    @param root_dag: DAG, used for runtime estimates
+    @type root_dag: dag.DAG
+    @param runnable: Runnable processes, in dispatch order
+    @type runnable: list
+    @param target_duration: Target duration of a bundle in seconds
+    @type target_duration: float
+    @param slots: Number of bundles that may run at once
+    @type slots: int
+    @return: Lists of processes, in dispatch order. Processes that are
+     not bundled are in lists of their own.
+    @rtype: list
+    """
+    units = []
+    groups = {}  # requirements -> processes
+    for proc in runnable:
+        if (not can_bundle(proc)
+                or root_dag.estimate_runtime(proc) >= target_duration):
+            units.append([proc])
+            continue
+        key = bundle_key(proc)
+        if key not in groups:
+            groups[key] = []
+            units.append(groups[key])  # Placeholder in dispatch order
+        groups[key].append(proc)
+
+    bundles = []
+    for unit in units:
+        if len(unit) == 1:
+            bundles.append(unit)
+            continue
+        max_members = max(1, -(-len(unit) // max(slots, 1)))
+        bundle = []
+        duration = 0.0
+        for proc in unit:
+            estimate = root_dag.estimate_runtime(proc)
+            if bundle and (duration + estimate > target_duration
+                           or len(bundle) >= max_members):
+                bundles.append(bundle)
+                bundle = []
+                duration = 0.0
+            bundle.append(proc)
+            duration += estimate
+        if bundle:
+            bundles.append(bundle)
+    return bundles
+
+
+def find_chain(root_dag, proc, parents, children):
+    """
+    Follows the linear chain that starts at a process. Each following
+    step is the only child of the step before it, has no other parent,
+    is waiting and has the same requirements as the first step. Every
+    input file of a following step must be produced by an earlier step
+    or already exist, so that no step of the job waits for a file.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @param proc: First step
+    @type proc: dag.Process
+    @param parents: Parent map from DAG.dependency_map
+    @type parents: dict
+    @param children: Child map from DAG.dependency_map
+    @type children: dict
+    @return: Steps of the chain, starting with proc
+    @rtype: list
+    """
+    from dag import WAITING_STATES
+    from dag.filecache import get_file_cache
+    file_cache = get_file_cache()
+    chain = [proc]
+    produced = set(proc.output_files)
+    key = bundle_key(proc)
+    current = proc
+    while len(children.get(current, [])) == 1:
+        child = children[current][0]
+        if (parents.get(child) != [current]
+                or child.state not in WAITING_STATES
+                or not can_bundle(child) or bundle_key(child) != key
+                or child in chain):
+            break
+        missing = [prereq for prereq in root_dag.incomplete_prereqs(
+                       child, parents, file_cache)
+                   if prereq is not current and prereq not in produced]
+        if missing:
+            L.debug("Not fusing %s, which is waiting for %d prerequisites"
+                    % (child.workunit_name, len(missing)))
+            break
+        chain.append(child)
+        produced.update(child.output_files)
+        current = child
+    return chain
+
+
+def plan_units(root_dag, runnable, bundle_duration=None, fuse=False,
+               slots=1):
+    """
+    Decides how runnable processes are submitted: alone, fused with the
+    rest of their linear chain, or bundled with other short processes.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @param runnable: Runnable processes, in dispatch order
+    @type runnable: list
+    @param bundle_duration: Target duration of bundles, or None to not
+     bundle processes
+    @type bundle_duration: float
+    @param fuse: Whether or not linear chains are fused
+    @type fuse: bool
+    @param slots: Number of bundles that may run at once
+    @type slots: int
+    @return: Tuples of a list of processes and whether or not they are a
+     chain, in dispatch order
+    @rtype: list
+    """
+    chains = {}  # first step -> chain
+    if fuse:
+        (parents, children) = root_dag.dependency_map()
+        for proc in runnable:
+            if can_bundle(proc):
+                chain = find_chain(root_dag, proc, parents, children)
+                if len(chain) > 1:
+                    chains[proc] = chain
+    singles = [proc for proc in runnable if proc not in chains]
+    bundles = {}  # first member -> bundle
+    if bundle_duration:
+        for bundle in make_bundles(root_dag, singles, bundle_duration,
+                                   slots):
+            bundles[bundle[0]] = bundle
+    else:
+        for proc in singles:
+            bundles[proc] = [proc]
+
+    units = []
+    for proc in runnable:
+        if proc in chains:
+            units.append((chains[proc], True))
+        elif proc in bundles:
+            units.append((bundles[proc], False))
+    return units
+
+
+def member_entry(proc, cwd=None, log_store=None):
+    """
+    Describes a process for the manifest of a bundle.
+
+    @rtype: dict
+    """
+    import os
+    from dag.shell import limit_settings, ShellProcess
+    entry = {"workunit_name": proc.workunit_name,
+             "cwd": cwd or os.getcwd(),
+             "nice": getattr(proc, "nice", 0)}
+    entry.update(limit_settings(proc))
+    if log_store:
+        entry["log_store"] = log_store
+    if isinstance(proc, ShellProcess):
+        entry["argv"] = [proc.cmd] + list(proc.args)
+    else:
+        executable = getattr(proc, "executable_name", None) or proc.cmd
+        entry["command"] = "%s %s" % (executable, proc.args or "")
+    return entry
+
+
+def write_manifest(filename, name, members, chain=False,
+                   progress_command=None, log_store=None):
+    """
+    Writes the manifest of a bundle.
+
+    @param filename: Path to manifest
+    @type filename: str
+    @param name: Name of the bundle
+    @type name: str
+    @param members: Processes in the bundle, in the order they are run
+    @type members: list
+    @param chain: Whether or not the members are a chain, which stops at
+     the first failure
+    @type chain: bool
+    @param progress_command: Optional shell command run after each member,
+     so that the DAG may be updated while the bundle runs
+    @type progress_command: str
+    @param log_store: Optional directory of the log store to which the
+     output of members is written (see dag.logstore)
+    @type log_store: str
+    """
+    import json
+    with open(filename, "w") as manifest:
+        json.dump({"name": name,
+                   "chain": chain,
+                   "progress_command": progress_command,
+                   "members": [member_entry(proc, log_store=log_store)
+                               for proc in members]},
+                  manifest)
+
+
+def read_manifest(filename):
+    import json
+    with open(filename, "r") as manifest:
+        return json.load(manifest)
+
+
+def run_member(entry):
+    """
+    Runs one member of a bundle, with standard output and error written to
+    <workunit name>.stdout and <workunit name>.stderr, or to the log store
+    named in the entry (see dag.logstore). The limits in the entry are
+    enforced as the shell engine does (see dag.shell.ShellProcess).
+
+    @param entry: Member from the manifest
+    @type entry: dict
+    @return: Result of the member
+    @rtype: dict
+    """
+    import os
+    import subprocess
+    import time
+    from dag.logstore import open_outputs, close_outputs
+    from dag.shell import (limit_failure, resource_limits,
+                           set_resource_limits, status_to_returncode,
+                           wait_for_command)
+
+    name = entry["workunit_name"]
+    cwd = entry.get("cwd") or os.getcwd()
+    nice = entry.get("nice", 0)
+    limits = resource_limits(entry.get("cpu_limit"),
+                             entry.get("memory_limit"))
+
+    def prepare_child():
+        if nice:
+            os.nice(nice)
+        set_resource_limits(limits)
+
+    start_time = time.time()
+    log_store = entry.get("log_store")
+    outputs = open_outputs(name, log_store, cwd)
+    (stdout_file, stderr_file) = outputs
+    try:
+        if "argv" in entry:
+            child = subprocess.Popen(entry["argv"], cwd=cwd, close_fds=True,
+                                     preexec_fn=prepare_child,
+                                     stdout=stdout_file, stderr=stderr_file)
+        else:
+            child = subprocess.Popen(entry["command"], shell=True, cwd=cwd,
+                                     close_fds=True, preexec_fn=prepare_child,
+                                     stdout=stdout_file, stderr=stderr_file)
+        (status, rusage, failure_reason) = wait_for_command(
+            child, entry.get("deadline"), name=name)
+        if failure_reason is None:
+            failure_reason = limit_failure(status, rusage,
+                                           entry.get("cpu_limit"))
+        result = {"exit_code": status_to_returncode(status),
+                  "failure_reason": failure_reason,
+                  "max_rss": rusage.ru_maxrss * 1024,
+                  "cpu_time": rusage.ru_utime + rusage.ru_stime}
+    except OSError as e:
+        stderr_file.write("Could not run %s: %s\n" % (name, e))
+        result = {"exit_code": 127}
+    finally:
+        close_outputs(name, outputs, log_store)
+    result.update({"workunit_name": name, "start_time": start_time,
+                   "end_time": time.time()})
+    return result
+
+
+def run_bundle(manifest_filename, results_filename):
+    """
+    Runs the members of a bundle one after another. The result of each
+    member is appended to the results file as soon as it finishes, and the
+    progress command of the manifest, if any, is run. A chain stops at
+    the first member that fails.
+
+    @param manifest_filename: Path to manifest
+    @type manifest_filename: str
+    @param results_filename: Path to results file
+    @type results_filename: str
+    @return: Exit code of the bundle, 0 if every member succeeded
+    @rtype: int
+    """
+    import json
+    import subprocess
+    manifest = read_manifest(manifest_filename)
+    progress_command = manifest.get("progress_command")
+    exit_code = 0
+    with open(results_filename, "a") as results:
+        for entry in manifest["members"]:
+            result = run_member(entry)
+            results.write(json.dumps(result) + "\n")
+            results.flush()
+            if progress_command:
+                subprocess.call(progress_command, shell=True)
+            if result["exit_code"] or result.get("failure_reason"):
+                exit_code = 1
+                if manifest.get("chain"):
+                    break
+    return exit_code
+
+
+def read_results(results_filename):
+    """
+    Reads the results written by run_bundle.
+
+    @return: Results by workunit name
+    @rtype: dict
+    """
+    import json
+    results = {}
+    try:
+        with open(results_filename, "r") as infile:
+            for line in infile:
+                if line.strip():
+                    result = json.loads(line)
+                    results[result["workunit_name"]] = result
+    except IOError:
+        pass
+    return results
+
+
+def apply_results(root_dag, manifest_filename, results_filename,
+                  partial=False):
+    """
+    Sets the states of the members of a finished bundle from its results,
+    adds their runs to the run history and fingerprints the members that
+    succeeded. Members without a result did not run. They are marked FAIL,
+    or returned to CREATED if they are the later steps of a chain.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @param manifest_filename: Path to manifest
+    @type manifest_filename: str
+    @param results_filename: Path to results file
+    @type results_filename: str
+    @param partial: Whether or not the bundle is still running. If it is,
+     members without a result are left as they are.
+    @type partial: bool
+    @return: Members of the bundle
+    @rtype: list
+    """
+    from dag import States
+    from dag.fingerprint import record
+    from dag.history import get_history
+
+    history_filename = getattr(root_dag, "history_filename", None)
+    results = read_results(results_filename)
+    manifest = read_manifest(manifest_filename)
+    members = []
+    for entry in manifest["members"]:
+        proc = root_dag.get_process(entry["workunit_name"])
+        if proc is None:
+            L.warning("Bundle member %s is not in the DAG"
+                      % entry["workunit_name"])
+            continue
+        members.append(proc)
+        result = results.get(proc.workunit_name)
+        if result is None:
+            if partial:
+                continue
+            if manifest.get("chain"):
+                proc.state = States.CREATED
+            else:
+                proc.state = States.FAIL
+            continue
+        if proc.state in (States.SUCCESS, States.FAIL):
+            continue  # Applied by an earlier, partial update
+        proc.failure_reason = result.get("failure_reason")
+        if result["exit_code"] or proc.failure_reason:
+            proc.state = States.FAIL
+        else:
+            proc.state = States.SUCCESS
+        proc.start_time = result["start_time"]
+        proc.end_time = result["end_time"]
+        get_history(history_filename).record(proc, result["start_time"],
+                                             result["end_time"],
+                                             result["exit_code"],
+                                             result.get("max_rss"),
+                                             result.get("cpu_time"))
+        if proc.state == States.SUCCESS:
+            record(proc, history_filename)
+    return members
+
+
+if __name__ == "__main__":
+    from sys import argv
+    if len(argv) != 3:
+        print("Usage: python -m dag.bundle <manifest> <results>")
+        exit(1)
+    exit(run_bundle(argv[1], argv[2]))
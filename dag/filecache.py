@@ -0,0 +1,295 @@
+"""
+dag.filecache
+=============
+
+@author: David Coss, PhD
+@date: October 19, 2026
+@license: GPL version 3 (see COPYING or
+ http://www.gnu.org/licenses/gpl.html for details)
+
+Cache of file existence used by the scheduler. Instead of calling stat
+for every input file of every waiting process on every pass, the cache
+lists each directory once and answers from the listing.
+
+On local filesystems, listings are kept until inotify reports a change in
+the directory. On network filesystems, such as NFS, where inotify does
+not see changes made by other hosts, listings expire after a time to live
+(TTL). If inotify is unavailable, the TTL is used everywhere.
+
+Entries of a listing are assumed to be files. A directory named like an
+input file is therefore reported as present.
+"""
+import logging
+
+L = logging.getLogger("dag.filecache")
+
+# Seconds for which a directory listing on a network filesystem is used.
+DEFAULT_TTL = 30
+
+NETWORK_FILESYSTEMS = ["afs", "beegfs", "ceph", "cifs", "fuse.sshfs",
+                       "glusterfs", "gpfs", "lustre", "ncpfs", "nfs", "nfs4",
+                       "panfs", "smbfs"]
+
+# inotify constants from sys/inotify.h
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_DELETE_SELF | IN_MOVE_SELF)
+
+# Shared cache, created by get_file_cache
+_cache = None
+
+
+def network_mount_points(mounts_filename="/proc/mounts"):
+    """
+    Returns the mount points of network filesystems.
+
+    @param mounts_filename: Mount table. Default: /proc/mounts
+    @type mounts_filename: str
+    @return: Mount points
+    @rtype: list
+    """
+    mount_points = []
+    try:
+        with open(mounts_filename, "r") as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # Spaces in mount points are escaped as \040
+                mount_point = fields[1].replace("\\040", " ")
+                if fields[2] in NETWORK_FILESYSTEMS:
+                    mount_points.append(mount_point)
+    except IOError:
+        pass
+    return mount_points
+
+
+class Inotify(object):
+    """
+    Minimal non-blocking interface to Linux inotify, using ctypes.
+
+    @raise OSError: If inotify is not available
+    """
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        import os
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"),
+                                use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.pid = os.getpid()
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """
+        Watches a directory.
+
+        @param path: Path of the directory. Byte strings are passed to the
+         kernel as they are, since paths need not be valid UTF-8.
+        @type path: str
+        @return: Watch descriptor, or None if the watch could not be added
+        @rtype: int
+        """
+        if isinstance(path, unicode):
+            path = path.encode("utf-8")
+        wd = self.libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            return None
+        return wd
+
+    def read_events(self):
+        """
+        Reads pending events without blocking.
+
+        @return: List of (watch descriptor, mask) pairs
+        @rtype: list
+        """
+        import errno
+        import os
+        import struct
+
+        events = []
+        header_size = struct.calcsize("iIII")
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    break
+                raise
+            if not buf:
+                break
+            offset = 0
+            while offset + header_size <= len(buf):
+                (wd, mask, cookie, length) = struct.unpack_from("iIII", buf,
+                                                                offset)
+                events.append((wd, mask))
+                offset += header_size + length
+        return events
+
+    def close(self):
+        import os
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class FileCache(object):
+    """
+    Cache of directory listings used to check whether files exist.
+
+    @ivar ttl: Seconds for which listings without an inotify watch are used
+    @type ttl: float
+    @ivar assume_outputs: Whether or not output files of successful
+     processes are assumed to exist. See DAG.incomplete_prereqs.
+    @type assume_outputs: bool
+    """
+    def __init__(self, ttl=DEFAULT_TTL, use_inotify=True,
+                 assume_outputs=True):
+        self.ttl = ttl
+        self.assume_outputs = assume_outputs
+        self.listings = {}  # directory -> (time, set of names, watched)
+        self.watches = {}  # watch descriptor -> directory
+        self.watched = set()  # directories with a watch
+        self.network_mounts = network_mount_points()
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                L.debug("inotify is unavailable: %s" % e)
+
+    def is_network_path(self, directory):
+        """
+        Determines whether or not a directory is on a network filesystem.
+
+        @rtype: bool
+        """
+        for mount_point in self.network_mounts:
+            if (directory == mount_point
+                    or directory.startswith(mount_point.rstrip("/") + "/")):
+                return True
+        return False
+
+    def refresh(self):
+        """
+        Drops the listings of directories that inotify reports as changed.
+         The scheduler calls this once per pass, rather than once per file.
+        """
+        import os
+        if self.inotify is None:
+            return
+        if self.inotify.pid != os.getpid():
+            # Forked child. The watches belong to the parent.
+            self.inotify = None
+            self.watches = {}
+            self.watched = set()
+            self.invalidate()
+            return
+        for (wd, mask) in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                self.invalidate()
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            self.listings.pop(directory, None)
+            if mask & IN_IGNORED:
+                del self.watches[wd]
+                self.watched.discard(directory)
+
+    def listing(self, directory):
+        """
+        Returns the names in a directory, listing it if needed.
+
+        @param directory: Absolute path of directory
+        @type directory: str
+        @return: Names in the directory
+        @rtype: set
+        """
+        import os
+        import time
+
+        now = time.time()
+        cached = self.listings.get(directory)
+        if cached is not None:
+            (listed_at, names, watched) = cached
+            if watched or now - listed_at < self.ttl:
+                return names
+
+        watched = False
+        if (self.inotify is not None
+                and not self.is_network_path(directory)):
+            # Watch before listing, so that no change is missed.
+            if directory in self.watched:
+                watched = True
+            else:
+                wd = self.inotify.add_watch(directory)
+                if wd is not None:
+                    self.watches[wd] = directory
+                    self.watched.add(directory)
+                    watched = True
+        try:
+            names = set(os.listdir(directory))
+        except OSError:
+            names = set()
+        self.listings[directory] = (now, names, watched)
+        return names
+
+    def isfile(self, path):
+        """
+        Determines whether or not a file exists.
+
+        @param path: Path to file
+        @type path: str
+        @rtype: bool
+        """
+        import os.path as OP
+        (directory, name) = OP.split(OP.abspath(path))
+        return name in self.listing(directory)
+
+    def invalidate(self, path=None):
+        """
+        Drops cached listings, so that files are checked again.
+
+        @param path: Optional file whose directory listing is dropped.
+         Default: all listings are dropped.
+        @type path: str
+        """
+        import os.path as OP
+        if path is None:
+            self.listings = {}
+        else:
+            self.listings.pop(OP.dirname(OP.abspath(path)), None)
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+        self.watches = {}
+        self.watched = set()
+        self.listings = {}
+
+
+def get_file_cache():
+    """
+    Returns the FileCache shared by the scheduler, creating it if needed.
+
+    @rtype: dag.filecache.FileCache
+    """
+    global _cache
+    if _cache is None:
+        _cache = FileCache()
+    return _cache
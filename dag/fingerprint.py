@@ -0,0 +1,240 @@
+"""
+dag.fingerprint
+===============
+
+@author: David Coss, PhD
+@date: October 19, 2026
+@license: GPL version 3 (see COPYING or
+ http://www.gnu.org/licenses/gpl.html for details)
+
+Make-style incremental execution. When a process succeeds, a fingerprint
+of its command, arguments, input files and output files is stored in the
+run history database. When the process is about to run again, it is
+marked SUCCESS without running if its fingerprint still matches and its
+output files are unchanged.
+
+Input files are compared by size and modification time. If those differ,
+the contents are compared, so that a file that was only touched does not
+cause a re-run. Only processes with output files are fingerprinted,
+since a process without outputs cannot be shown to be up to date.
+Processes with "cacheable" set to False (see "%define nocache" in gsub)
+always run.
+"""
+import logging
+
+L = logging.getLogger("dag.fingerprint")
+
+# Files larger than this are compared by size and modification time only.
+HASH_SIZE_LIMIT = 64 * 1024 ** 2
+
+# UUIDs of processes found to be out of date by this Python process.
+# They are not checked again until they have run.
+_stale = set()
+
+
+def file_digest(path):
+    """
+    Returns the SHA-1 of the contents of a file.
+
+    @param path: Path to file
+    @type path: str
+    @rtype: str
+    """
+    import hashlib
+    digest = hashlib.sha1()
+    with open(path, "rb") as infile:
+        while True:
+            block = infile.read(1024 ** 2)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_state(path, with_digest=False):
+    """
+    Returns the size, modification time and, optionally, the digest of a
+    file. None is returned if the file does not exist.
+
+    @param path: Path to file
+    @type path: str
+    @param with_digest: Whether or not the contents should be hashed.
+     Files larger than HASH_SIZE_LIMIT are never hashed.
+    @type with_digest: bool
+    @return: List of size, modification time and digest (or None)
+    @rtype: list
+    """
+    import os
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    digest = None
+    if with_digest and st.st_size <= HASH_SIZE_LIMIT:
+        digest = file_digest(path)
+    return [st.st_size, st.st_mtime, digest]
+
+
+def process_key(proc):
+    """
+    Creates the key under which the fingerprint of a process is stored.
+    The key covers the command, the arguments and the absolute paths of
+    the output files.
+
+    @param proc: Process
+    @type proc: dag.Process
+    @rtype: str
+    """
+    import hashlib
+    import os.path as OP
+    args = getattr(proc, "args", "")
+    if isinstance(args, (list, tuple)):
+        args = "\0".join([str(arg) for arg in args])
+    parts = [str(getattr(proc, "cmd", "")), str(args)]
+    parts.extend(sorted([OP.abspath(f.full_path())
+                         for f in proc.output_files]))
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def make_fingerprint(proc):
+    """
+    Creates the fingerprint of a process from its current input and
+    output files.
+
+    @param proc: Process
+    @type proc: dag.Process
+    @return: Fingerprint, or None if an output file is missing
+    @rtype: dict
+    """
+    import os.path as OP
+    inputs = {}
+    for infile in proc.input_files:
+        path = OP.abspath(infile.full_path())
+        inputs[path] = file_state(path, True)
+    outputs = {}
+    for outfile in proc.output_files:
+        path = OP.abspath(outfile.full_path())
+        outputs[path] = file_state(path)
+        if outputs[path] is None:
+            return None
+    return {"inputs": inputs, "outputs": outputs}
+
+
+def is_cacheable(proc):
+    """
+    Determines whether or not a process may be skipped when up to date.
+
+    @rtype: bool
+    """
+    return bool(proc.output_files) and getattr(proc, "cacheable", True)
+
+
+def record(proc, history_filename=None):
+    """
+    Stores the fingerprint of a process that has succeeded.
+
+    @param proc: Successful process
+    @type proc: dag.Process
+    @param history_filename: Optional path to history database
+    @type history_filename: str
+    """
+    import json
+    from dag.history import History
+
+    if not is_cacheable(proc):
+        return
+    fingerprint = make_fingerprint(proc)
+    if fingerprint is None:
+        L.debug("Not fingerprinting %s. Output files are missing."
+                % proc.workunit_name)
+        return
+    # A new History is used, as this may be called by a forked child.
+    history = History(history_filename)
+    history.save_fingerprint(process_key(proc), json.dumps(fingerprint))
+    history.close()
+    _stale.discard(proc.uuid)
+
+
+def is_up_to_date(proc, history_filename=None):
+    """
+    Determines whether or not a process may be skipped, because its
+    inputs and outputs are the same as when it last succeeded.
+
+    @param proc: Process
+    @type proc: dag.Process
+    @param history_filename: Optional path to history database
+    @type history_filename: str
+    @rtype: bool
+    """
+    import json
+    from dag.history import get_history
+
+    if not is_cacheable(proc) or proc.uuid in _stale:
+        return False
+    stored = get_history(history_filename).load_fingerprint(
+        process_key(proc))
+    up_to_date = stored is not None and matches(proc, json.loads(stored))
+    if not up_to_date:
+        _stale.add(proc.uuid)
+    return up_to_date
+
+
+def matches(proc, fingerprint):
+    """
+    Compares the current files of a process with a stored fingerprint.
+
+    @param proc: Process
+    @type proc: dag.Process
+    @param fingerprint: Fingerprint from make_fingerprint
+    @type fingerprint: dict
+    @rtype: bool
+    """
+    import os.path as OP
+
+    for (path, old) in fingerprint["outputs"].items():
+        current = file_state(path)
+        if current is None or current[0:2] != old[0:2]:
+            return False
+
+    old_inputs = fingerprint["inputs"]
+    paths = [OP.abspath(infile.full_path()) for infile in proc.input_files]
+    if sorted(paths) != sorted(old_inputs):
+        return False
+    for path in paths:
+        old = old_inputs[path]
+        current = file_state(path)
+        if current is None or old is None:
+            if current != old:
+                return False
+            continue
+        if current[0:2] == old[0:2]:
+            continue
+        # Size or time changed. Touched files have the same contents.
+        if old[2] is None or current[0] != old[0]:
+            return False
+        if file_digest(path) != old[2]:
+            return False
+    return True
+
+
+def skip_up_to_date(root_dag, runnable):
+    """
+    Marks up to date processes as SUCCESS, without running them.
+
+    @param root_dag: DAG containing the processes
+    @type root_dag: dag.DAG
+    @param runnable: Processes that are about to be run
+    @type runnable: list
+    @return: Processes that were skipped
+    @rtype: list
+    """
+    from dag import States
+
+    history_filename = getattr(root_dag, "history_filename", None)
+    skipped = []
+    for proc in runnable:
+        if is_up_to_date(proc, history_filename):
+            L.info("%s is up to date" % proc.workunit_name)
+            proc.state = States.SUCCESS
+            skipped.append(proc)
+    return skipped
@@ -17,6 +17,11 @@ import dag
 
 internal_counter = 0
 
+# Most values of a %foreach that is expanded into one process per value,
+# i.e. for engines other than SHELL and for parser functions. Only SHELL
+# sweeps are kept as a single dag.shell.SweepProcess.
+EAGER_SWEEP_LIMIT = 10000
+
 
 def preprocess_line(line, parser_kmap, dependencies):
     """
@@ -78,12 +83,114 @@ def preprocess_line(line, parser_kmap, dependencies):
     elif line[0:5] == "%nice":
         nice_increment = line.split()[-1]
         parser_kmap["nice"] = int(nice_increment)
+    elif line[0:6] == "%cores":
+        parser_kmap["cores"] = int(line.split()[-1])
+    elif line[0:7] == "%memory":
+        parser_kmap["memory"] = line.split()[-1]
+    elif line[0:5] == "%pool":
+        from dag.pools import NO_POOL
+        pool_tokens = line.split()[1:]
+        if len(pool_tokens) not in (1, 2):
+            raise dag.DagException("Invalid pool line.\n"
+                                   "Expected:\n"
+                                   "%pool NAME [CAP]\n"
+                                   "Received:\n{0}".format(line))
+        name = pool_tokens[0]
+        caps = parser_kmap.setdefault("pool_caps", {})
+        if name == NO_POOL:
+            parser_kmap.pop("pool", None)
+        else:
+            if len(pool_tokens) == 2:
+                caps[name] = int(pool_tokens[1])
+                if caps[name] < 1:
+                    raise dag.DagException("Pool %s needs a cap of at"
+                                           " least 1." % name)
+            elif name not in caps:
+                raise dag.DagException("Pool %s has no cap. Use"
+                                       " %%pool %s CAP" % (name, name))
+            parser_kmap["pool"] = name
+    elif line[0:9] == "%priority":
+        parser_kmap["priority"] = int(line.split()[-1])
+    elif line[0:8] == "%foreach":
+        foreach_tokens = line.split()[1:]
+        if len(foreach_tokens) < 2:
+            raise dag.DagException("Invalid foreach line.\n"
+                                   "Expected:\n"
+                                   "%foreach VARIABLE value [value ...]\n"
+                                   "Received:\n{0}".format(line))
+        parser_kmap["foreach"] = (foreach_tokens[0], foreach_tokens[1:])
 
     return (parser_kmap, processes, dependencies)
 
 
+def apply_header(proc, parser_kmap):
+    """
+    Sets the scheduling attributes, which apply to every engine, of a new
+    process from the keyword map.
+
+    "priority" (set by %priority or "%define priority N") is the manual
+    scheduling priority. "nocache" (set by "%define nocache") prevents the
+    process from being skipped when it is up to date. "retries" (set by
+    "%define retries N") is the number of times the process is run again
+    if it fails, waiting "%define retry_delay SECONDS" before the first
+    retry and twice as long before each of the next (see dag.retry).
+    "pool" (set by %pool) is the concurrency pool of the process (see
+    dag.pools).
+
+    @param proc: New process
+    @type proc: dag.Process
+    @param parser_kmap: Keyword map populated by the submission script
+    @type parser_kmap: dict
+    """
+    from dag.util import get_header_value
+    if "priority" in parser_kmap:
+        proc.priority = int(get_header_value(parser_kmap, "priority"))
+    if "nocache" in parser_kmap:
+        proc.cacheable = False
+    if "retries" in parser_kmap:
+        proc.retries = int(get_header_value(parser_kmap, "retries"))
+    if "retry_delay" in parser_kmap:
+        proc.retry_delay = float(get_header_value(parser_kmap, "retry_delay"))
+    if "pool" in parser_kmap:
+        proc.pool = parser_kmap["pool"]
+
+
+def sweep_arguments(args, foreach, limit=EAGER_SWEEP_LIMIT):
+    """
+    Substitutes each value of a %foreach directive into the arguments of a
+    command. Wildcards are resolved now, rather than when the command runs.
+
+    @param args: Arguments, which may contain $VARIABLE
+    @type args: list
+    @param foreach: Variable name and value tokens of the directive
+    @type foreach: tuple
+    @param limit: Most values allowed. Default: EAGER_SWEEP_LIMIT
+    @type limit: int
+    @return: One list of arguments per value
+    @rtype: list
+    @raise dag.DagException: If there are more than limit values
+    """
+    from string import Template
+    from dag.shell import SweepProcess
+    values = SweepProcess("", [], foreach[0], foreach[1])
+    count = values.resolve()
+    if limit is not None and count > limit:
+        raise dag.DagException(
+            "%%foreach %s has %d values, which would create one process"
+            " each. Only the SHELL engine runs plain commands as a single"
+            " sweep. At most %d values are allowed otherwise. Split the"
+            " sweep, or use the SHELL engine." % (foreach[0], count, limit))
+    argument_lists = []
+    for index in range(count):
+        mapping = {foreach[0]: values.value(index)}
+        argument_lists.append([Template(arg).safe_substitute(mapping)
+                               for arg in args])
+    return argument_lists
+
+
 def create_dag(input_filename, parsers, init_file=None,
-               engine=dag.Engine.SHELL, num_cores=None):
+               engine=dag.Engine.SHELL, num_cores=None, memory=None,
+               incremental=True):
     """
     Takes an input file that contains a list of commands and generates a dag.
     Jobs that have all of their prerequisites met are started, unless the
@@ -99,8 +206,14 @@ def create_dag(input_filename, parsers, init_file=None,
     @type init_file: file
     @param num_processors: Optional number of processors used in multiprocessing.
     @type num_processors: int
+    @param memory: Optional bytes of memory used in multiprocessing.
+    @type memory: int
+    @param incremental: Whether or not processes that are up to date
+    are skipped. Default: True
+    @type incremental: bool
     @return:  DAG object if successful. Otherwise, None is returned
     @rtype: dag.DAG
+    @raise dag.DependencyCycle: If the dependencies contain a cycle
     """
 
     import dag.util as dag_utils
@@ -124,6 +237,8 @@ def create_dag(input_filename, parsers, init_file=None,
     root_dag = DAG()
     root_dag.engine = engine
     root_dag.num_cores = num_cores
+    root_dag.memory = memory
+    root_dag.incremental = incremental
     parser_kmap = {}  # used as the second argument of parser functions (below)
     # dependencies dict is used to allow the user
     # to define explicit dependencies.
@@ -140,6 +255,7 @@ def create_dag(input_filename, parsers, init_file=None,
                  dependencies) = preprocess_line(line,
                                                  parser_kmap, dependencies)
                 for extra_proc in extra_processes:
+                    apply_header(extra_proc, parser_kmap)
                     root_dag.add_process(extra_proc)
                 continue
             tokens = line.split(' ')
@@ -156,25 +272,40 @@ def create_dag(input_filename, parsers, init_file=None,
                 pname = parser_args[0]
                 parser_args = parser_args[1:]
 
-            if root_dag.engine == Engine.SHELL:
-                import dag.shell
-                proc_list = dag.shell.parse_shell(pname, parser_args,
-                                                  parser_kmap, parsers, init_code)
-                num_procs = len(root_dag.processes)
-                for proc in proc_list:
-                    proc.workunit_name = "%s-%d" % (proc.cmd, num_procs)
-                    num_procs += 1
-            else:
-                if not pname in parsers.keys():
-                    print("No function for %s" % pname)
-                    print("Known functions: ", parsers.keys())
-                    raise DagException("Unknown Function: {0}".format(pname))
-
-                funct = "%s(parser_args,parser_kmap)" % parsers[pname]
-                print("Running %s" % funct)
-                proc_list = eval(funct)   # uses parser_args
-
-            if proc_list is None:
+            # %foreach applies to the next command only. Plain shell
+            # commands become one SweepProcess. Parser functions create
+            # their own processes, so they are called once per value.
+            foreach = parser_kmap.pop("foreach", None)
+            argument_lists = [parser_args]
+            if foreach and (root_dag.engine != Engine.SHELL
+                            or pname in parsers):
+                argument_lists = sweep_arguments(parser_args, foreach)
+                foreach = None
+
+            proc_list = []
+            for parser_args in argument_lists:
+                if root_dag.engine == Engine.SHELL:
+                    import dag.shell
+                    new_procs = dag.shell.parse_shell(pname, parser_args,
+                                                      parser_kmap, parsers,
+                                                      init_code, foreach)
+                    num_procs = len(root_dag.processes) + len(proc_list)
+                    for proc in new_procs:
+                        proc.workunit_name = "%s-%d" % (proc.cmd, num_procs)
+                        num_procs += 1
+                else:
+                    if not pname in parsers.keys():
+                        print("No function for %s" % pname)
+                        print("Known functions: ", parsers.keys())
+                        raise DagException("Unknown Function: {0}".format(pname))
+
+                    funct = "%s(parser_args,parser_kmap)" % parsers[pname]
+                    print("Running %s" % funct)
+                    new_procs = eval(funct)   # uses parser_args
+                if new_procs:
+                    proc_list.extend(new_procs)
+
+            if not proc_list:
                 continue
 
             # If given explicitly set workunit name
@@ -190,6 +321,7 @@ def create_dag(input_filename, parsers, init_file=None,
 
 
             for i in proc_list:
+                apply_header(i, parser_kmap)
                 root_dag.add_process(i)
 
     # Set explicit dependencies, if any
@@ -209,19 +341,51 @@ def create_dag(input_filename, parsers, init_file=None,
                 parent_process.children.append(child_proc)
                 print("%s depends on %s" % (child, parent_name))
 
+    root_dag.pools = parser_kmap.get("pool_caps", {})
+    check_dependencies(root_dag)
     return root_dag
 
 
+def check_dependencies(root_dag):
+    """
+    Validates the dependencies of a new DAG (see dag.DAG.validate). Orphan
+    input files and the processes they block are reported as warnings,
+    since the files may yet be created outside of the DAG.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @raise dag.DependencyCycle: If the dependencies contain a cycle
+    """
+    from dag import DependencyCycle, format_cycles
+    problems = root_dag.validate()
+    if problems["cycles"]:
+        raise DependencyCycle("Dependency cycle(s) found: %s"
+                              % format_cycles(problems["cycles"]))
+    for (proc, files) in problems["orphan_inputs"].items():
+        print("Warning: No process creates %s, needed by %s"
+              % (", ".join([f.logical_name for f in files]),
+                 proc.workunit_name))
+    if problems["dead_ends"]:
+        print("Warning: %d process(es) cannot start until those files"
+              " exist: %s" % (len(problems["dead_ends"]),
+                              ", ".join([proc.workunit_name for proc
+                                         in problems["dead_ends"]])))
+
+
 def gsub(input_filename, start_jobs=True, dagfile=dag.DEFAULT_DAGFILE_NAME,
          init_filename=None, engine=dag.Engine.BOINC, num_cores=None,
-         queue_filename=None):
+         queue_filename=None, memory=None, incremental=True,
+         agent_address=None, bundle_duration=None, fuse_chains=False,
+         log_store=None, log_cap=None, log_compress=True, speculate=False,
+         pin_cores=False):
     """
     Reads a file containing a list of commands and parses them
     into workunits to be run on the grid. if start_jobs is true,
     workunites that are ready to be run are submitted to the scheduler.
 
     Lines beginning with '%' are considered directives for gsub itself.
-    Current gsub directives are: %define, %python
+    Current gsub directives are: %define, %python, %nice, %cores, %memory,
+    %priority, %foreach, %pool
     If '%' is followed by something other than the directive,
     the line is ignored.
 
@@ -231,6 +395,29 @@ def gsub(input_filename, start_jobs=True, dagfile=dag.DEFAULT_DAGFILE_NAME,
 
     %python lines are interpreted by the python interpreter.
 
+    %cores and %memory lines set the number of cores and the amount of
+    memory (e.g. "40G") requested by the shell processes that follow.
+    Shell processes may be limited with "%define deadline SECONDS" of
+    wall-clock time, "%define cpu_limit SECONDS" of CPU time and
+    "%define memory_limit SIZE" of address space (see
+    dag.shell.ShellProcess).
+
+    %priority lines set the scheduling priority of the processes that
+    follow. Runnable processes with a higher priority are started before
+    others, regardless of their critical path. The default priority is 0.
+
+    "%pool NAME CAP" limits the processes that follow to CAP running at
+    once, in every engine. "%pool NAME" reuses the cap of an earlier pool
+    and "%pool none" ends it (see dag.pools).
+
+    "%foreach VARIABLE value ..." runs the next command once per value, with
+    $VARIABLE in its arguments replaced by the value. Values may be ranges,
+    e.g. 1..100, or wildcard patterns, e.g. .SHELL/segmented-*. With the
+    SHELL engine, a plain command becomes a single dag.shell.SweepProcess,
+    whose wildcards are resolved when it becomes runnable. Otherwise, one
+    process is created per value, and a sweep of more than
+    EAGER_SWEEP_LIMIT values is refused.
+
     @param input_filename: filename of commands to be parsed
     @type input_filename: String
     @param start_jobs: Indicates whether jobs should be started
@@ -246,6 +433,39 @@ def gsub(input_filename, start_jobs=True, dagfile=dag.DEFAULT_DAGFILE_NAME,
     @type engine: dag.States
     @param queue_filename: Path to Message Queue File
     @type queue_filename: str 
+    @param memory: Optional bytes of memory used in local multiprocessing.
+    @type memory: int
+    @param incremental: Whether or not processes whose inputs and outputs
+    are unchanged since they last succeeded are skipped. Default: True
+    @type incremental: bool
+    @param agent_address: Optional HOST:PORT on which the shell engine
+    listens for worker agents (see dag.agent). HOST should be a private
+    interface and DAG_AGENT_TOKEN must be set.
+    @type agent_address: str
+    @param bundle_duration: Optional target duration, in seconds, of
+    bundles of short processes (see dag.bundle). Default: no bundling
+    @type bundle_duration: float
+    @param fuse_chains: Whether or not linear chains of processes are run
+    as single jobs (see dag.bundle). Default: False
+    @type fuse_chains: bool
+    @param log_store: Optional directory of a store that keeps the output
+    of shell processes in segment files, rather than in a pair of files
+    per process (see dag.logstore). Default: no store
+    @type log_store: str
+    @param log_cap: Bytes of each output stream kept by the log store.
+    Output is spooled in full while processes run (see
+    dag.logstore.open_outputs). Default: dag.logstore.DEFAULT_CAP
+    @type log_cap: int
+    @param log_compress: Whether or not the log store compresses output.
+    Default: True
+    @type log_compress: bool
+    @param speculate: Whether or not the shell engine runs copies of
+    stragglers (see dag.speculate). Default: False
+    @type speculate: bool
+    @param pin_cores: Whether or not the shell engine pins each process to
+    CPUs of its own, within a NUMA node if it fits (see dag.placement).
+    Default: False
+    @type pin_cores: bool
     @return: DAG contain processes created by the job submission script.
     @rtype: dag.DAG
     @raise dag.DagException: If DAG file already exists or cannot be created or
@@ -282,7 +502,8 @@ def gsub(input_filename, start_jobs=True, dagfile=dag.DEFAULT_DAGFILE_NAME,
         from dag.util import open_user_init
         init_file = open_user_init()
 
-    root_dag = create_dag(input_filename, parsers, init_file, engine, num_cores)
+    root_dag = create_dag(input_filename, parsers, init_file, engine, num_cores,
+                          memory, incremental)
     if root_dag is None:
         raise dag.DagException("Could not create DAG using submission "
                                "file %s" % input)
@@ -290,6 +511,21 @@ def gsub(input_filename, start_jobs=True, dagfile=dag.DEFAULT_DAGFILE_NAME,
         root_dag.queue_filename = "%s.mq" % dagfile
     else:
         root_dag.queue_filename = queue_filename
+    if agent_address:
+        from dag.agent import get_token
+        get_token()  # Fail now, rather than when the work starts
+    root_dag.agent_address = agent_address
+    root_dag.bundle_duration = bundle_duration
+    root_dag.fuse_chains = fuse_chains
+    root_dag.speculate = speculate
+    root_dag.pin_cores = pin_cores
+    root_dag.log_store = None
+    if log_store:
+        from dag.logstore import LogStore, DEFAULT_CAP
+        if log_cap is None:
+            log_cap = DEFAULT_CAP
+        root_dag.log_store = LogStore.create(log_store, log_cap,
+                                             log_compress).directory
     save_dag(root_dag, dagfile)
 
     # Check to see if the directory is writable. If not, issue warning.
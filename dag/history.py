@@ -0,0 +1,312 @@
+"""
+dag.history
+===========
+
+@author: David Coss, PhD
+@date: October 19, 2026
+@license: GPL version 3 (see COPYING or
+ http://www.gnu.org/licenses/gpl.html for details)
+
+Keeps a record of finished processes and turns those records into
+runtime estimates. Records are stored in a small SQLite database, keyed
+by the command and a signature of its arguments, so that the same step
+of different DAGs shares its history. The database also holds the
+fingerprints of successful processes (see dag.fingerprint).
+
+The database is ~/.dag_history.db, unless the DAG names another one or
+the environment variable DAG_HISTORY is set.
+"""
+import logging
+
+L = logging.getLogger("dag.history")
+
+DEFAULT_HISTORY_FILE = ".dag_history.db"
+# Environment variable overriding the default history database
+HISTORY_VARIABLE = "DAG_HISTORY"
+
+# Number of most recent successful runs averaged into an estimate.
+ESTIMATE_WINDOW = 20
+# Seconds for which estimates are reused before the database is read again.
+ESTIMATE_CACHE_PERIOD = 60
+
+# Open History objects by file name.
+_histories = {}
+
+
+def default_history_filename():
+    """
+    Returns the path of the history database in the user's home
+    directory, or the path in HISTORY_VARIABLE if it is set.
+
+    @return: Path to history database
+    @rtype: str
+    """
+    import os
+    import os.path as OP
+    if os.environ.get(HISTORY_VARIABLE):
+        return os.environ[HISTORY_VARIABLE]
+    return OP.join(OP.expanduser("~"), DEFAULT_HISTORY_FILE)
+
+
+def argument_signature(args):
+    """
+    Creates a signature of command line arguments. Runs of digits are
+    replaced, so that the same command run on numbered chunks,
+    e.g. segmented-1 and segmented-2, shares a signature.
+
+    @param args: Arguments as a string or a list of strings
+    @type args: str
+    @return: Signature of the arguments
+    @rtype: str
+    """
+    import hashlib
+    import re
+    if args is None:
+        args = ""
+    elif isinstance(args, (list, tuple)):
+        args = " ".join([str(arg) for arg in args])
+    normalized = re.sub(r"\d+", "#", str(args))
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class History(object):
+    """
+    Store of process run records.
+
+    @ivar filename: Path to the SQLite database
+    @type filename: str
+    """
+    def __init__(self, filename=None):
+        if not filename:
+            filename = default_history_filename()
+        self.filename = filename
+        self.connection = None
+        self.estimates = {}  # (cmd, signature) -> seconds or None
+        self.estimates_time = 0
+
+    def connect(self):
+        """
+        Opens the database, creating the table of runs if needed.
+
+        @return: Database connection
+        @rtype: sqlite3.Connection
+        """
+        import sqlite3
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.filename, timeout=30)
+            self.connection.execute(
+                "create table if not exists runs ("
+                "cmd text, signature text, workunit_name text,"
+                " start_time real, end_time real, exit_code integer,"
+                " max_rss integer, cpu_time real)")
+            self.connection.execute(
+                "create index if not exists runs_by_signature"
+                " on runs (cmd, signature)")
+            self.connection.execute(
+                "create table if not exists fingerprints ("
+                "key text primary key, fingerprint text)")
+            self.connection.commit()
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def record(self, proc, start_time, end_time, exit_code,
+               max_rss=None, cpu_time=None):
+        """
+        Adds a run of a process to the history. Problems writing to the
+        database are logged, rather than raised, so that a run is never
+        lost because its record could not be kept.
+
+        @param proc: Process that ran
+        @type proc: dag.Process
+        @param start_time: Epoch time at which the process started
+        @type start_time: float
+        @param end_time: Epoch time at which the process ended
+        @type end_time: float
+        @param exit_code: Exit code of the process
+        @type exit_code: int
+        @param max_rss: Peak resident set size in bytes
+        @type max_rss: int
+        @param cpu_time: User plus system CPU time in seconds
+        @type cpu_time: float
+        """
+        import sqlite3
+        cmd = str(getattr(proc, "cmd", ""))
+        signature = argument_signature(getattr(proc, "args", None))
+        try:
+            connection = self.connect()
+            connection.execute("insert into runs values (?,?,?,?,?,?,?,?)",
+                               (cmd, signature, proc.workunit_name,
+                                start_time, end_time, exit_code,
+                                max_rss, cpu_time))
+            connection.commit()
+        except sqlite3.Error as e:
+            L.warning("Could not record run of %s in %s: %s"
+                      % (proc.workunit_name, self.filename, e))
+            return
+        self.estimates.pop((cmd, signature), None)
+        self.estimates.pop((cmd, None), None)
+
+    def save_fingerprint(self, key, fingerprint):
+        """
+        Stores the fingerprint of a process, replacing any previous one.
+
+        @param key: Key identifying the process (see dag.fingerprint)
+        @type key: str
+        @param fingerprint: Serialized fingerprint
+        @type fingerprint: str
+        """
+        import sqlite3
+        try:
+            connection = self.connect()
+            connection.execute("insert or replace into fingerprints"
+                               " values (?,?)", (key, fingerprint))
+            connection.commit()
+        except sqlite3.Error as e:
+            L.warning("Could not save fingerprint in %s: %s"
+                      % (self.filename, e))
+
+    def load_fingerprint(self, key):
+        """
+        Returns the stored fingerprint of a process, or None if there
+        is none.
+
+        @param key: Key identifying the process (see dag.fingerprint)
+        @type key: str
+        @rtype: str
+        """
+        import sqlite3
+        try:
+            row = self.connect().execute("select fingerprint from"
+                                         " fingerprints where key = ?",
+                                         (key,)).fetchone()
+        except sqlite3.Error as e:
+            L.warning("Could not read fingerprint from %s: %s"
+                      % (self.filename, e))
+            return None
+        if row is None:
+            return None
+        return row[0]
+
+    def runtimes(self, cmd, signature=None):
+        """
+        Returns the durations of the most recent successful runs of a
+        command, newest first. If signature is None, runs with any
+        arguments are included.
+
+        @return: Durations in seconds
+        @rtype: list
+        """
+        import sqlite3
+        query = ("select end_time - start_time from runs"
+                 " where cmd = ? and exit_code = 0")
+        params = [cmd]
+        if signature is not None:
+            query += " and signature = ?"
+            params.append(signature)
+        query += " order by end_time desc limit ?"
+        params.append(ESTIMATE_WINDOW)
+        try:
+            rows = self.connect().execute(query, params).fetchall()
+        except sqlite3.Error as e:
+            L.warning("Could not read history from %s: %s"
+                      % (self.filename, e))
+            return []
+        return [row[0] for row in rows if row[0] is not None]
+
+    def estimate(self, proc):
+        """
+        Estimates the runtime of a process from the average of recent
+        successful runs with the same command and argument signature.
+        If there are none, runs of the command with any arguments are
+        used. None is returned if the command has never succeeded.
+
+        @param proc: Process to be estimated
+        @type proc: dag.Process
+        @return: Estimated runtime in seconds
+        @rtype: float
+        """
+        import time
+        if time.time() - self.estimates_time > ESTIMATE_CACHE_PERIOD:
+            self.estimates = {}
+            self.estimates_time = time.time()
+        cmd = str(getattr(proc, "cmd", ""))
+        signature = argument_signature(getattr(proc, "args", None))
+        for key in [(cmd, signature), (cmd, None)]:
+            if key not in self.estimates:
+                durations = self.runtimes(*key)
+                if durations:
+                    self.estimates[key] = sum(durations) / len(durations)
+                else:
+                    self.estimates[key] = None
+            if self.estimates[key] is not None:
+                return self.estimates[key]
+        return None
+
+
+def get_history(filename=None):
+    """
+    Returns the History for a database file, opening it once per process.
+    Forked children should create their own History instead, since
+    database connections cannot be shared across a fork.
+
+    @param filename: Path to the database. Default: ~/.dag_history.db
+    @type filename: str
+    @rtype: dag.history.History
+    """
+    if not filename:
+        filename = default_history_filename()
+    if filename not in _histories:
+        _histories[filename] = History(filename)
+    return _histories[filename]
+
+
+def estimate_completion(root_dag):
+    """
+    Estimates the number of seconds until every process in the DAG has
+    finished. For the shell engine, the estimate is the larger of the
+    longest remaining critical path and the remaining work spread over the
+    available cores. Other engines are assumed to have enough slots, so
+    only the critical path counts. Time already spent by running processes
+    is taken into account.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @return: Estimated seconds remaining
+    @rtype: float
+    """
+    import time
+    from dag import Engine, States, FINISHED_STATES
+
+    now = time.time()
+
+    def remaining(proc):
+        estimate = root_dag.estimate_runtime(proc)
+        start_time = getattr(proc, "start_time", None)
+        if proc.state == States.RUNNING and start_time:
+            return max(estimate - (now - start_time), 0.0)
+        return estimate
+
+    lengths = root_dag.critical_path_lengths(estimator=remaining)
+    if not lengths:
+        return 0.0
+    if root_dag.engine != Engine.SHELL:
+        return max(lengths.values())
+    work = sum([remaining(proc) for proc in root_dag.processes
+                if proc.state not in FINISHED_STATES])
+    slots = getattr(root_dag, "num_cores", None) or 1
+    return max(max(lengths.values()), work / slots)
+
+
+def format_duration(seconds):
+    """
+    Formats a number of seconds as hours, minutes and seconds.
+
+    @rtype: str
+    """
+    seconds = int(round(seconds))
+    return "%d:%02d:%02d" % (seconds // 3600, (seconds % 3600) // 60,
+                             seconds % 60)
@@ -0,0 +1,341 @@
+"""
+dag.logstore
+============
+
+@author: David Coss, PhD
+@date: October 19, 2026
+@license: GPL version 3 (see COPYING or
+ http://www.gnu.org/licenses/gpl.html for details)
+
+Segmented store of the standard output and error of processes. Without
+a store, each process writes <workunit name>.stdout and
+<workunit name>.stderr to the working directory, which leaves two files
+per process. With a store, output is spooled to anonymous temporary
+files while the process runs. When it finishes, the output is appended
+to a large segment file in the store directory. An SQLite index maps
+workunit names to the segment, offset and length of their output, so
+that "update_dag log <name>" reads it with a single seek.
+
+Each stream is optionally compressed with zlib and cut off after a
+number of bytes (the cap). Appends from concurrent processes are
+serialized by a lock on the store. The settings of a store are kept in
+its directory, so that writers only need its path.
+
+The cap bounds the size of the store, not the disk used while processes
+run. Processes write to their spool files directly, so a spool file
+holds all of the output of its process until it finishes, and the
+output beyond the cap is only dropped then. A process that writes
+without end can therefore fill the temporary directory (see TMPDIR),
+which should have room for the full output of the processes that run at
+once.
+"""
+import logging
+
+L = logging.getLogger("dag.logstore")
+
+# Bytes of each stream that are kept. Output beyond this is dropped when
+# it is appended to the store.
+DEFAULT_CAP = 16 * 1024 ** 2
+# Size after which a new segment is started
+DEFAULT_SEGMENT_SIZE = 256 * 1024 ** 2
+STREAMS = ("stdout", "stderr")
+CONFIG_FILENAME = "config.json"
+INDEX_FILENAME = "index.db"
+LOCK_FILENAME = "lock"
+BLOCK_SIZE = 1024 ** 2
+
+# Open LogStore objects by directory
+_stores = {}
+
+
+class LogStore(object):
+    """
+    Store of process output in segment files.
+
+    @ivar directory: Directory of the store
+    @type directory: str
+    @ivar cap: Bytes of each stream that are kept, or None for no limit.
+     It does not limit the spool files (see open_outputs).
+    @type cap: int
+    @ivar compress: Whether or not output is compressed
+    @type compress: bool
+    @ivar segment_size: Size after which a new segment is started
+    @type segment_size: int
+    """
+    def __init__(self, directory):
+        import json
+        import os.path as OP
+        self.directory = OP.abspath(directory)
+        self.cap = DEFAULT_CAP
+        self.compress = True
+        self.segment_size = DEFAULT_SEGMENT_SIZE
+        self.connection = None
+        self.pid = None  # Process that opened the connection
+        config_filename = OP.join(self.directory, CONFIG_FILENAME)
+        if OP.isfile(config_filename):
+            with open(config_filename, "r") as config_file:
+                config = json.load(config_file)
+            self.cap = config.get("cap", self.cap)
+            self.compress = config.get("compress", self.compress)
+            self.segment_size = config.get("segment_size", self.segment_size)
+
+    @staticmethod
+    def create(directory, cap=DEFAULT_CAP, compress=True,
+               segment_size=DEFAULT_SEGMENT_SIZE):
+        """
+        Creates a store, or changes the settings of an existing one.
+
+        @param directory: Directory of the store
+        @type directory: str
+        @param cap: Bytes of each stream that are kept, or None for no limit
+        @type cap: int
+        @param compress: Whether or not output is compressed
+        @type compress: bool
+        @param segment_size: Size after which a new segment is started
+        @type segment_size: int
+        @return: The store
+        @rtype: dag.logstore.LogStore
+        """
+        import json
+        import os
+        import os.path as OP
+        if not OP.isdir(directory):
+            os.makedirs(directory)
+        with open(OP.join(directory, CONFIG_FILENAME), "w") as config_file:
+            json.dump({"cap": cap, "compress": compress,
+                       "segment_size": segment_size}, config_file)
+        _stores.pop(OP.abspath(directory), None)
+        return get_log_store(directory)
+
+    def connect(self):
+        """
+        Opens the index, creating its table if needed.
+
+        @rtype: sqlite3.Connection
+        """
+        import os
+        import os.path as OP
+        import sqlite3
+        if self.pid != os.getpid():
+            # Forked child. The connection belongs to the parent.
+            self.connection = None
+        if self.connection is None:
+            self.pid = os.getpid()
+            self.connection = sqlite3.connect(
+                OP.join(self.directory, INDEX_FILENAME), timeout=30)
+            self.connection.execute(
+                "create table if not exists logs ("
+                "workunit_name text, stream text, segment integer,"
+                " offset integer, length integer, size integer,"
+                " compressed integer, time real)")
+            self.connection.execute(
+                "create index if not exists logs_by_name"
+                " on logs (workunit_name, stream)")
+            self.connection.commit()
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def segment_filename(self, segment):
+        import os.path as OP
+        return OP.join(self.directory, "segment-%06d.log" % segment)
+
+    def current_segment(self):
+        """
+        Returns the number of the segment to which output is appended. Must
+        be called with the store locked.
+
+        @rtype: int
+        """
+        import os.path as OP
+        row = self.connect().execute(
+            "select max(segment) from logs").fetchone()
+        segment = row[0] or 1
+        filename = self.segment_filename(segment)
+        if (OP.isfile(filename)
+                and OP.getsize(filename) >= self.segment_size):
+            segment += 1
+        return segment
+
+    def append(self, workunit_name, stream, infile):
+        """
+        Appends the contents of a file, up to the cap, to the store.
+
+        @param workunit_name: Name of the process
+        @type workunit_name: str
+        @param stream: "stdout" or "stderr"
+        @type stream: str
+        @param infile: Open file holding the output. It is read from the
+         start.
+        @type infile: file
+        """
+        import fcntl
+        import os
+        import os.path as OP
+        import time
+        import zlib
+
+        infile.flush()
+        infile.seek(0, os.SEEK_END)
+        size = infile.tell()
+        infile.seek(0)
+        remaining = size if self.cap is None else min(size, self.cap)
+        with open(OP.join(self.directory, LOCK_FILENAME), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                segment = self.current_segment()
+                with open(self.segment_filename(segment), "ab") as outfile:
+                    outfile.seek(0, os.SEEK_END)
+                    offset = outfile.tell()
+                    compressor = None
+                    if self.compress:
+                        compressor = zlib.compressobj()
+                    while remaining > 0:
+                        block = infile.read(min(BLOCK_SIZE, remaining))
+                        if not block:
+                            break
+                        remaining -= len(block)
+                        if compressor:
+                            block = compressor.compress(block)
+                        outfile.write(block)
+                    if compressor:
+                        outfile.write(compressor.flush())
+                    length = outfile.tell() - offset
+                connection = self.connect()
+                connection.execute("insert into logs values (?,?,?,?,?,?,?,?)",
+                                   (workunit_name, stream, segment, offset,
+                                    length, size, int(self.compress),
+                                    time.time()))
+                connection.commit()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def read(self, workunit_name, stream="stdout"):
+        """
+        Reads the output of the latest run of a process.
+
+        @param workunit_name: Name of the process
+        @type workunit_name: str
+        @param stream: "stdout" or "stderr"
+        @type stream: str
+        @return: Output, followed by a note if it was cut off at the cap,
+         or None if the store has no output for the process
+        @rtype: str
+        """
+        import zlib
+        row = self.connect().execute(
+            "select segment, offset, length, size, compressed from logs"
+            " where workunit_name = ? and stream = ?"
+            " order by rowid desc limit 1",
+            (workunit_name, stream)).fetchone()
+        if row is None:
+            return None
+        (segment, offset, length, size, compressed) = row
+        with open(self.segment_filename(segment), "rb") as segment_file:
+            segment_file.seek(offset)
+            data = segment_file.read(length)
+        if compressed:
+            data = zlib.decompress(data)
+        if len(data) < size:
+            data += ("\n[%d bytes of %s were not kept]\n"
+                     % (size - len(data), stream))
+        return data
+
+
+def get_log_store(directory):
+    """
+    Returns the LogStore of a directory, opening it if needed.
+
+    @param directory: Directory of the store
+    @type directory: str
+    @rtype: dag.logstore.LogStore
+    """
+    import os.path as OP
+    directory = OP.abspath(directory)
+    if directory not in _stores:
+        _stores[directory] = LogStore(directory)
+    return _stores[directory]
+
+
+def open_outputs(workunit_name, log_store=None, cwd=None):
+    """
+    Opens the files to which a process writes its standard output and
+    error. Without a store, these are <workunit name>.stdout and
+    <workunit name>.stderr. With a store, they are anonymous temporary
+    files, which close_outputs appends to the store. The temporary files
+    are not capped: they grow with the output of the process until it
+    finishes, and only then is the output cut off at the cap of the store.
+
+    @param workunit_name: Name of the process
+    @type workunit_name: str
+    @param log_store: Optional directory of a LogStore
+    @type log_store: str
+    @param cwd: Directory of the output files. Default: current directory
+    @type cwd: str
+    @return: Standard output and standard error files
+    @rtype: tuple
+    """
+    import os.path as OP
+    import tempfile
+    if log_store:
+        return (tempfile.TemporaryFile(), tempfile.TemporaryFile())
+    return tuple([open(OP.join(cwd or "", "%s.%s" % (workunit_name, stream)),
+                       "w")
+                  for stream in STREAMS])
+
+
+def close_outputs(workunit_name, outputs, log_store=None):
+    """
+    Closes the files opened by open_outputs, after appending them to the
+    store, if there is one. Problems with the store are logged, rather
+    than raised, so that a run is never lost because of its output.
+
+    @param workunit_name: Name of the process
+    @type workunit_name: str
+    @param outputs: Files from open_outputs
+    @type outputs: tuple
+    @param log_store: Optional directory of a LogStore
+    @type log_store: str
+    """
+    import sqlite3
+    try:
+        if log_store:
+            store = get_log_store(log_store)
+            for (stream, outfile) in zip(STREAMS, outputs):
+                try:
+                    store.append(workunit_name, stream, outfile)
+                except (IOError, OSError, sqlite3.Error) as e:
+                    L.warning("Could not store %s of %s in %s: %s"
+                              % (stream, workunit_name, log_store, e))
+    finally:
+        for outfile in outputs:
+            outfile.close()
+
+
+def read_output(workunit_name, stream="stdout", log_store=None, cwd=None):
+    """
+    Reads the output of a process from the store or, without a store,
+    from its output file.
+
+    @param workunit_name: Name of the process
+    @type workunit_name: str
+    @param stream: "stdout" or "stderr"
+    @type stream: str
+    @param log_store: Optional directory of a LogStore
+    @type log_store: str
+    @param cwd: Directory of output files. Default: current directory
+    @type cwd: str
+    @return: Output, or None if there is none
+    @rtype: str
+    """
+    import os.path as OP
+    if log_store:
+        return get_log_store(log_store).read(workunit_name, stream)
+    filename = OP.join(cwd or "", "%s.%s" % (workunit_name, stream))
+    if not OP.isfile(filename):
+        return None
+    with open(filename, "r") as infile:
+        return infile.read()
@@ -24,6 +24,9 @@ class BjobsFailed(DagException):
 
 
 class LSFProcess(GridProcess):
+    __slots__ = ("executable_name", "app_profile", "project_name", "host",
+                 "rsc_memory_limit")
+
     def __init__(self, *args, **kmap):
         super(LSFProcess, self).__init__(*args)
         
@@ -89,12 +92,99 @@ def stage_files(proc, source_dir=None, set_grp_perms=True, overwrite=True):
                 if hasattr(proc, "host"):
                     if proc.host:
                         script_file.write("#BSUB -m {0}\n".format(proc.host))
+                if getattr(proc, "cwd", None):
+                    script_file.write("#BSUB -cwd {0}\n".format(proc.cwd))
                 script_file.write("\n%s\n" % command)
 
     cmd = get_command_string(proc)
     make_bsub(cmd, proc)
 
 
+def submit(proc_name, begin_time=None):
+    """
+    Submits the bsub script of a job.
+
+    @param proc_name: Name of the job (workunit name or bundle name)
+    @type proc_name: str
+    @param begin_time: Optional epoch time before which LSF does not
+     start the job (bsub -b)
+    @type begin_time: float
+    @raise JobSubmitFailed: If the job cannot be submitted
+    """
+    import subprocess
+    import time
+
+    options = ""
+    if begin_time and begin_time > time.time():
+        options = "-b %s " % time.strftime("%Y:%m:%d:%H:%M",
+                                           time.localtime(begin_time))
+    retval = subprocess.call("bsub %s< %s.bsub" % (options, proc_name),
+                             shell=True)
+    if retval:
+        from os.path import join
+        from os import getcwd
+        filename = join(getcwd(), "{0}.bsub".format(proc_name))
+        raise JobSubmitFailed("Could not submit job."
+                              " Bsub script name: {0}"
+                              .format(filename))
+
+
+def submit_notifier(proc_name, project_name, command="update"):
+    """
+    Submits a job that runs "update_dag <command> <proc_name>" when the
+    job named proc_name has ended.
+    """
+    import subprocess
+
+    notifier_project_name = project_name or "dag_notifier"
+    subprocess.call('bsub -P {1} -w "ended({0})" -J {0}_notifier'
+                    ' -app python-2.7.2 update_dag {2} {0}'
+                    .format(proc_name, notifier_project_name, command),
+                    shell=True)
+
+
+def stage_bundle(members, chain=False, log_store=None):
+    """
+    Writes the manifest and the bsub script of a bundle, which is named
+    after its first member. The bsub options are those of the first member,
+    since members have the same requirements.
+
+    A chain reports each finished member with "update_dag bundle <name>
+    --partial", so that the DAG shows its progress while it runs.
+
+    @param members: Processes in the bundle
+    @type members: list
+    @param chain: Whether or not the members are a linear chain
+    @type chain: bool
+    @param log_store: Optional directory of the log store to which the
+     output of members is written (see dag.logstore)
+    @type log_store: str
+    @return: Name of the bundle
+    @rtype: str
+    """
+    from dag.bundle import write_manifest
+    for proc in members:
+        if not proc.workunit_name:
+            stage_files(proc)
+    name = "%s-%s" % ("chain" if chain else "bundle", members[0].workunit_name)
+    progress_command = None
+    if chain:
+        progress_command = "update_dag bundle %s --partial" % name
+    write_manifest("%s.manifest" % name, name, members, chain,
+                   progress_command, log_store)
+    bundle_proc = LSFProcess("python", [], [],
+                             "-m dag.bundle {0}.manifest {0}.results"
+                             .format(name),
+                             rsc_memory_bound=getattr(members[0],
+                                                      "rsc_memory_bound",
+                                                      None))
+    bundle_proc.workunit_name = name
+    for attr in ["project_name", "app_profile", "host"]:
+        setattr(bundle_proc, attr, getattr(members[0], attr, None))
+    stage_files(bundle_proc)
+    return name
+
+
 def create_work(the_dag, dagfile):
     """
     Creates a workunit by processing the dag and running stage_files
@@ -102,6 +192,15 @@ def create_work(the_dag, dagfile):
 
     Sets the workunit information in the dag.GridProcess objects
 
+    If the DAG has a bundle duration (see dag.bundle), short runnable
+     processes are submitted together as bundles. If it fuses chains,
+     linear chains of processes are submitted as one job. The notifier of
+     a bundle or chain runs "update_dag bundle <name>".
+
+    Failed processes with retries left are submitted again at once, with
+     a begin time at the end of their retry delay (see dag.retry), since
+     LSF only calls back when a job ends.
+
     @param the_dag: DAG
     @type the_dag: dag.DAG
     @param dagfile: Path to dag file
@@ -111,37 +210,45 @@ def create_work(the_dag, dagfile):
      of a parent process.
     """
     import dag
-    import subprocess
+    from dag.pools import admit
+    from dag.retry import requeue_failures
+    from dag.tempfiles import TempFileCollector
 
-    for proc in the_dag.processes:
-        if proc.state not in [dag.States.CREATED, dag.States.STAGED]:
-            continue
-        if the_dag.incomplete_prereqs(proc):
-            continue
-        if not proc.workunit_name:
-            stage_files(proc)
-        retval = subprocess.call("bsub < %s.bsub"
-                                 % proc.workunit_name, shell=True)
-
-        if retval:
-            from os.path import join
-            from os import getcwd
-            filename = join(getcwd(),
-                            "{0}.bsub".format(proc.workunit_name))
-            raise JobSubmitFailed("Could not submit job."
-                                  " Bsub script name: {0}"
-                                  .format(filename))
-        notifier_project_name = "dag_notifier"
-        if hasattr(proc, "project_name"):
-            notifier_project_name = proc.project_name
-        retval = subprocess.call('bsub -P {1} -w "ended({0})" -J {0}_notifier'
-                                 ' -app python-2.7.2 update_dag update {0}'
-                                 .format(proc.workunit_name,
-                                         notifier_project_name),
-                                 shell=True)
-
-        proc.state = dag.States.RUNNING
+    # Temporary files whose consumers have succeeded are deleted while
+    # jobs are submitted (see dag.tempfiles).
+    collector = TempFileCollector(the_dag)
+    collector.update()
+    requeue_failures(the_dag, wait=False)
+    # Runnable processes are submitted critical path first. Those whose
+    # pool is full wait for a running member of the pool to end.
+    runnable = admit(the_dag, the_dag.generate_runnable_list())
+    units = [([proc], False) for proc in runnable]
+    bundle_duration = getattr(the_dag, "bundle_duration", None)
+    fuse_chains = getattr(the_dag, "fuse_chains", False)
+    if bundle_duration or fuse_chains:
+        from dag.bundle import plan_units
+        units = plan_units(the_dag, runnable, bundle_duration, fuse_chains)
+    for (members, chain) in units:
+        proc = members[0]
+        project_name = getattr(proc, "project_name", None)
+        begin_time = max(getattr(member, "retry_after", None)
+                         for member in members)
+        if len(members) > 1:
+            name = stage_bundle(members, chain,
+                                getattr(the_dag, "log_store", None))
+            submit(name, begin_time)
+            submit_notifier(name, project_name, "bundle")
+        else:
+            if not proc.workunit_name:
+                stage_files(proc)
+            submit(proc.workunit_name, begin_time)
+            submit_notifier(proc.workunit_name, project_name)
+
+        for member in members:
+            member.state = dag.States.RUNNING
         the_dag.save()
+    collector.close()
+    the_dag.save()
 
 
 def clean_workunit(root_dag, proc):
@@ -156,7 +263,7 @@ def clean_workunit(root_dag, proc):
     proc.clean_temp_files()
 
 
-def get_state(proc):
+def get_state(proc, job_name=None):
     """
     Gets the state of the process using bjobs and returns the corresponding
      dag.States value. If bjobs does not find the job based on the job name,
@@ -164,25 +271,28 @@ def get_state(proc):
 
     @param proc: Process to be found
     @type proc: dag.Process
+    @param job_name: Optional name of the job. Default: workunit name
+    @type job_name: str
     @return: Process State
     @rtype: dag.States
     @raise BjobsFailed: If the job cannot be found by bjobs.
     """
     import subprocess as SP
     from dag import States
-    bjobs = SP.Popen("bjobs -a -J {0}".format(proc.workunit_name)
+    job_name = job_name or proc.workunit_name
+    bjobs = SP.Popen("bjobs -a -J {0}".format(job_name)
                      .split(), stdout=SP.PIPE, stderr=SP.PIPE)
     retval = bjobs.wait()
     (stdout, stderr) = bjobs.communicate()
     if retval:
         raise BjobsFailed("Could not get status of job {0}\nRetval: {1}\n"
                           "Message: {2}"
-                          .format(proc.workunit_name, retval, stderr))
+                          .format(job_name, retval, stderr))
 
     if not stdout:
         raise BjobsFailed("Could not get status of job {0}\nRetval: {1}\n"
                           "Message: {2}"
-                          .format(proc.workunit_name, retval, stderr))
+                          .format(job_name, retval, stderr))
 
     if "RUN" in stdout:
         return States.RUNNING
@@ -195,4 +305,209 @@ def get_state(proc):
 
     raise BjobsFailed("Could not get status of job {0}\nRetval: {1}\n"
                       "Message: {2}"
-                      .format(proc.workunit_name, retval, stderr))
+                      .format(job_name, retval, stderr))
+
+
+def parse_lsf_quantity(text, units):
+    """
+    Parses a bjobs quantity such as "35 Mbytes" or "12.5 second(s)".
+
+    @param text: Value printed by bjobs
+    @type text: str
+    @param units: Dict mapping lower case unit prefixes to multipliers
+    @type units: dict
+    @return: Value in base units, or None if bjobs did not report one
+    @rtype: float
+    """
+    tokens = text.strip().split()
+    if not tokens or tokens[0] == "-":
+        return None
+    try:
+        value = float(tokens[0])
+    except ValueError:
+        return None
+    if len(tokens) > 1:
+        for (prefix, multiplier) in units.items():
+            if tokens[1].lower().startswith(prefix):
+                return value * multiplier
+    return value
+
+
+def get_run_record(proc):
+    """
+    Gets the run time, exit code, peak memory and CPU time of a finished
+     job using bjobs.
+
+    @param proc: Process to be found
+    @type proc: dag.Process
+    @return: Dict with "run_time", "exit_code", "max_rss" (bytes) and
+     "cpu_time" (seconds). Values bjobs does not report are None.
+    @rtype: dict
+    @raise BjobsFailed: If the job cannot be found by bjobs.
+    """
+    import subprocess as SP
+    fields = ["run_time", "exit_code", "max_mem", "cpu_used"]
+    bjobs = SP.Popen(["bjobs", "-a", "-noheader", "-o",
+                      "%s delimiter='|'" % " ".join(fields),
+                      "-J", proc.workunit_name],
+                     stdout=SP.PIPE, stderr=SP.PIPE)
+    (stdout, stderr) = bjobs.communicate()
+    lines = [line for line in stdout.splitlines() if "|" in line]
+    if bjobs.returncode or not lines:
+        raise BjobsFailed("Could not get run record of job {0}\n"
+                          "Retval: {1}\nMessage: {2}"
+                          .format(proc.workunit_name, bjobs.returncode,
+                                  stderr))
+
+    # The most recent job with the name is listed last.
+    values = dict(zip(fields, lines[-1].split("|")))
+    seconds = {"s": 1}
+    memory = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4,
+              "b": 1}
+    exit_code = parse_lsf_quantity(values.get("exit_code", ""), {})
+    max_rss = parse_lsf_quantity(values.get("max_mem", ""), memory)
+    return {"run_time": parse_lsf_quantity(values.get("run_time", ""),
+                                           seconds),
+            "exit_code": int(exit_code or 0),
+            "max_rss": int(max_rss) if max_rss is not None else None,
+            "cpu_time": parse_lsf_quantity(values.get("cpu_used", ""),
+                                           seconds)}
+
+
+def record_run(proc, history_filename=None):
+    """
+    Adds a finished job to the run history, using the values reported
+    by bjobs. Problems getting the values are logged and ignored.
+
+    @param proc: Finished process
+    @type proc: dag.Process
+    @param history_filename: Optional path to history database
+    @type history_filename: str
+    """
+    import logging
+    import time
+    from dag.history import get_history
+
+    try:
+        record = get_run_record(proc)
+    except (BjobsFailed, OSError) as e:
+        logging.getLogger("dag.lsf").warning("Not recording run of %s: %s"
+                                             % (proc.workunit_name, e))
+        return
+    end_time = time.time()
+    start_time = end_time - (record["run_time"] or 0)
+    proc.start_time = start_time
+    proc.end_time = end_time
+    get_history(history_filename).record(proc, start_time, end_time,
+                                         record["exit_code"],
+                                         record["max_rss"],
+                                         record["cpu_time"])
+
+
+def cancel_job(job_name):
+    """
+    Kills a job with bkill.
+
+    @param job_name: Name of the job
+    @type job_name: str
+    """
+    import subprocess
+    subprocess.call(["bkill", "-J", job_name])
+
+
+def speculate(root_dag):
+    """
+    Submits speculative copies of running jobs that are stragglers (see
+    dag.speculate), using the run time reported by bjobs. Each process is
+    copied at most once. A copy runs in its scratch directory under the
+    job name <workunit name>.speculative. Its notifier runs "update_dag
+    speculated <copy name>" (see copy_ended).
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @return: Processes that were copied
+    @rtype: list
+    """
+    import copy
+    import os.path as OP
+    from dag import States
+    from dag.speculate import copy_name, find_stragglers, make_scratch
+
+    def elapsed(proc):
+        try:
+            return get_run_record(proc)["run_time"]
+        except (BjobsFailed, OSError):
+            return None
+
+    candidates = [proc for proc
+                  in root_dag.get_processes_by_state(States.RUNNING)
+                  if isinstance(proc, LSFProcess)
+                  and not getattr(proc, "speculated", False)]
+    copied = []
+    for proc in find_stragglers(root_dag, candidates, elapsed):
+        twin = copy.copy(proc)
+        twin.workunit_name = copy_name(proc)
+        twin.cwd = OP.abspath(make_scratch(proc))
+        if "/" in twin.executable_name:
+            twin.executable_name = OP.abspath(twin.executable_name)
+        stage_files(twin)
+        submit(twin.workunit_name)
+        submit_notifier(twin.workunit_name, getattr(proc, "project_name",
+                                                    None), "speculated")
+        proc.speculated = True
+        proc.speculative_copy = twin.workunit_name
+        copied.append(proc)
+    return copied
+
+
+def copy_ended(root_dag, name):
+    """
+    Acts on the end of a speculative copy. A copy that succeeds while the
+    original is still running wins. The original is then killed and the
+    output files of the copy are installed when its notifier reports that
+    it has ended (see original_ended). Otherwise, the copy is discarded.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @param name: Job name of the copy
+    @type name: str
+    @return: Original process, or None if the copy is no longer tracked
+    @rtype: dag.Process
+    """
+    from dag import States
+    from dag.speculate import SUFFIX, discard_scratch
+    proc = root_dag.get_process(name[:-len(SUFFIX)])
+    if proc is None or getattr(proc, "speculative_copy", None) != name:
+        return None
+    try:
+        state = get_state(proc, name)
+    except BjobsFailed:
+        state = States.FAIL
+    if state == States.SUCCESS and proc.state == States.RUNNING:
+        proc.copy_won = True
+        cancel_job(proc.workunit_name)
+    else:
+        discard_scratch(proc)
+        proc.speculative_copy = None
+    return proc
+
+
+def original_ended(proc):
+    """
+    Acts on the end of a process that has a speculative copy. If the copy
+    has already succeeded, its output files are installed and the process
+    succeeds, even though it was killed. Otherwise, the copy is killed.
+
+    @param proc: Process that has ended
+    @type proc: dag.Process
+    """
+    from dag import States
+    from dag.speculate import discard_scratch, install_outputs
+    if getattr(proc, "copy_won", False):
+        if install_outputs(proc):
+            proc.state = States.SUCCESS
+    else:
+        cancel_job(proc.speculative_copy)
+        discard_scratch(proc)
+    proc.copy_won = False
+    proc.speculative_copy = None
@@ -0,0 +1,203 @@
+"""
+dag.placement
+=============
+
+@author: David Coss, PhD
+@date: October 19, 2026
+@license: GPL version 3 (see COPYING or
+ http://www.gnu.org/licenses/gpl.html for details)
+
+Placement of shell processes on CPUs. Without placement, the kernel may
+move a process between the sockets of a machine, away from the memory it
+has already touched, which slows down memory bound processes. With
+placement (gsub --pin-cores), the shell engine gives each process its own
+set of CPUs, as many as the cores it requests, and pins the forked child
+to them, so that the command and everything it starts stay there.
+
+A process that fits in one NUMA node is kept within it. The node with the
+fewest free CPUs that still has room is chosen, so that whole nodes stay
+free for processes with many threads. CPUs are returned to the pool when
+the process finishes. If there are not enough free CPUs, e.g. because
+more cores than CPUs were given to gsub, the process is not pinned.
+"""
+import logging
+
+L = logging.getLogger("dag.placement")
+
+NODE_DIRECTORY = "/sys/devices/system/node"
+# Number of CPUs in the mask passed to sched_setaffinity (see set_affinity)
+CPU_SETSIZE = 1024
+
+
+def parse_cpu_list(text):
+    """
+    Parses a list of CPUs in the format of the kernel, e.g. "0-3,8,10-11".
+
+    @param text: CPU list
+    @type text: str
+    @return: CPU numbers
+    @rtype: list
+    """
+    cpus = []
+    for token in text.strip().split(","):
+        if not token:
+            continue
+        if "-" in token:
+            (first, last) = token.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(token))
+    return cpus
+
+
+def get_affinity(pid=0):
+    """
+    Returns the CPUs on which a process may run.
+
+    @param pid: Process ID. Default: this process
+    @type pid: int
+    @return: CPU numbers, or None if they cannot be determined
+    @rtype: list
+    """
+    import os
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(pid))
+    try:
+        with open("/proc/%s/status" % (pid or "self"), "r") as status:
+            for line in status:
+                if line.startswith("Cpus_allowed_list:"):
+                    return parse_cpu_list(line.split(":", 1)[1])
+    except IOError:
+        pass
+    return None
+
+
+def set_affinity(pid, cpus):
+    """
+    Pins a process to CPUs. Processes it starts afterwards inherit them.
+
+    @param pid: Process ID, 0 for this process
+    @type pid: int
+    @param cpus: CPU numbers
+    @type cpus: list
+    @return: Whether or not the process was pinned
+    @rtype: bool
+    """
+    import os
+    if hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(pid, cpus)
+            return True
+        except OSError:
+            return False
+    import ctypes
+    import sys
+    if not sys.platform.startswith("linux"):
+        return False
+    bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    mask = (ctypes.c_ulong * (CPU_SETSIZE // bits))()
+    for cpu in cpus:
+        mask[cpu // bits] |= 1 << (cpu % bits)
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+    except OSError:
+        return False
+    return libc.sched_setaffinity(pid, ctypes.sizeof(mask), mask) == 0
+
+
+def read_topology():
+    """
+    Returns the CPUs of each NUMA node on which this process may run. A
+    machine without NUMA information is a single node.
+
+    @return: Lists of CPU numbers
+    @rtype: list
+    """
+    import glob
+    import multiprocessing
+    import os.path as OP
+    allowed = get_affinity()
+    nodes = []
+    paths = glob.glob(OP.join(NODE_DIRECTORY, "node[0-9]*"))
+    for path in sorted(paths, key=lambda p: int(OP.basename(p)[4:])):
+        try:
+            with open(OP.join(path, "cpulist"), "r") as cpulist:
+                cpus = parse_cpu_list(cpulist.read())
+        except IOError:
+            continue
+        cpus = [cpu for cpu in cpus if allowed is None or cpu in allowed]
+        if cpus:
+            nodes.append(cpus)
+    if not nodes:
+        nodes = [allowed or range(multiprocessing.cpu_count())]
+    return nodes
+
+
+class CorePool(object):
+    """
+    CPUs of the machine, grouped by NUMA node, and the processes to which
+    they are assigned.
+
+    @ivar nodes: CPU numbers of each node
+    @type nodes: list
+    @ivar assigned: Map of names to the CPUs assigned to them
+    @type assigned: dict
+    """
+    def __init__(self, nodes=None):
+        """
+        @param nodes: Optional CPU numbers of each node. Default: the
+         topology of this machine (see read_topology)
+        @type nodes: list
+        """
+        if nodes is None:
+            nodes = read_topology()
+        self.nodes = nodes
+        self.assigned = {}
+
+    def free_cpus(self):
+        """
+        @return: CPUs of each node that are not assigned
+        @rtype: list
+        """
+        used = set()
+        for cpus in self.assigned.values():
+            used.update(cpus)
+        return [[cpu for cpu in node if cpu not in used]
+                for node in self.nodes]
+
+    def allocate(self, name, cores):
+        """
+        Assigns CPUs to a process. A process that fits in a node is given
+        CPUs of a single node. Larger processes span the nodes with the
+        most free CPUs.
+
+        @param name: Name of the process, which is used to release the CPUs
+        @type name: str
+        @param cores: Number of CPUs
+        @type cores: int
+        @return: CPU numbers, or None if there are not enough free CPUs
+        @rtype: list
+        """
+        cores = max(int(cores or 1), 1)
+        free = self.free_cpus()
+        fitting = [cpus for cpus in free if len(cpus) >= cores]
+        if fitting:
+            chosen = min(fitting, key=len)[:cores]
+        elif sum([len(cpus) for cpus in free]) >= cores:
+            chosen = []
+            for cpus in sorted(free, key=len, reverse=True):
+                chosen.extend(cpus[:cores - len(chosen)])
+        else:
+            L.debug("Not enough free CPUs to pin %s" % name)
+            return None
+        self.assigned[name] = chosen
+        return chosen
+
+    def release(self, name):
+        """
+        Returns the CPUs of a process to the pool.
+
+        @param name: Name given to allocate
+        @type name: str
+        """
+        self.assigned.pop(name, None)
@@ -0,0 +1,91 @@
+"""
+dag.pools
+=========
+
+@author: David Coss, PhD
+@date: October 19, 2026
+@license: GPL version 3 (see COPYING or
+ http://www.gnu.org/licenses/gpl.html for details)
+
+Named concurrency pools. Some processes share a resource other than cores
+and memory, e.g. a disk or the licences of a tool, and slow each other
+down, or fail, when too many run at once. In a gsub script,
+"%pool NAME CAP" puts the processes that follow in the pool NAME, of
+which at most CAP processes run at a time. "%pool NAME" reuses a pool
+defined earlier and "%pool none" ends the pool.
+
+The caps are kept in the pools attribute of the DAG and the pool of a
+process in its pool attribute. Every engine passes its runnable
+processes through admit, which holds back those whose pool is full, so
+that the free slots are filled with other processes.
+"""
+import logging
+
+L = logging.getLogger("dag.pools")
+
+NO_POOL = "none"
+
+
+def pool_usage(root_dag):
+    """
+    Counts the running processes of each pool. Each running instance of a
+    sweep counts as a process. Sweeps whose values have not been resolved
+    have none.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @return: Dict mapping pool names to numbers of running processes
+    @rtype: dict
+    """
+    from dag import States
+    from dag.shell import SweepProcess
+    usage = {}
+    for proc in root_dag.processes:
+        pool = getattr(proc, "pool", None)
+        if not pool:
+            continue
+        if isinstance(proc, SweepProcess):
+            running = 0
+            if proc.state_counts is not None:
+                running = proc.state_counts[States.RUNNING]
+        else:
+            running = int(proc.state == States.RUNNING)
+        usage[pool] = usage.get(pool, 0) + running
+    return usage
+
+
+def admit(root_dag, runnable, usage=None):
+    """
+    Chooses the runnable processes that may start without exceeding the
+    caps of their pools. The order of the processes is kept. Processes
+    without a pool, or in a pool without a cap, are always admitted.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @param runnable: Processes that are ready to be started, in order of
+     preference
+    @type runnable: list
+    @param usage: Optional result of pool_usage, which is updated with the
+     admitted processes, so that it may be passed to the next call.
+     Default: current usage
+    @type usage: dict
+    @return: Admitted processes
+    @rtype: list
+    """
+    caps = getattr(root_dag, "pools", None)
+    if not caps:
+        return list(runnable)
+    if usage is None:
+        usage = pool_usage(root_dag)
+    admitted = []
+    for proc in runnable:
+        pool = getattr(proc, "pool", None)
+        if pool in caps:
+            if usage.get(pool, 0) >= caps[pool]:
+                L.debug("Holding back %s, as pool %s is full"
+                        % (getattr(proc, "workunit_name", None) or proc.cmd,
+                           pool))
+                continue
+            usage[pool] = usage.get(pool, 0) + 1
+        admitted.append(proc)
+    return admitted
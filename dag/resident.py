@@ -0,0 +1,291 @@
+"""
+dag.resident
+============
+
+@author: David Coss, PhD
+@date: October 19, 2026
+@license: GPL version 3 (see COPYING or
+ http://www.gnu.org/licenses/gpl.html for details)
+
+Resident update_dag server. "update_dag serve" keeps the modules of dag
+and the DAG loaded in one process, which listens on a unix socket next
+to the DAG file (<DAG file>.sock). When the socket exists, the update_dag
+script forwards its command to the server, instead of loading the DAG
+itself, so that notifier jobs pay only for starting Python and
+connecting. If no server answers, the command is run locally as before.
+
+Requests and replies are single JSON objects. The server runs one
+command at a time, in the working directory of the client. The DAG is
+loaded again whenever the file on disk has been replaced, e.g. when the
+shell master or a local update_dag has saved it. After a command, the
+DAG is kept only if the file on disk is unchanged or was written by the
+command itself. Otherwise, another writer saved in the meantime, and the
+DAG is loaded again for the next command. Commands run by the
+server use the environment of the server, rather than that of the client.
+"""
+import logging
+
+L = logging.getLogger("dag.resident")
+
+SOCKET_SUFFIX = ".sock"
+# Seconds without a request after which the server exits. 0 means never.
+DEFAULT_IDLE_TIMEOUT = 600
+# Commands that are never forwarded
+LOCAL_COMMANDS = ["help", "serve"]
+
+
+def socket_path(dagfile):
+    """
+    Returns the path of the socket of the server of a DAG file.
+
+    @param dagfile: Path to DAG file
+    @type dagfile: str
+    @rtype: str
+    """
+    import os.path as OP
+    return OP.abspath(dagfile) + SOCKET_SUFFIX
+
+
+def can_forward(args):
+    """
+    Determines whether or not a command may be run by the server. Commands
+    that read from standard input are run locally.
+
+    @param args: Command and its arguments
+    @type args: list
+    @rtype: bool
+    """
+    if not args or args[0] in LOCAL_COMMANDS:
+        return False
+    return not (args[0] == "remove" and "all" in args[1:])
+
+
+def forward(dagfile, args, output=None):
+    """
+    Sends a command to the server of a DAG file and writes its output.
+
+    @param dagfile: Path to DAG file
+    @type dagfile: str
+    @param args: Command and its arguments
+    @type args: list
+    @param output: Stream to which the output is written. Default: stdout
+    @type output: file
+    @return: Exit status of the command, or None if no server is running,
+     in which case the command should be run locally.
+    @rtype: int
+    """
+    import json
+    import os
+    import socket
+    import sys
+
+    path = socket_path(dagfile)
+    if not can_forward(args) or not os.path.exists(path):
+        return None
+    if output is None:
+        output = sys.stdout
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            client.connect(path)
+        except socket.error:
+            return None  # Stale socket. The server has exited.
+        client.sendall(json.dumps({"args": args, "cwd": os.getcwd()}) + "\n")
+        client.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = client.recv(64 * 1024)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        client.close()
+    if not chunks:
+        # The command may have been run, so it is not run again.
+        output.write("The update_dag server closed the connection.\n")
+        return 1
+    reply = json.loads("".join(chunks))
+    output.write(reply["output"])
+    return reply["status"]
+
+
+def run_command(root_dag, args):
+    """
+    Runs an update_dag command, as the update_dag script would.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @param args: Command and its arguments
+    @type args: list
+    @return: Output of the command
+    @rtype: str
+    """
+    from dag.update_dag import REPORT_COMMANDS, modify_dag, report_lines
+    (cmd, cmd_args) = (args[0], args[1:])
+    if cmd in REPORT_COMMANDS:
+        return "".join(report_lines(root_dag, cmd, cmd_args))
+    return "%s\n" % modify_dag(root_dag, cmd, cmd_args, False)
+
+
+class ResidentServer(object):
+    """
+    Server that runs update_dag commands against a DAG kept in memory.
+
+    @ivar dagfile: Absolute path to DAG file
+    @type dagfile: str
+    @ivar root_dag: Loaded DAG, or None if it must be loaded
+    @type root_dag: dag.DAG
+    """
+    def __init__(self, dagfile):
+        import os.path as OP
+        import socket
+        self.dagfile = OP.abspath(dagfile)
+        self.root_dag = None
+        self.loaded = None  # Identity of the file that was loaded
+        self.path = socket_path(dagfile)
+        if OP.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                import os
+                os.unlink(self.path)  # Left by a server that died
+            else:
+                from dag import DagException
+                raise DagException("A server is already running on %s"
+                                   % self.path)
+            finally:
+                probe.close()
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen(16)
+
+    def file_identity(self):
+        """
+        Identifies the DAG file on disk. DAG.save renames a new file over
+         the old one, so the inode changes with every save.
+
+        @rtype: tuple
+        """
+        import os
+        st = os.stat(self.dagfile)
+        return (st.st_dev, st.st_ino, st.st_mtime, st.st_size)
+
+    def current_dag(self):
+        """
+        Returns the DAG, loading it again if the file has been replaced.
+
+        @rtype: dag.DAG
+        """
+        import dag
+        identity = self.file_identity()
+        if self.root_dag is None or identity != self.loaded:
+            L.debug("Loading %s" % self.dagfile)
+            self.root_dag = dag.load(self.dagfile)
+            self.root_dag.filename = self.dagfile
+            self.loaded = identity
+        return self.root_dag
+
+    def handle(self, connection):
+        """
+        Reads one request, runs it and sends the reply.
+
+        @param connection: Connected client socket
+        @type connection: socket.socket
+        """
+        import json
+        import os
+        import sys
+        from StringIO import StringIO
+
+        chunks = []
+        while True:
+            chunk = connection.recv(64 * 1024)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        request = json.loads("".join(chunks))
+        args = request["args"]
+        cwd = os.getcwd()
+        captured = StringIO()
+        stdout = sys.stdout
+        status = 0
+        try:
+            os.chdir(request["cwd"])
+            sys.stdout = captured
+            if not can_forward(args):
+                raise Exception("%s cannot be run by the server" % args[0])
+            root_dag = self.current_dag()
+            output = run_command(root_dag, args)
+            identity = self.file_identity()
+            if identity == getattr(root_dag, "saved_identity", None):
+                self.loaded = identity  # Saved by this command
+            elif identity != self.loaded:
+                self.root_dag = None  # Saved by another writer
+        except Exception as e:
+            L.debug("%s failed: %s" % (" ".join(args), e))
+            output = ("Error running '%s'\nMessage: %s\n"
+                      % (args[0] if args else "", e))
+            status = 1
+            self.root_dag = None  # It may have been changed, but not saved.
+        finally:
+            sys.stdout = stdout
+            os.chdir(cwd)
+        connection.sendall(json.dumps({"output": captured.getvalue() + output,
+                                       "status": status}))
+
+    def serve(self, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        """
+        Answers requests until no request has arrived for idle_timeout
+        seconds.
+
+        @param idle_timeout: Seconds. If 0 or None, the server runs until
+         it is killed.
+        @type idle_timeout: float
+        """
+        import select
+        L.info("Serving %s on %s" % (self.dagfile, self.path))
+        while True:
+            (readable, _, _) = select.select([self.listener], [], [],
+                                             idle_timeout or None)
+            if not readable:
+                L.info("No requests for %s seconds. Exiting."
+                       % idle_timeout)
+                return
+            (connection, _) = self.listener.accept()
+            try:
+                self.handle(connection)
+            except Exception as e:
+                L.warning("Could not answer request: %s" % e)
+            finally:
+                connection.close()
+
+    def close(self):
+        import os
+        self.listener.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def serve(dagfile, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """
+    Runs a resident server for a DAG file until it is idle for
+    idle_timeout seconds or is terminated.
+
+    @param dagfile: Path to DAG file
+    @type dagfile: str
+    @param idle_timeout: Seconds. If 0 or None, the server runs until
+     it is killed.
+    @type idle_timeout: float
+    """
+    import signal
+
+    def terminate(signum, frame):
+        raise SystemExit(0)
+
+    server = ResidentServer(dagfile)
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        server.serve(idle_timeout)
+    finally:
+        server.close()
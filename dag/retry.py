@@ -0,0 +1,107 @@
+"""
+dag.retry
+=========
+
+@author: David Coss, PhD
+@date: October 19, 2026
+@license: GPL version 3 (see COPYING or
+ http://www.gnu.org/licenses/gpl.html for details)
+
+Automatic retries of failed processes. A process may be given a retry
+budget with "%define retries N" in its gsub script. When such a process
+fails and has retries left, it is moved to the RETRY state and waits
+before it is run again. The wait doubles with each attempt, starting at
+"%define retry_delay SECONDS" (default: one minute) and limited to an
+hour. Once the budget is spent, the process stays in FAIL, which is the
+terminal failure state. Processes that were cancelled are not retried.
+
+The schedulers call requeue_failures before they look for runnable
+processes, so every engine re-queues failures the same way. LSF and BOINC
+resubmit when a failure is reported with "update_dag update". LSF holds
+the job until its delay has passed (bsub -b). BOINC cannot delay the
+start of a workunit, so it runs a retry as soon as the failure is
+reported, without the backoff.
+"""
+import logging
+
+L = logging.getLogger("dag.retry")
+
+# Seconds before the first retry
+DEFAULT_RETRY_DELAY = 60
+# Longest wait between attempts
+MAX_RETRY_DELAY = 3600
+
+
+def retry_delay(proc):
+    """
+    Returns the number of seconds to wait before the next attempt of a
+    process. The delay doubles with each attempt.
+
+    @param proc: Failed process
+    @type proc: dag.Process
+    @rtype: float
+    """
+    base = getattr(proc, "retry_delay", DEFAULT_RETRY_DELAY)
+    attempts = getattr(proc, "attempts", 0)
+    return min(base * 2 ** attempts, MAX_RETRY_DELAY)
+
+
+def can_retry(proc):
+    """
+    Determines whether or not a failed process has retries left and was
+    not cancelled.
+
+    @param proc: Process
+    @type proc: dag.Process
+    @rtype: bool
+    """
+    return (getattr(proc, "attempts", 0) < getattr(proc, "retries", 0)
+            and not getattr(proc, "cancelled", False))
+
+
+def requeue_failures(root_dag, now=None, wait=True):
+    """
+    Moves failed processes that have retries left to RETRY and returns
+    processes in RETRY whose delay has passed to CREATED, so that they are
+    scheduled again. The DAG is not saved.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @param now: Epoch time. Default: current time
+    @type now: float
+    @param wait: If False, processes are returned to CREATED without
+     waiting for their delay to pass. The engine is then responsible for
+     not starting them before proc.retry_after, e.g. LSF's bsub -b.
+    @type wait: bool
+    @return: Processes moved to RETRY and processes returned to CREATED
+    @rtype: tuple
+    """
+    import time
+    from dag import States
+    from dag.shell import SweepProcess
+    if now is None:
+        now = time.time()
+    (retrying, released) = ([], [])
+    for proc in root_dag.get_processes_by_state((States.FAIL,
+                                                 States.RETRY)):
+        if proc.state == States.FAIL:
+            if not can_retry(proc):
+                continue
+            proc.retry_after = now + retry_delay(proc)
+            proc.attempts = getattr(proc, "attempts", 0) + 1
+            proc.state = States.RETRY
+            retrying.append(proc)
+            L.info("%s failed (%s). Retry %d of %d in %d seconds"
+                   % (getattr(proc, "workunit_name", None) or proc.cmd,
+                      getattr(proc, "failure_reason", None) or "error",
+                      proc.attempts, proc.retries, proc.retry_after - now))
+        if wait and getattr(proc, "retry_after", 0) > now:
+            continue
+        if isinstance(proc, SweepProcess):
+            # Only the instances that failed are run again.
+            for index in range(len(proc.instance_states)):
+                if proc.instance_states[index] == States.FAIL:
+                    proc.set_instance_state(index, States.CREATED)
+        proc.state = States.CREATED
+        released.append(proc)
+    return (retrying, released)
@@ -14,7 +14,7 @@ which may be found at https://github.com/kd0kfo/smq
 Interface module to POSIX shells.
 """
 
-from dag import Process, States, strstate
+from dag import Process, States, WAITING_STATES, strstate
 import logging
 
 L = logging.getLogger("dag.shell")
@@ -28,9 +28,45 @@ CLI_SENDER_PREFIX = "cli"
 MASTER_SENDER_NAME = "master"
 KILL_SIGNAL = "kill"
 
+# Reasons a shell process was stopped, which are sent to the master with
+# its state (see ShellProcess.start)
+REASON_CANCELLED = "cancelled"
+REASON_DEADLINE = "deadline"
+REASON_CPU_LIMIT = "cpu_limit"
+
+# Number of the pidfd_open system call in the syscall table shared by most
+# Linux architectures (see pidfd_open). Alpha, ia64 and MIPS number it
+# differently, so it is only used on the machines listed below.
+PIDFD_OPEN_SYSCALL = 434
+PIDFD_OPEN_MACHINES = ("x86_64", "amd64", "i386", "i486", "i586", "i686",
+                       "aarch64", "arm64", "armv6l", "armv7l", "armv8l",
+                       "ppc", "ppc64", "ppc64le", "s390x", "riscv64")
+
+# Seconds a cancelled process is given to stop after SIGTERM, before its
+# process group is sent SIGKILL
+CANCEL_GRACE_PERIOD = 10
+# Attributes holding the limits of a process (see ShellProcess)
+LIMIT_NAMES = ("deadline", "cpu_limit", "memory_limit")
+
+# Suffix of the file, next to the DAG file, listing the running children
+# of the master (see save_running_table).
+RUNNING_TABLE_SUFFIX = ".running"
+
 # Module variables
 kill_switch = False
 running_children = []
+reserved_resources = {}  # workunit name -> (cores, bytes of memory)
+core_pool = None  # dag.placement.CorePool, if processes are pinned to CPUs
+agent_server = None  # dag.agent.AgentServer, if agents are used
+sweep_instances = {}  # workunit name -> SweepInstance that has started
+log_store = None  # Directory of the dag.logstore.LogStore, if any
+adopted_pids = set()  # Children of an earlier master (see reattach)
+speculated = set()  # Workunit names of processes that have been copied
+speculative_copies = {}  # copy name -> original process (see dag.speculate)
+copy_winners = set()  # Workunit names of processes whose copy succeeded
+forked_pids = set()  # Children of the master that have not been waited for
+cancelling = {}  # PID -> time after which its process group is killed
+terminated = False  # Set in a forked child when it receives SIGTERM
 
 
 class ShellProcess(Process):
@@ -40,7 +76,24 @@ class ShellProcess(Process):
     Contains fields of dag.Process plus "nice" which corresponds to the
     "niceness" of the processes. The value of nice is added to the niceness
     of the process when it starts.
+
+    "cores" and "memory" are the resources the process requests from the
+    machine. The shell engine only starts the process once that many cores
+    and bytes of memory are free. A memory request of zero means the
+    process is not limited by memory.
+
+    A process may also be given limits, which are enforced while it runs
+    and are kept in __dict__, since older pickles lack them. "deadline" is
+    the number of seconds of wall-clock time after which the process is
+    stopped. "cpu_limit" is the number of seconds of CPU time (RLIMIT_CPU)
+    and "memory_limit" the number of bytes of address space (RLIMIT_AS)
+    that the process may use. A process that is stopped by a limit fails
+    with "failure_reason" set to REASON_DEADLINE or REASON_CPU_LIMIT, and
+    may be retried (see dag.retry). Allocations beyond the memory limit
+    fail, which the command reports as it sees fit.
     """
+    __slots__ = ("nice", "cores", "memory")
+
     def __init__(self, cmd, args):
         """
         @param cmd: Command to be executed
@@ -48,10 +101,13 @@ class ShellProcess(Process):
         @param args: List of arguments to be provided to the command (cmd)
         @type args: list
         """
+        from dag import intern_string
         super(ShellProcess, self).__init__()
-        self.cmd = cmd
+        self.cmd = intern_string(cmd)
         self.args = args
         self.nice = 0
+        self.cores = 1
+        self.memory = 0
 
     def __str__(self):
         """
@@ -70,52 +126,86 @@ class ShellProcess(Process):
 
         return strval
 
+    def resource_limits(self):
+        """
+        Returns the resource limits that are set in the forked process.
+        Limits are lowered to the hard limits of the master, which an
+        unprivileged process cannot raise.
+
+        @return: List of (resource, soft limit, hard limit) tuples
+        @rtype: list
+        """
+        return resource_limits(getattr(self, "cpu_limit", None),
+                               getattr(self, "memory_limit", None))
+
     def start(self):
         """
         Starts the shell processes.
 
         The nice value of this object is added to the nice value
-        of the forked process.
+        of the forked process, and its CPU and memory limits are set (see
+        resource_limits). If the process runs longer than its deadline, it
+        is sent SIGTERM, followed by SIGKILL after CANCEL_GRACE_PERIOD
+        seconds.
 
         Standard output and error are piped to files
-        named <workunit name>.stdout and <workunit name>.stderr, respectively.
-
-        The process runs until it exists or receives KILL_SIGNAL
-        from the master process.
+        named <workunit name>.stdout and <workunit name>.stderr, respectively,
+        or to the log store of the DAG, if it has one (see dag.logstore).
+
+        The process runs until it exits or is cancelled by the master,
+        which sends SIGTERM to the process group of the forked child (see
+        send_kill_signal). If the object has a "cwd" attribute, the
+        process runs in that directory, e.g. the scratch directory of a
+        speculative copy (see dag.speculate).
         """
         import subprocess
-        import time
 
         message_queue = self.message_queue
+        limits = self.resource_limits()
 
-        def set_niceness():
+        def cancelled():
+            if terminated:
+                return True
+            # Children of an earlier master may still be sent KILL_SIGNAL.
+            if message_queue.has_message(self.workunit_name):
+                message = message_queue.next(self.workunit_name)
+                return message.content == KILL_SIGNAL
+            return False
+
+        def prepare_child():
             if self.nice:
                 from os import nice
                 L.info("Changing niceness by %d" % self.nice)
                 nice(self.nice)
+            set_resource_limits(limits)
+
+        from dag.logstore import open_outputs, close_outputs
 
         L.info("Starting {0}".format(self.cmd))
-        stdout_file = open("%s.stdout" % self.workunit_name, "w")
-        stderr_file = open("%s.stderr" % self.workunit_name, "w")
+        outputs = open_outputs(self.workunit_name, log_store)
+        (stdout_file, stderr_file) = outputs
 
         shell_process = subprocess.Popen([self.cmd] + self.args,
-                                         preexec_fn=set_niceness,
+                                         cwd=getattr(self, "cwd", None),
+                                         preexec_fn=prepare_child,
                                          stdout=stdout_file,
                                          stderr=stderr_file)
-        while shell_process.poll() is None:
-            if message_queue.has_message(self.workunit_name):
-                message = message_queue.next(self.workunit_name)
-                if message.content == KILL_SIGNAL:
-                    L.debug("%s got kill signal" % self.workunit_name)
-                    shell_process.terminate()
-                    shell_process.wait()
-                    for F in (stdout_file, stderr_file):
-                        F.close()
-                    break
-            time.sleep(5)
-        exit_status = shell_process.poll()
+        (status, rusage, self.failure_reason) = wait_for_command(
+            shell_process, getattr(self, "deadline", None), cancelled,
+            self.workunit_name)
+        if self.failure_reason == REASON_CANCELLED:
+            self.killed = True
+        close_outputs(self.workunit_name, outputs, log_store)
+        shell_process.returncode = status_to_returncode(status)
+        exit_status = shell_process.returncode
+        self.exit_code = exit_status
+        self.rusage = rusage
+        if self.failure_reason is None:
+            self.failure_reason = limit_failure(
+                status, rusage, getattr(self, "cpu_limit", None))
         L.info("{0} Finished with exit code {1}".format(self.cmd, exit_status))
-        if exit_status:
+        if exit_status or self.failure_reason:
+            # A process that stopped cleanly at its deadline did not finish.
             self.state = States.FAIL
         else:
             self.state = States.SUCCESS
@@ -123,38 +213,399 @@ class ShellProcess(Process):
 
 class Waiter(ShellProcess):
     """
-    Subclass of shell process that can be used to monitor a process
-    that is not tracked in the DAG object. This object will be added
-    to the DAG. It will run until the process it is monitoring has
-    ended. Default polling period when monitoring is 60 seconds.
+    Subclass of shell process that can be used to monitor processes
+    that are not tracked in the DAG object. This object will be added
+    to the DAG. It will run until every process it is monitoring has
+    ended. The arguments are the PIDs of the processes.
+
+    The end of a process is detected with a pidfd (see pidfd_open), so
+    that the waiter finishes as soon as it exits. Where pidfds are not
+    available, the processes are checked every POLL_PERIOD seconds (see
+    is_waiting_on). The start time of each process is recorded from /proc
+    when the waiter is created, so that a new process that reuses a PID
+    is not waited for. Without /proc, the process is waited for while its
+    PID exists.
     """
+    __slots__ = ("POLL_PERIOD", "start_times")
+
     def __init__(self, cmd, args):
         super(Waiter, self).__init__(cmd, args)
         self.workunit_name = "waiting-%s" % args[0]
-        self.POLL_PERIOD = 60  # Seconds
+        if len(args) > 1:
+            self.workunit_name += "+%d" % (len(args) - 1)
+        self.POLL_PERIOD = 1  # Seconds
+        self.start_times = [process_start_time(int(pid)) for pid in args]
+
+    def start(self):
+        import errno
+        import os
+        import select
+
+        pids = [int(pid) for pid in self.args]
+        start_times = getattr(self, "start_times", None)
+        if start_times is None:  # Pickled before start times were kept
+            start_times = [process_start_time(pid) for pid in pids]
+        remaining = dict(zip(pids, start_times))
+        L.debug("Waiting on pids %s" % ", ".join(self.args))
+        poller = select.poll()
+        watched = {}  # pidfd -> PID
+        for pid in list(remaining):
+            fd = pidfd_open(pid)
+            if fd is not None:
+                poller.register(fd, select.POLLIN)
+                watched[fd] = pid
+            # The pidfd may refer to a process that reused the PID.
+            if not is_waiting_on(pid, remaining[pid]):
+                del remaining[pid]
+        try:
+            while remaining and not terminated:
+                timeout = None
+                if len(watched) < len(remaining):
+                    timeout = self.POLL_PERIOD * 1000
+                try:
+                    events = poller.poll(timeout)
+                except select.error as e:
+                    if e.args[0] != errno.EINTR:
+                        raise
+                    events = []  # Interrupted by SIGTERM
+                for (fd, event) in events:
+                    remaining.pop(watched[fd], None)
+                for pid in list(remaining):
+                    if not is_waiting_on(pid, remaining[pid]):
+                        del remaining[pid]
+                for fd in [fd for (fd, pid) in watched.items()
+                           if pid not in remaining]:
+                    poller.unregister(fd)
+                    os.close(fd)
+                    del watched[fd]
+        finally:
+            for fd in watched:
+                os.close(fd)
+        if terminated:
+            self.killed = True
+            self.state = States.FAIL
+        L.debug("No longer waiting on pids %s" % ", ".join(self.args))
+
+
+def is_waiting_on(pid, start_time):
+    """
+    Determines whether a process that a Waiter was created for is still
+    running. With /proc, the process must have the start time recorded
+    when the waiter was created, so that a new process that reuses the PID
+    does not count. Without /proc, the PID is checked with kill(pid, 0).
+
+    @param pid: Process ID
+    @type pid: int
+    @param start_time: Start time from process_start_time, or None
+    @type start_time: int
+    @rtype: bool
+    """
+    import errno
+    import os
+    import os.path as OP
+    if OP.isfile("/proc/self/stat"):
+        return (start_time is not None
+                and process_start_time(pid) == start_time)
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def pidfd_open(pid):
+    """
+    Opens a file descriptor that refers to a process and becomes readable
+    when the process exits. This requires Linux 5.3 or later.
+
+    @param pid: Process ID
+    @type pid: int
+    @return: File descriptor, or None if pidfds are not supported or the
+     process does not exist
+    @rtype: int
+    """
+    import os
+    import platform
+    import sys
+    if hasattr(os, "pidfd_open"):
+        try:
+            return os.pidfd_open(pid)
+        except OSError:
+            return None
+    if (not sys.platform.startswith("linux")
+            or platform.machine() not in PIDFD_OPEN_MACHINES):
+        return None
+    import ctypes
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+    except OSError:
+        return None
+    fd = libc.syscall(PIDFD_OPEN_SYSCALL, pid, 0)
+    if fd < 0:
+        return None
+    return fd
+
+
+def expand_values(tokens):
+    """
+    Turns the value tokens of a sweep into segments of values. A token
+    of the form "first..last" is an inclusive range of integers, which is
+    kept as a (first, stop) tuple. A token containing a wildcard is
+    replaced by the sorted list of matching paths. Any other token is a
+    literal value.
+
+    @param tokens: Value tokens
+    @type tokens: list
+    @return: Segments of values
+    @rtype: list
+    """
+    import glob
+    import re
+    segments = []
+    for token in tokens:
+        match = re.match(r"^(-?\d+)\.\.(-?\d+)$", token)
+        if match:
+            (first, last) = [int(i) for i in match.groups()]
+            segments.append((first, max(first, last + 1)))
+        elif any([c in token for c in "*?["]):
+            segments.append(sorted(glob.glob(token)))
+        else:
+            segments.append([token])
+    return segments
+
+
+class SweepProcess(ShellProcess):
+    """
+    One shell command run once for each of a list of values, e.g. once per
+    chunk file. The command and arguments are templates in which $VARIABLE
+    (or ${VARIABLE}) is replaced by the value of each instance.
+
+    Values are resolved when the sweep first becomes runnable, so that
+    wildcards match files created by earlier processes. Instances are
+    created only when they are started, and the DAG stores one byte of
+    state per instance. The sweep stays in its waiting state until every
+    instance has started. It then becomes RUNNING, and SUCCESS or FAIL
+    once every instance has finished.
+
+    @ivar variable: Name of the variable substituted in the arguments
+    @type variable: str
+    @ivar value_tokens: Values, ranges ("1..100") and wildcard patterns
+    @type value_tokens: list
+    @ivar segments: Resolved values (see expand_values), or None
+    @type segments: list
+    @ivar instance_states: State of each instance, once resolved
+    @type instance_states: array.array
+    """
+    __slots__ = ("variable", "value_tokens", "segments", "instance_states",
+                 "state_counts")
+
+    def __init__(self, cmd, args, variable, value_tokens):
+        super(SweepProcess, self).__init__(cmd, args)
+        self.variable = variable
+        self.value_tokens = value_tokens
+        self.segments = None
+        self.instance_states = None
+        self.state_counts = None
+
+    def __str__(self):
+        strval = super(SweepProcess, self).__str__()
+        strval += "\nSweep over ${0}: {1}".format(self.variable,
+                                                  " ".join(self.value_tokens))
+        if self.instance_states is not None:
+            strval += "\nInstances: {0}".format(len(self.instance_states))
+            strval += "".join([" {0}: {1}".format(strstate(state), count)
+                               for (state, count)
+                               in enumerate(self.state_counts) if count])
+        return strval
 
     def start(self):
-        import time
-
-        def check_pid(thepid):
-            from os import kill
-            import errno
-            try:
-                kill(thepid, 0)
-            except OSError as ose:
-                if errno.ESRCH == ose.errno:
-                    return False
-            return True
-
-        pid = int(self.args[0])
-        L.debug("Waiting on pid %d" % pid)
-        while check_pid(pid):
-            time.sleep(self.POLL_PERIOD)
-        L.debug("No longer waiting on pid %d" % pid)
-
-
-def parse_shell(cmd, args, header_map, parsers, init_code=None):
-    if not cmd in parsers:
+        from dag import DagException
+        raise DagException("Sweeps are run one instance at a time")
+
+    def resolve(self):
+        """
+        Resolves the values of the sweep, if this has not been done. A sweep
+        without values succeeds at once.
+
+        @return: Number of instances
+        @rtype: int
+        """
+        import array
+        if self.instance_states is None:
+            self.segments = expand_values(self.value_tokens)
+            count = sum([self.segment_size(segment)
+                         for segment in self.segments])
+            self.instance_states = array.array("b", [States.CREATED] * count)
+            self.state_counts = [0] * States.NUM_STATES
+            self.state_counts[States.CREATED] = count
+            if not count:
+                self.state = States.SUCCESS
+        return len(self.instance_states)
+
+    @staticmethod
+    def segment_size(segment):
+        if isinstance(segment, tuple):
+            return segment[1] - segment[0]
+        return len(segment)
+
+    def value(self, index):
+        """
+        Returns the value of an instance.
+
+        @param index: Index of instance
+        @type index: int
+        @rtype: str
+        """
+        for segment in self.segments:
+            size = self.segment_size(segment)
+            if index < size:
+                if isinstance(segment, tuple):
+                    return str(segment[0] + index)
+                return segment[index]
+            index -= size
+        raise IndexError("Sweep has no instance %d" % index)
+
+    def pending_instances(self):
+        """
+        Generates the indices of instances that have not started.
+
+        @rtype: generator
+        """
+        self.resolve()
+        if not self.state_counts[States.CREATED]:
+            return
+        for (index, state) in enumerate(self.instance_states):
+            if state == States.CREATED:
+                yield index
+
+    def instance(self, index):
+        """
+        Creates the process of an instance.
+
+        @param index: Index of instance
+        @type index: int
+        @rtype: dag.shell.SweepInstance
+        """
+        from string import Template
+        mapping = {self.variable: self.value(index)}
+        proc = SweepInstance(self, index,
+                             Template(self.cmd).safe_substitute(mapping),
+                             [Template(arg).safe_substitute(mapping)
+                              for arg in self.args])
+        proc.workunit_name = "%s[%d]" % (self.workunit_name, index)
+        proc.nice = self.nice
+        proc.cores = self.cores
+        proc.memory = self.memory
+        proc.priority = self.priority
+        proc.deadline = getattr(self, "deadline", None)
+        proc.cpu_limit = getattr(self, "cpu_limit", None)
+        proc.memory_limit = getattr(self, "memory_limit", None)
+        proc.pool = getattr(self, "pool", None)
+        return proc
+
+    def set_instance_state(self, index, state):
+        """
+        Changes the state of an instance and updates the state of the sweep.
+        """
+        old_state = self.instance_states[index]
+        if old_state == state:
+            return
+        self.instance_states[index] = state
+        self.state_counts[old_state] -= 1
+        self.state_counts[state] += 1
+        counts = self.state_counts
+        if counts[States.CREATED]:
+            if self.state not in (States.CREATED, States.STAGED):
+                self.state = States.CREATED
+        elif counts[States.RUNNING]:
+            self.state = States.RUNNING
+        elif counts[States.FAIL]:
+            self.state = States.FAIL
+        else:
+            self.state = States.SUCCESS
+
+
+class SweepInstance(ShellProcess):
+    """
+    A started instance of a SweepProcess. Its state is stored in the sweep.
+    """
+    __slots__ = ("sweep", "index")
+
+    def __init__(self, sweep, index, cmd, args):
+        self.sweep = None
+        super(SweepInstance, self).__init__(cmd, args)
+        self.sweep = sweep
+        self.index = index
+
+    def _get_state(self):
+        return self.sweep.instance_states[self.index]
+
+    def _set_state(self, state):
+        if self.sweep is None:
+            return  # Initial state is held by the sweep
+        self.sweep.set_instance_state(self.index, state)
+        if state != States.RUNNING:
+            sweep_instances.pop(self.workunit_name, None)
+
+    state = property(_get_state, _set_state)
+
+
+def get_process(root_dag, name):
+    """
+    Finds a process by workunit name, including sweep instances. Instances
+    started by an earlier master are created again from their name,
+    <sweep name>[<index>].
+
+    @rtype: dag.Process
+    """
+    proc = root_dag.get_process(name)
+    if proc is None:
+        proc = sweep_instances.get(name)
+    if proc is None and name.endswith("]") and "[" in name:
+        (sweep_name, index) = name[:-1].rsplit("[", 1)
+        sweep = root_dag.get_process(sweep_name)
+        if isinstance(sweep, SweepProcess) and index.isdigit():
+            proc = sweep.instance(int(index))
+            if proc.state == States.RUNNING:
+                sweep_instances[name] = proc
+    return proc
+
+
+def expand_sweeps(runnable, limit):
+    """
+    Replaces runnable sweeps by instances that have not started. At most
+    limit instances of each sweep are created.
+
+    @param runnable: Runnable processes in dispatch order
+    @type runnable: list
+    @param limit: Maximum number of instances per sweep
+    @type limit: int
+    @return: Processes and sweep instances in dispatch order
+    @rtype: list
+    """
+    from itertools import islice
+    expanded = []
+    for proc in runnable:
+        if not isinstance(proc, SweepProcess):
+            expanded.append(proc)
+            continue
+        for index in islice(proc.pending_instances(), max(limit, 0)):
+            expanded.append(proc.instance(index))
+    return expanded
+
+
+def parse_shell(cmd, args, header_map, parsers, init_code=None, sweep=None):
+    """
+    Creates the shell processes of a line of a submission file.
+
+    @param sweep: Optional variable name and value tokens of a %foreach
+     directive. If given, a single SweepProcess is created.
+    @type sweep: tuple
+    """
+    from dag.util import get_header_value, parse_memory
+    if sweep is not None:
+        proc_list = [SweepProcess(cmd, args, sweep[0], sweep[1])]
+    elif not cmd in parsers:
         proc_list = [ShellProcess(cmd, args)]
     else:
         if init_code:
@@ -164,38 +615,562 @@ def parse_shell(cmd, args, header_map, parsers, init_code=None):
     if "nice" in header_map:
         for newproc in proc_list:
             newproc.nice = int(header_map["nice"])
+    if "cores" in header_map:
+        for newproc in proc_list:
+            newproc.cores = int(get_header_value(header_map, "cores"))
+    if "memory" in header_map:
+        for newproc in proc_list:
+            newproc.memory = parse_memory(get_header_value(header_map,
+                                                           "memory"))
+    if "deadline" in header_map:
+        for newproc in proc_list:
+            newproc.deadline = float(get_header_value(header_map,
+                                                      "deadline"))
+    if "cpu_limit" in header_map:
+        for newproc in proc_list:
+            newproc.cpu_limit = float(get_header_value(header_map,
+                                                       "cpu_limit"))
+    if "memory_limit" in header_map:
+        for newproc in proc_list:
+            newproc.memory_limit = parse_memory(
+                get_header_value(header_map, "memory_limit"))
     return proc_list
 
 
-def runprocess(proc, message_queue):
+def status_to_returncode(status):
     """
-    Called by the master shell program, this function forks a shell process.
-    The master process returns the PID of the child. The child process runs
-    the shell process and then sends a message back to the master process
-    indicating its status.
+    Converts a status from os.wait into a return code, in the style of
+    subprocess. A process ended by a signal has the negative of the
+    signal number as its return code.
+
+    @param status: Status from os.wait, os.waitpid or os.wait4
+    @type status: int
+    @return: Return code
+    @rtype: int
     """
     import os
-    import smq
-    pid = os.fork()
-    if pid:  # Master
-        return pid
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
 
-    # Child
-    L.debug("Forked %s as %d" % (proc.workunit_name, os.getpid()))
+
+def limit_settings(proc):
+    """
+    Returns the limits of a process (see ShellProcess), for a process that
+    is run by an agent or the bundle runner.
+
+    @param proc: Process
+    @type proc: dag.Process
+    @return: Limits that are set, by name
+    @rtype: dict
+    """
+    settings = {}
+    for name in LIMIT_NAMES:
+        if getattr(proc, name, None):
+            settings[name] = getattr(proc, name)
+    return settings
+
+
+def resource_limits(cpu_limit=None, memory_limit=None):
+    """
+    Returns the resource limits that are set in a forked process. Limits
+    are lowered to the hard limits of the calling process, which an
+    unprivileged process cannot raise.
+
+    @param cpu_limit: Optional seconds of CPU time
+    @type cpu_limit: float
+    @param memory_limit: Optional bytes of address space
+    @type memory_limit: int
+    @return: List of (resource, soft limit, hard limit) tuples
+    @rtype: list
+    """
+    import resource
+    limits = []
+    if cpu_limit:
+        # SIGXCPU is sent at the soft limit and SIGKILL at the hard limit.
+        limits.append((resource.RLIMIT_CPU, int(cpu_limit),
+                       int(cpu_limit) + CANCEL_GRACE_PERIOD))
+    if memory_limit:
+        limits.append((resource.RLIMIT_AS, int(memory_limit),
+                       int(memory_limit)))
+    clamped = []
+    for (limit, soft, hard) in limits:
+        current = resource.getrlimit(limit)[1]
+        if current != resource.RLIM_INFINITY:
+            (soft, hard) = (min(soft, current), min(hard, current))
+        clamped.append((limit, soft, hard))
+    return clamped
+
+
+def set_resource_limits(limits):
+    """
+    Sets limits from resource_limits in the calling process, e.g. in the
+    preexec_fn of subprocess.Popen.
+    """
+    import resource
+    for (limit, soft, hard) in limits:
+        resource.setrlimit(limit, (soft, hard))
+
+
+def limit_failure(status, rusage, cpu_limit=None):
+    """
+    Determines whether a command that has exited was stopped by its CPU
+    limit.
+
+    @param status: Exit status from os.wait4
+    @type status: int
+    @param rusage: Resource usage from os.wait4
+    @param cpu_limit: Optional seconds of CPU time
+    @type cpu_limit: float
+    @return: REASON_CPU_LIMIT or None
+    @rtype: str
+    """
+    import os
+    import signal
+    if not cpu_limit or not os.WIFSIGNALED(status):
+        return None
+    # SIGKILL follows SIGXCPU if the process ignores it.
+    cpu_time = rusage.ru_utime + rusage.ru_stime
+    if (os.WTERMSIG(status) == signal.SIGXCPU
+            or (os.WTERMSIG(status) == signal.SIGKILL
+                and cpu_time >= cpu_limit)):
+        return REASON_CPU_LIMIT
+    return None
+
+
+def wait_for_command(popen, deadline=None, cancelled=None, name=None):
+    """
+    Waits for a command to exit. If it runs longer than its deadline, it
+    is sent SIGTERM, followed by SIGKILL after CANCEL_GRACE_PERIOD seconds.
+    os.wait4 is used, rather than Popen.poll, so that the resource usage
+    of the command is available for the run history.
+
+    @param popen: Command
+    @type popen: subprocess.Popen
+    @param deadline: Optional seconds of wall-clock time
+    @type deadline: float
+    @param cancelled: Optional function, called while the command runs,
+     which returns True if the command is to be stopped
+    @type cancelled: function
+    @param name: Name of the command in log messages
+    @type name: str
+    @return: Exit status, resource usage and failure reason, which is
+     REASON_DEADLINE, REASON_CANCELLED or None
+    @rtype: tuple
+    """
+    import os
+    import time
+    failure_reason = None
+    deadline_time = None
+    if deadline:
+        deadline_time = time.time() + deadline
+    kill_time = None  # Time after which SIGKILL is sent
+    while True:
+        (pid, status, rusage) = os.wait4(popen.pid, os.WNOHANG)
+        if pid:
+            return (status, rusage, failure_reason)
+        if cancelled is not None and cancelled():
+            L.debug("%s got kill signal" % name)
+            popen.terminate()
+            (pid, status, rusage) = os.wait4(popen.pid, 0)
+            return (status, rusage, REASON_CANCELLED)
+        now = time.time()
+        if kill_time is not None and now > kill_time:
+            popen.kill()
+            kill_time = None
+        elif deadline_time and now > deadline_time and kill_time is None:
+            L.info("%s passed its deadline of %d seconds" % (name, deadline))
+            failure_reason = REASON_DEADLINE
+            popen.terminate()
+            kill_time = now + CANCEL_GRACE_PERIOD
+            deadline_time = None
+        if kill_time is not None:
+            time.sleep(0.1)  # Stopping
+        elif deadline_time:
+            time.sleep(min(max(deadline_time - now, 0.1), 5))
+        elif cancelled is None:
+            (pid, status, rusage) = os.wait4(popen.pid, 0)
+            return (status, rusage, failure_reason)
+        else:
+            time.sleep(5)  # Interrupted by SIGTERM
+
+
+def record_run(proc, start_time, end_time, history_filename=None):
+    """
+    Adds a finished process to the run history. This is called by the
+    forked child, once the process has finished. Resource usage is taken
+    from ShellProcess.start, if available. Otherwise, the usage of all
+    of the children of the forked child is used.
+
+    @param proc: Process that ran
+    @type proc: dag.Process
+    @param start_time: Epoch time at which the process started
+    @type start_time: float
+    @param end_time: Epoch time at which the process ended
+    @type end_time: float
+    @param history_filename: Optional path to history database
+    @type history_filename: str
+    """
+    import resource
+    from dag.history import History
+
+    rusage = getattr(proc, "rusage", None)
+    if rusage is None:
+        rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    exit_code = getattr(proc, "exit_code", None)
+    if exit_code is None:
+        exit_code = int(proc.state != States.SUCCESS)
+    # ru_maxrss is in kilobytes on Linux.
+    history = History(history_filename)
+    history.record(proc, start_time, end_time, exit_code,
+                   rusage.ru_maxrss * 1024,
+                   rusage.ru_utime + rusage.ru_stime)
+    history.close()
+
+
+def get_physical_memory():
+    """
+    Returns the amount of physical memory of the machine, if it
+    can be determined. Otherwise, None is returned.
+
+    @return: Bytes of physical memory
+    @rtype: int
+    """
+    import os
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def resource_request(proc, total_cores, total_memory):
+    """
+    Returns the cores and memory requested by a process. Requests larger
+    than the machine are reduced to the size of the machine, so that the
+    process may still run once everything else has finished.
+
+    @param proc: Process
+    @type proc: dag.Process
+    @param total_cores: Number of cores available to the shell engine
+    @type total_cores: int
+    @param total_memory: Bytes of memory available to the shell engine.
+     None indicates memory is not limited.
+    @type total_memory: int
+    @return: Tuple of cores and bytes of memory
+    @rtype: tuple
+    """
+    cores = max(int(getattr(proc, "cores", 1) or 1), 1)
+    memory = int(getattr(proc, "memory", 0) or 0)
+    if cores > total_cores:
+        L.warning("%s requests %d cores, but only %d are available"
+                  % (proc.workunit_name, cores, total_cores))
+        cores = total_cores
+    if total_memory and memory > total_memory:
+        L.warning("%s requests %d bytes of memory, but only %d are available"
+                  % (proc.workunit_name, memory, total_memory))
+        memory = total_memory
+    return (cores, memory)
+
+
+def free_resources(total_cores, total_memory):
+    """
+    Returns the cores and memory not reserved by running children.
+
+    @return: Tuple of free cores and free bytes of memory
+    @rtype: tuple
+    """
+    free_cores = total_cores
+    free_memory = total_memory
+    for (cores, memory) in reserved_resources.values():
+        free_cores -= cores
+        if free_memory is not None:
+            free_memory -= memory
+    return (free_cores, free_memory)
+
+
+def pack_processes(runnable, free_cores, free_memory,
+                   total_cores, total_memory):
+    """
+    Chooses the runnable processes that fit within the free resources.
+
+    Processes are packed first-fit in the order given, which is the
+    dispatch order from DAG.generate_runnable_list. Among processes of
+    equal priority and critical path, that order places the largest
+    requests first. A process that does not fit is skipped, so that
+    smaller processes behind it fill the remaining gaps.
+
+    @param runnable: Processes that are ready to be started, in order of
+     preference
+    @type runnable: list
+    @param free_cores: Number of cores not in use
+    @type free_cores: int
+    @param free_memory: Bytes of memory not in use. None indicates memory
+     is not limited.
+    @type free_memory: int
+    @param total_cores: Number of cores available to the shell engine
+    @type total_cores: int
+    @param total_memory: Bytes of memory available to the shell engine
+    @type total_memory: int
+    @return: Processes to be started
+    @rtype: list
+    """
+    selected = []
+    for proc in runnable:
+        if free_cores <= 0:
+            break
+        (cores, memory) = resource_request(proc, total_cores, total_memory)
+        if cores > free_cores:
+            continue
+        if free_memory is not None and memory > free_memory:
+            continue
+        selected.append(proc)
+        free_cores -= cores
+        if free_memory is not None:
+            free_memory -= memory
+    return selected
+
+
+class Bundle(object):
+    """
+    Processes run one after another by a single forked child. Bundles are
+    made by dag.bundle.plan_units and exist only while they are being
+    dispatched. Their members have the same resource requests. A chain is
+    a bundle whose members depend on each other, so it stops at the first
+    member that fails.
+    """
+    __slots__ = ("members", "chain", "workunit_name", "cores", "memory")
+
+    def __init__(self, members, chain=False):
+        self.members = members
+        self.chain = chain
+        self.workunit_name = "%s-%s" % ("chain" if chain else "bundle",
+                                        members[0].workunit_name)
+        self.cores = getattr(members[0], "cores", 1)
+        self.memory = getattr(members[0], "memory", 0)
+
+
+def state_message(proc):
+    """
+    Returns the message that reports the state of a process to the master,
+    "state:<state>", followed by ":<reason>" if the process was stopped
+    (see ShellProcess.start).
+
+    @rtype: str
+    """
+    reason = getattr(proc, "failure_reason", None)
+    if proc.state == States.FAIL and reason:
+        return "state:%d:%s" % (proc.state, reason)
+    return "state:%d" % proc.state
+
+
+def parse_state_message(content):
+    """
+    Parses a message created by state_message.
+
+    @param content: Message content
+    @type content: str
+    @return: State and failure reason, which is None if none was sent
+    @rtype: tuple
+    """
+    fields = content.split(":", 2)
+    if len(fields) > 2:
+        return (int(fields[1]), fields[2])
+    return (int(fields[1]), None)
+
+
+def run_in_child(proc, message_queue, history_filename=None):
+    """
+    Runs a process in a forked child. The run is recorded in the run
+    history, the process is fingerprinted if it succeeded and its states
+    are sent to the master.
+
+    @return: Whether or not the process was killed by the master
+    @rtype: bool
+    """
+    import time
+    import smq
     # Updating master
     proc.state = States.RUNNING
     proc.message_queue = message_queue
     message_queue.send(smq.Message("state:%d" % proc.state, "str",
                                proc.workunit_name, MASTER_SENDER_NAME))
+    start_time = time.time()
     proc.start()
+    end_time = time.time()
     # If proc.start does not update its state, assume SUCCESS
     if proc.state == States.RUNNING:
         proc.state = States.SUCCESS
-    message_queue.send(smq.Message("state:%d" % proc.state, "str",
+    if not isinstance(proc, Waiter):
+        record_run(proc, start_time, end_time, history_filename)
+    if proc.state == States.SUCCESS:
+        from dag.fingerprint import record
+        record(proc, history_filename)
+    message_queue.send(smq.Message(state_message(proc), "str",
                                proc.workunit_name, MASTER_SENDER_NAME))
-    L.debug("%d finished start() with status %s" % (os.getpid(),
-                                                    strstate(proc.state)))
-    exit(0)
+    return getattr(proc, "killed", False) or terminated
+
+
+def on_terminate(signum, frame):
+    """
+    SIGTERM handler of forked children. The child keeps running, so that
+    it may wait for its process and report its state to the master.
+    """
+    global terminated
+    terminated = True
+
+
+def fork_child(cpus=None):
+    """
+    Forks a child of the master. The child leads a new process group,
+    which the processes it starts join, so that the master may signal all
+    of them at once (see send_kill_signal). Both sides set the group, so
+    that the master never signals the child before it exists.
+
+    @param cpus: Optional CPUs to which the child, and therefore every
+     process it starts, is pinned (see dag.placement)
+    @type cpus: list
+    @return: PID of the child in the master and 0 in the child
+    @rtype: int
+    """
+    import os
+    import signal
+    from dag.placement import set_affinity
+    pid = os.fork()
+    if pid:  # Master
+        try:
+            os.setpgid(pid, pid)
+        except OSError:
+            pass  # The child has already set it.
+        forked_pids.add(pid)
+        return pid
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGTERM, on_terminate)
+    if cpus and not set_affinity(0, cpus):
+        L.warning("Could not pin %d to CPUs %s" % (os.getpid(), cpus))
+    return 0
+
+
+def exit_child(status=0):
+    """
+    Ends a child forked by fork_child. The child leaves with os._exit,
+    after flushing its output and logs, so that it never runs the cleanup
+    of the code that called the master, e.g. finally clauses or atexit
+    handlers, which belongs to the master.
+
+    @param status: Exit status
+    @type status: int
+    """
+    import logging
+    import os
+    import sys
+    try:
+        logging.shutdown()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(status)
+
+
+def runprocess(proc, message_queue, history_filename=None, cpus=None):
+    """
+    Called by the master shell program, this function forks a shell process.
+    The master process returns the PID of the child. The child process runs
+    the shell process, records the run in the run history, fingerprints
+    the process if it succeeded and then sends a message back to the
+    master process indicating its status.
+
+    @param proc: Process to be run
+    @type proc: dag.Process
+    @param message_queue: Queue used to report to the master
+    @type message_queue: smq.Queue
+    @param history_filename: Optional path to history database
+    @type history_filename: str
+    @param cpus: Optional CPUs to which the process is pinned
+    @type cpus: list
+    """
+    import os
+    pid = fork_child(cpus)
+    if pid:  # Master
+        return pid
+
+    # Child
+    try:
+        L.debug("Forked %s as %d" % (proc.workunit_name, os.getpid()))
+        run_in_child(proc, message_queue, history_filename)
+        L.debug("%d finished start() with status %s" % (os.getpid(),
+                                                        strstate(proc.state)))
+    except BaseException:
+        L.exception("Child %d failed" % os.getpid())
+        exit_child(1)
+    exit_child(0)
+
+
+def runbundle(bundle, message_queue, history_filename=None, cpus=None):
+    """
+    Forks one child that runs the members of a bundle one after another,
+    as runprocess does for a single process. The state of each member is
+    sent to the master as it changes. If a member is killed, or a member
+    of a chain does not succeed, the members that have not run are
+    returned to the CREATED state.
+
+    @param bundle: Bundle to be run
+    @type bundle: dag.shell.Bundle
+    @param cpus: Optional CPUs to which the members are pinned
+    @type cpus: list
+    @return: PID of the child
+    @rtype: int
+    """
+    import os
+    import smq
+    pid = fork_child(cpus)
+    if pid:  # Master
+        return pid
+
+    # Child
+    try:
+        L.debug("Forked %s as %d" % (bundle.workunit_name, os.getpid()))
+        for (index, proc) in enumerate(bundle.members):
+            killed = run_in_child(proc, message_queue, history_filename)
+            if killed or (bundle.chain and proc.state != States.SUCCESS):
+                for skipped in bundle.members[index + 1:]:
+                    message_queue.send(smq.Message(
+                        "state:%d" % States.CREATED, "str",
+                        skipped.workunit_name, MASTER_SENDER_NAME))
+                break
+    except BaseException:
+        L.exception("Child %d failed" % os.getpid())
+        exit_child(1)
+    exit_child(0)
+
+
+def allocate_cpus(name, cores):
+    """
+    Chooses the CPUs of a process that is about to be started, if
+    processes are pinned (see dag.placement).
+
+    @param name: Name under which the resources of the process are
+     reserved
+    @type name: str
+    @param cores: Number of cores requested
+    @type cores: int
+    @return: CPU numbers, or None if the process is not pinned
+    @rtype: list
+    """
+    if core_pool is None:
+        return None
+    return core_pool.allocate(name, cores)
+
+
+def release_resources(name):
+    """
+    Releases the cores, memory and CPUs reserved for a process.
+
+    @param name: Name under which the resources are reserved
+    @type name: str
+    """
+    reserved_resources.pop(name, None)
+    if core_pool is not None:
+        core_pool.release(name)
 
 
 def perform_operation(root_dag, message):
@@ -240,7 +1215,10 @@ def dump_state(root_dag, message_queue):
     @rtype: str
     """
     from dag.update_dag import modify_dag
+    from dag.history import estimate_completion, format_duration
     retval = "Currently running %d processes\n" % len(running_children)
+    retval += ("Estimated time remaining: %s\n"
+               % format_duration(estimate_completion(root_dag)))
     retval += "Jobs by state:\n%s\n" % modify_dag(root_dag, "state",
                                                   ["all", "--count"], False)
     return retval
@@ -257,12 +1235,15 @@ def process_messages(root_dag, message_queue):
     @type message_queue: smq.Queue
     """
     global kill_switch
+    import time
     from smq import Message
     from dag import FINISHED_STATES
 
     def send(text, recipient):
         message_queue.send(Message(text, "str", MASTER_SENDER_NAME, recipient))
 
+    from dag.speculate import SUFFIX
+
     retval = None
     while message_queue.has_message(MASTER_SENDER_NAME):
         message = message_queue.next(MASTER_SENDER_NAME)
@@ -271,21 +1252,36 @@ def process_messages(root_dag, message_queue):
         if message.content == "shutdown":
             kill_switch = True
             retval = "Shutting down shell processes"
+        elif (message.content.startswith("state:")
+                and message.sender.endswith(SUFFIX)):
+            copy_state_changed(message.sender,
+                               parse_state_message(message.content)[0],
+                               message_queue)
         elif message.content.startswith("state:"):
-            proc = root_dag.get_process(message.sender)
+            proc = get_process(root_dag, message.sender)
             if not proc:
                 retval = ("Cannot change state. Unknown process %s"
                           % message.sender)
                 break
-            newstate = message.content.replace("state:", "")
-            proc.state = int(newstate)
+            (proc.state, proc.failure_reason) = parse_state_message(
+                message.content)
+            if proc.failure_reason:
+                L.info("%s failed: %s" % (proc.workunit_name,
+                                          proc.failure_reason))
+            if (proc.state != States.RUNNING
+                    and proc.workunit_name in speculated):
+                original_stopped(root_dag, proc, message_queue)
             L.debug("Changed state of %s to %s"
                       % (proc.workunit_name, strstate(proc.state)))
             root_dag.save()
             if proc.state in FINISHED_STATES:
+                proc.end_time = time.time()
+            if proc.state != States.RUNNING:
+                # Finished, or returned to CREATED by a killed bundle
                 for ended in [i for i in running_children
                               if i[0] == proc.workunit_name]:
                     running_children.remove(ended)
+                release_resources(proc.workunit_name)
         elif message.content == "dump":
             retval = dump_state(root_dag, message_queue)
         else:
@@ -294,9 +1290,305 @@ def process_messages(root_dag, message_queue):
             send(retval, message.sender)
 
 
-def send_kill_signal(process_name, pid, message_queue):
+def process_start_time(pid):
     """
-    Sends a kill signal to child processes.
+    Returns the time at which a process started, in clock ticks after boot,
+    from /proc. Together with the PID, it identifies a process, since
+    PIDs are reused.
+
+    @param pid: Process ID
+    @type pid: int
+    @return: Start time, or None if the process does not exist or is a
+     zombie
+    @rtype: int
+    """
+    try:
+        with open("/proc/%d/stat" % pid, "r") as stat:
+            data = stat.read()
+    except IOError:
+        return None
+    # Fields follow the command name, which may contain spaces.
+    fields = data[data.rindex(")") + 2:].split()
+    if fields[0] in ["Z", "X"]:
+        return None
+    return int(fields[19])
+
+
+def boot_id():
+    """
+    Returns the ID of the current boot of the machine, or None if unknown.
+
+    @rtype: str
+    """
+    try:
+        with open("/proc/sys/kernel/random/boot_id", "r") as infile:
+            return infile.read().strip()
+    except IOError:
+        return None
+
+
+def save_running_table(filename):
+    """
+    Writes the PIDs and start times of the running children of the master,
+    so that a master restarted after a crash may reattach to them.
+
+    @param filename: Path to table
+    @type filename: str
+    """
+    import json
+    import os
+    import socket
+    processes = {}
+    for (name, pid) in running_children:
+        processes[name] = [pid, process_start_time(pid),
+                           name in reserved_resources]
+    tmp_filename = "%s.tmp" % filename
+    with open(tmp_filename, "w") as table:
+        json.dump({"host": socket.gethostname(), "boot_id": boot_id(),
+                   "processes": processes}, table)
+    os.rename(tmp_filename, filename)
+
+
+def reattach(root_dag, table_filename, num_cores, total_memory):
+    """
+    Takes over the children of a master that died, using the table written
+    by save_running_table. Children that are still alive are monitored as
+    if they had been started by this master; they report their states
+    through the message queue as usual. Processes left RUNNING without a
+    living child are returned to CREATED. With incremental execution,
+    those that had finished before the crash are then skipped, rather than
+    run again (see dag.fingerprint).
+
+    Results sent by children while there was no master must be read
+    (see process_messages) before this is called.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @param table_filename: Path to table
+    @type table_filename: str
+    @param num_cores: Number of cores available to the shell engine
+    @type num_cores: int
+    @param total_memory: Bytes of memory available to the shell engine
+    @type total_memory: int
+    @return: Tuple of the lists of reattached and of lost processes
+    @rtype: tuple
+    """
+    import json
+    import os.path as OP
+    import socket
+
+    table = {}
+    if OP.isfile(table_filename):
+        try:
+            with open(table_filename, "r") as infile:
+                table = json.load(infile)
+        except ValueError:
+            L.warning("Ignoring unreadable table %s" % table_filename)
+    entries = {}
+    if (table.get("host") == socket.gethostname()
+            and table.get("boot_id") == boot_id()):
+        entries = table.get("processes", {})
+
+    reattached = []
+    for (name, (pid, start_time, reserved)) in entries.items():
+        proc = get_process(root_dag, name)
+        if proc is None or proc.state != States.RUNNING:
+            continue
+        if start_time is None or process_start_time(pid) != start_time:
+            continue
+        L.info("Reattached to %s (PID %d)" % (name, pid))
+        running_children.append((name, pid))
+        adopted_pids.add(pid)
+        if reserved:
+            reserved_resources[name] = resource_request(proc, num_cores,
+                                                        total_memory)
+        reattached.append(proc)
+
+    alive = set([name for (name, pid) in running_children])
+    lost = []
+    for proc in root_dag.processes:
+        if isinstance(proc, SweepProcess):
+            if (proc.instance_states is None
+                    or not proc.state_counts[States.RUNNING]):
+                continue
+            for (index, state) in enumerate(proc.instance_states):
+                name = "%s[%d]" % (proc.workunit_name, index)
+                if state == States.RUNNING and name not in alive:
+                    proc.set_instance_state(index, States.CREATED)
+                    sweep_instances.pop(name, None)
+                    lost.append(name)
+        elif proc.state == States.RUNNING and proc.workunit_name not in alive:
+            proc.state = States.CREATED
+            lost.append(proc.workunit_name)
+    if lost:
+        L.warning("Returned %d lost processes to CREATED: %s"
+                  % (len(lost), ", ".join(lost)))
+    return (reattached, lost)
+
+
+def start_copies(root_dag, message_queue, num_cores, total_memory,
+                 history_filename=None):
+    """
+    Starts speculative copies of stragglers (see dag.speculate) with the
+    cores and memory that are still free after runnable processes have
+    been started. Each process is copied at most once. Members of bundles,
+    sweep instances, waiters and processes in pools (see dag.pools) are
+    not copied.
+
+    @param root_dag: Main DAG object
+    @type root_dag: dag.DAG
+    @param message_queue: Queue used to report to the master
+    @type message_queue: smq.Queue
+    @param num_cores: Number of cores available to the shell engine
+    @type num_cores: int
+    @param total_memory: Bytes of memory available to the shell engine
+    @type total_memory: int
+    @param history_filename: Optional path to history database
+    @type history_filename: str
+    """
+    import copy
+    import os.path as OP
+    from dag.speculate import copy_name, find_stragglers, make_scratch
+
+    pid_counts = {}
+    for (name, pid) in running_children:
+        pid_counts[pid] = pid_counts.get(pid, 0) + 1
+    # Processes are looked up once per pass, rather than once per child.
+    by_name = None
+    candidates = []
+    for (name, pid) in running_children:
+        if name in speculated or pid_counts[pid] > 1:
+            continue
+        if by_name is None:
+            # The first process with a name wins, as in DAG.get_process.
+            by_name = dict((proc.workunit_name, proc)
+                           for proc in reversed(root_dag.processes))
+        proc = by_name.get(name)
+        if not isinstance(proc, ShellProcess) or isinstance(proc, Waiter):
+            continue
+        if getattr(proc, "pool", None):
+            continue  # A copy would exceed the cap of the pool.
+        candidates.append(proc)
+    if not candidates:
+        return
+    (free_cores, free_memory) = free_resources(num_cores, total_memory)
+    stragglers = find_stragglers(root_dag, candidates)
+    for proc in pack_processes(stragglers, free_cores, free_memory,
+                               num_cores, total_memory):
+        speculated.add(proc.workunit_name)
+        try:
+            scratch = make_scratch(proc)
+        except OSError as e:
+            L.warning("Not copying %s: %s" % (proc.workunit_name, e))
+            continue
+        twin = copy.copy(proc)
+        twin.workunit_name = copy_name(proc)
+        twin.cwd = OP.abspath(scratch)
+        if "/" in twin.cmd:
+            twin.cmd = OP.abspath(twin.cmd)
+        # The master fingerprints the outputs once they are installed.
+        twin.cacheable = False
+        request = resource_request(proc, num_cores, total_memory)
+        pid = runprocess(twin, message_queue, history_filename,
+                         allocate_cpus(twin.workunit_name, request[0]))
+        running_children.append((twin.workunit_name, pid))
+        reserved_resources[twin.workunit_name] = request
+        speculative_copies[twin.workunit_name] = proc
+        L.info("Started a copy of straggler %s" % proc.workunit_name)
+
+
+def copy_state_changed(name, state, message_queue):
+    """
+    Acts on the state reported by a speculative copy. A copy that succeeds
+    while the original is still running wins. The original is then
+    cancelled and the output files of the copy are installed once it has
+    stopped (see original_stopped). Otherwise, the copy is discarded.
+
+    @param name: Workunit name of the copy
+    @type name: str
+    @param state: New state of the copy
+    @type state: int
+    @param message_queue: Queue used to send kill signals
+    @type message_queue: smq.Queue
+    """
+    from dag.speculate import discard_scratch
+    if state == States.RUNNING:
+        return
+    for ended in [i for i in running_children if i[0] == name]:
+        running_children.remove(ended)
+    release_resources(name)
+    proc = speculative_copies.pop(name, None)
+    if proc is None:
+        return  # Started by an earlier master
+    if state == States.SUCCESS and proc.state == States.RUNNING:
+        L.info("Copy of %s finished first" % proc.workunit_name)
+        copy_winners.add(proc.workunit_name)
+        for (child_name, pid) in running_children:
+            if child_name == proc.workunit_name:
+                send_kill_signal(child_name, pid, message_queue)
+    else:
+        discard_scratch(proc)
+
+
+def original_stopped(root_dag, proc, message_queue):
+    """
+    Acts on the end of a process that has been copied. If its copy has
+    already succeeded, the output files of the copy are installed and the
+    process succeeds, even though it was cancelled. Otherwise, the copy is
+    cancelled, if it is still running.
+
+    @param root_dag: Main DAG object
+    @type root_dag: dag.DAG
+    @param proc: Process that is no longer running
+    @type proc: dag.Process
+    @param message_queue: Queue used to send kill signals
+    @type message_queue: smq.Queue
+    """
+    from dag.speculate import copy_name, install_outputs
+    if proc.workunit_name in copy_winners:
+        copy_winners.discard(proc.workunit_name)
+        if install_outputs(proc):
+            from dag.fingerprint import record
+            proc.state = States.SUCCESS
+            record(proc, getattr(root_dag, "history_filename", None))
+        return
+    name = copy_name(proc)
+    for (child_name, pid) in running_children:
+        if child_name == name:
+            # Its scratch directory is removed once it has stopped.
+            send_kill_signal(child_name, pid, message_queue)
+
+
+def signal_group(pgid, signum):
+    """
+    Sends a signal to a process group.
+
+    @param pgid: ID of the process group, i.e. PID of its leader
+    @type pgid: int
+    @param signum: Signal number
+    @type signum: int
+    @return: Whether or not the group exists
+    @rtype: bool
+    """
+    import errno
+    import os
+    try:
+        os.killpg(pgid, signum)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            L.warning("Could not signal process group %d: %s" % (pgid, e))
+        return False
+    return True
+
+
+def send_kill_signal(process_name, pid, message_queue,
+                     grace_period=CANCEL_GRACE_PERIOD):
+    """
+    Stops a child of the master and every process it started, by sending
+    SIGTERM to its process group. If the group has not stopped after the
+    grace period, reap_children sends it SIGKILL. Children of an earlier
+    master that do not lead a process group are sent KILL_SIGNAL through
+    the message queue instead.
 
     @param process_name: Name of process to be killed.
     @type process_name: str
@@ -304,12 +1596,98 @@ def send_kill_signal(process_name, pid, message_queue):
     @type: int
     @param message_queue: Queue to be used to send signal
     @type message_queue: smq.Queue
+    @param grace_period: Seconds between SIGTERM and SIGKILL
+    @type grace_period: float
     """
-    import smq
-    L.debug("Sending kill signal to %s" % pid)
-    message_queue.send(smq.Message(KILL_SIGNAL, "str",
-                                   MASTER_SENDER_NAME,
-                                   process_name))
+    import signal
+    import time
+    if pid in cancelling:
+        return
+    L.debug("Sending SIGTERM to process group %d" % pid)
+    if signal_group(pid, signal.SIGTERM):
+        cancelling[pid] = time.time() + grace_period
+    else:
+        import smq
+        message_queue.send(smq.Message(KILL_SIGNAL, "str",
+                                       MASTER_SENDER_NAME,
+                                       process_name))
+
+
+def reap_children():
+    """
+    Waits for the children of the master that have exited, so that they
+    do not remain as zombies, and sends SIGKILL to the process groups of
+    cancelled children whose grace period has passed. Children of an
+    earlier master cannot be waited for; they are checked in /proc.
+
+    @return: PIDs of the children that have exited
+    @rtype: set
+    """
+    import os
+    import signal
+    import time
+    reaped = set()
+    for pid in forked_pids:
+        try:
+            (done, status) = os.waitpid(pid, os.WNOHANG)
+        except OSError:
+            done = pid  # Already waited for
+        if done:
+            reaped.add(pid)
+    for pid in adopted_pids:
+        if process_start_time(pid) is None:
+            reaped.add(pid)
+    forked_pids.difference_update(reaped)
+    adopted_pids.difference_update(reaped)
+    now = time.time()
+    for (pid, deadline) in list(cancelling.items()):
+        if now < deadline:
+            continue
+        # Processes left in the group outlive its leader.
+        if signal_group(pid, signal.SIGKILL):
+            L.warning("Process group %d did not stop after SIGTERM."
+                      " Sent SIGKILL." % pid)
+        del cancelling[pid]
+    return reaped
+
+
+def settle_reaped(root_dag, reaped, message_queue):
+    """
+    Ends the processes of children that exited without reporting a final
+    state, e.g. after SIGKILL. Messages sent by a child before it exited
+    must be read (see process_messages) before this is called. The
+    process that was running fails. Later members of its bundle never ran
+    and return to CREATED.
+
+    @param root_dag: Main DAG object
+    @type root_dag: dag.DAG
+    @param reaped: PIDs from reap_children
+    @type reaped: set
+    @param message_queue: Queue used to send kill signals
+    @type message_queue: smq.Queue
+    """
+    import time
+    from dag.speculate import SUFFIX
+    entries = [child for child in running_children if child[1] in reaped]
+    started = set()
+    for (name, pid) in entries:
+        if name.endswith(SUFFIX):
+            copy_state_changed(name, States.FAIL, message_queue)
+            continue
+        running_children.remove((name, pid))
+        release_resources(name)
+        proc = get_process(root_dag, name)
+        if proc is None:
+            continue
+        L.warning("%s ended without reporting its state" % name)
+        if pid in started:
+            proc.state = States.CREATED
+        else:
+            started.add(pid)
+            proc.state = States.FAIL
+            proc.end_time = time.time()
+    if entries:
+        root_dag.save()
 
 
 def create_work(root_dag, dag_path):
@@ -317,22 +1695,34 @@ def create_work(root_dag, dag_path):
     Starts and monitors shell processes. This is the
     main process loop function.
 
+    The PIDs of running children are kept in <DAG file>.running, so that,
+    if the master dies, the next master reattaches to the children that
+    are still running, rather than running them again (see reattach).
+
     @param root_dag: Main DAG object
     @type root_dag: dag.DAG
     @param dag_path: Path to DAG file
     @type dag_path: str
     """
+    import os
     import smq
     from os import getpid
-    from dag import WAITING_STATES
+    from dag.pools import admit
+    from dag.tempfiles import TempFileCollector, usage_report
 
     global kill_switch
     global running_children
+    global agent_server
+    global log_store
+    global core_pool
 
     if root_dag.num_cores:
         num_cores = root_dag.num_cores
     else:
         num_cores = DEFAULT_NUMBER_OF_CORES
+    total_memory = getattr(root_dag, "memory", None)
+    if not total_memory:
+        total_memory = get_physical_memory()
 
     # called before fork. All are therefore aware who master is.
     master_pid = getpid()
@@ -343,10 +1733,52 @@ def create_work(root_dag, dag_path):
     root_dag.message_queue = message_queue
     process_messages(root_dag, message_queue)
 
+    # Files are not checked, since inputs may yet be created outside of
+    # the DAG.
+    cycles = root_dag.validate(check_files=False)["cycles"]
+    if cycles:
+        from dag import format_cycles
+        L.warning("%s contains %d dependency cycle(s): %s"
+                  % (dag_path, len(cycles), format_cycles(cycles)))
+
+    # Take over children left running by a master that died.
+    table_filename = "%s%s" % (dag_path, RUNNING_TABLE_SUFFIX)
+    (reattached, lost) = reattach(root_dag, table_filename, num_cores,
+                                  total_memory)
+    if reattached or lost:
+        root_dag.save()
+    saved_children = []
+
+    def update_running_table():
+        if running_children != saved_children:
+            save_running_table(table_filename)
+            saved_children[:] = running_children
+
     torun = root_dag.generate_runnable_list()
-    if not torun:
+    if (not torun and not running_children
+            and not root_dag.get_processes_by_state(States.RETRY)):
         return
 
+    history_filename = getattr(root_dag, "history_filename", None)
+    bundle_duration = getattr(root_dag, "bundle_duration", None)
+    fuse_chains = getattr(root_dag, "fuse_chains", False)
+    agent_address = getattr(root_dag, "agent_address", None)
+    log_store = getattr(root_dag, "log_store", None)
+    if getattr(root_dag, "pin_cores", False):
+        from dag.placement import CorePool
+        core_pool = CorePool()
+        L.info("Pinning processes to CPUs of %d NUMA nodes"
+               % len(core_pool.nodes))
+    if agent_address:
+        from dag.agent import AgentServer
+        agent_server = AgentServer(root_dag, agent_address)
+
+    def agents_busy():
+        return agent_server is not None and agent_server.assignments
+
+    # Temporary files are deleted by a thread once their consumers succeed.
+    collector = TempFileCollector(root_dag)
+
     # doing loop so that in the future finished processes
     # may start other processes
     import time
@@ -354,19 +1786,77 @@ def create_work(root_dag, dag_path):
     L.info("Doing work locally with %d cores. Master PID %d" % (num_cores,
                                                                 getpid()))
     try:
-        while torun or num_processes_left or running_children:
-            for process in torun:
-                if len(running_children) >= num_cores:
-                    break
-                pid = runprocess(process, message_queue)
-                running_children.append((process.workunit_name, pid))
+        while (torun or num_processes_left or running_children
+               or agents_busy()):
+            (free_cores, free_memory) = free_resources(num_cores,
+                                                       total_memory)
+            limit = free_cores
+            if agent_server is not None:
+                limit += agent_server.free_cores()
+            torun = admit(root_dag, expand_sweeps(torun, limit))
+            candidates = torun
+            if bundle_duration or fuse_chains:
+                from dag.bundle import plan_units
+                candidates = [members[0] if len(members) == 1
+                              else Bundle(members, chain)
+                              for (members, chain)
+                              in plan_units(root_dag, torun, bundle_duration,
+                                            fuse_chains, max(free_cores, 1))]
+            for process in pack_processes(candidates, free_cores,
+                                          free_memory, num_cores,
+                                          total_memory):
+                # Members run one at a time. The last one to finish
+                # releases the resources.
+                if isinstance(process, Bundle):
+                    members = process.members
+                else:
+                    members = [process]
+                name = members[-1].workunit_name
+                request = resource_request(process, num_cores, total_memory)
+                cpus = allocate_cpus(name, request[0])
+                if isinstance(process, Bundle):
+                    pid = runbundle(process, message_queue, history_filename,
+                                    cpus)
+                else:
+                    pid = runprocess(process, message_queue,
+                                     history_filename, cpus)
+                for member in members:
+                    member.state = States.RUNNING
+                    member.start_time = time.time()
+                    running_children.append((member.workunit_name, pid))
+                    if isinstance(member, SweepInstance):
+                        sweep_instances[member.workunit_name] = member
+                reserved_resources[name] = request
+            if getattr(root_dag, "speculate", False):
+                start_copies(root_dag, message_queue, num_cores,
+                             total_memory, history_filename)
+            update_running_table()
+            if agent_server is not None:
+                # Waiters watch local PIDs, so they are never sent away.
+                agent_server.dispatch([process for process in torun
+                                       if process.state != States.RUNNING
+                                       and not isinstance(process, Waiter)])
             num_processes_left = len(root_dag
                                      .get_processes_by_state(WAITING_STATES))
+            # Children report their states before they exit.
+            reaped = reap_children()
             process_messages(root_dag, message_queue)
+            settle_reaped(root_dag, reaped, message_queue)
+            update_running_table()
+            collector.update()
             if kill_switch:
                 break
+            if agent_server is not None:
+                if agent_server.poll(timeout=5):
+                    root_dag.save()
+            else:
+                time.sleep(5)
             torun = root_dag.generate_runnable_list()
-            time.sleep(5)
+            if (not torun and not running_children and not agents_busy()
+                    and is_stalled(root_dag)):
+                L.error("Stopping, as the remaining processes depend on a"
+                        " dependency cycle and can never run.")
+                break
     finally:
         mypid = getpid()
         if mypid == master_pid and running_children:
@@ -381,33 +1871,99 @@ def create_work(root_dag, dag_path):
                         "no running processes at the moment.")
             if kill_switch:
                 L.debug("Finished loop because kill switch was thrown.")
-            from os import waitpid
             L.debug("%d is killing threads %d threads " %
                     (mypid, len(running_children)))
             for running_child in running_children:
                 send_kill_signal(running_child[0],
                                  running_child[1],
                                  message_queue)
-                waitpid(running_child[1], 0)
+            # Children of an earlier master cannot be waited for.
+            # reap_children sends SIGKILL to those that do not stop.
+            while forked_pids:
+                reap_children()
+                time.sleep(0.1)
+            from dag.speculate import discard_scratch
+            for proc in speculative_copies.values():
+                discard_scratch(proc)
+        if mypid == master_pid and os.path.isfile(table_filename):
+            os.unlink(table_filename)
+        if mypid == master_pid and agent_server is not None:
+            agent_server.close()
+            agent_server = None
+        if mypid == master_pid and collector.thread is not None:
+            collector.update()
+            collector.close()
+            root_dag.save()
+            L.info(usage_report(root_dag))
+
+
+def is_stalled(root_dag):
+    """
+    Determines whether or not every waiting process is part of, or depends
+    on, a dependency cycle (see dag.DAG.validate), so that waiting for
+    them would never end.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @rtype: bool
+    """
+    waiting = root_dag.get_processes_by_state(WAITING_STATES)
+    if not waiting:
+        return False
+    problems = root_dag.validate(check_files=False)
+    stuck = set(problems["dead_ends"])
+    for cycle in problems["cycles"]:
+        stuck.update(cycle)
+    return all(proc in stuck for proc in waiting)
 
 
 def cancel_workunits(root_dag, processes):
     """
-    Takes a list of processes and sends a kill signal.
+    Stops running processes. The process group of each child is sent
+    SIGTERM at once and SIGKILL after CANCEL_GRACE_PERIOD seconds, if it
+    has not stopped (see send_kill_signal). The cores and memory of the
+    children are free at once, rather than when they have stopped.
+    Cancelled processes fail and are not retried (see dag.retry).
+
+    Members of a bundle share a child, so cancelling one stops the bundle.
+    The member running at the time fails and the others return to CREATED.
+    Cancelling a sweep stops its running instances.
 
     @param root_dag: Main DAG object
     @type root_dag: dag.DAG
     @param processes: List of processes to be cancelled
     @type processes: list of dag.Process
+    @return: Number of processes that were running
+    @rtype: int
     """
-    L.debug("Canceling work units %s" % [p.workunit_name for p in processes])
+    L.debug("Cancelling %d work units" % len(processes))
+    cancelled = set()
+    names = {}
+    sweeps = {}
     for proc in processes:
-        childlist = [P for P in running_children if proc.workunit_name == P[0]]
-        if childlist:
-            pid = childlist[0][1]
-            send_kill_signal(proc.workunit_name,
-                             pid,
-                             root_dag.message_queue)
+        if agent_server is not None and agent_server.cancel(proc):
+            cancelled.add(proc)
+            continue
+        if isinstance(proc, SweepProcess):
+            sweeps["%s[" % proc.workunit_name] = proc
+        else:
+            names[proc.workunit_name] = proc
+    pids = {}
+    for (name, pid) in running_children:
+        proc = names.get(name)
+        if proc is None and name.endswith("]") and "[" in name:
+            proc = sweeps.get(name[:name.rindex("[") + 1])
+        if proc is not None:
+            cancelled.add(proc)
+            pids.setdefault(pid, name)
+    for proc in cancelled:
+        proc.cancelled = True
+    for (name, pid) in running_children:
+        if pid in pids:
+            release_resources(name)
+    for (pid, name) in pids.items():
+        send_kill_signal(name, pid, root_dag.message_queue)
+    return len(cancelled)
 
 
 def clean_workunit(root_dag, proc):
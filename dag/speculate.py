@@ -0,0 +1,218 @@
+"""
+dag.speculate
+=============
+
+@author: David Coss, PhD
+@date: October 19, 2026
+@license: GPL version 3 (see COPYING or
+ http://www.gnu.org/licenses/gpl.html for details)
+
+Speculative execution of stragglers. In a wide fan-out, a few processes
+on an overloaded node may run much longer than their siblings and hold
+back every gather that depends on them. A running process is a straggler
+when it has run SLOWDOWN times longer than the median runtime of its
+finished siblings, i.e. processes of the DAG with the same command.
+
+A speculative copy of a straggler runs in a scratch directory,
+<workunit name>.speculative, in which its input files are linked. Its
+output files are therefore written there, rather than over those of the
+original. Only processes whose input and output files are listed, with
+paths relative to the working directory, may be copied. Whichever copy
+succeeds first wins and the other is cancelled. If the copy wins, its
+output files are renamed into place once the original has stopped, so
+that readers never see a mix of the two.
+
+The shell engine looks for stragglers in its main loop, using cores
+that no runnable process needs. With LSF, "update_dag stragglers"
+submits copies (see dag.lsf.speculate).
+"""
+import logging
+
+L = logging.getLogger("dag.speculate")
+
+SUFFIX = ".speculative"
+# A process is a straggler once it has run this many times longer than
+# the median runtime of its siblings...
+SLOWDOWN = 2.0
+# ... and at least this many seconds longer.
+MIN_OVERRUN = 60
+# Number of finished siblings needed to judge a process
+MIN_SAMPLES = 3
+
+
+def copy_name(proc):
+    """
+    Returns the workunit name of the speculative copy of a process.
+
+    @rtype: str
+    """
+    return "%s%s" % (proc.workunit_name, SUFFIX)
+
+
+def scratch_directory(proc):
+    """
+    Returns the directory in which the copy of a process runs.
+
+    @rtype: str
+    """
+    return copy_name(proc)
+
+
+def can_speculate(proc):
+    """
+    Determines whether or not a process may be run twice at once, i.e.
+    whether or not it lists output files, all of which are inside the
+    working directory, so that its copy writes them in its scratch
+    directory.
+
+    @param proc: Process
+    @type proc: dag.Process
+    @rtype: bool
+    """
+    import os.path as OP
+    if not proc.output_files:
+        return False
+    for f in proc.input_files + proc.output_files:
+        path = OP.normpath(f.full_path())
+        if OP.isabs(path) or path.startswith(".."):
+            return False
+    return True
+
+
+def sibling_runtimes(root_dag):
+    """
+    Returns the runtimes of the processes that have succeeded, by command.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @return: Dict mapping commands to sorted lists of seconds
+    @rtype: dict
+    """
+    from dag import States
+    runtimes = {}
+    for proc in root_dag.get_processes_by_state(States.SUCCESS):
+        start_time = getattr(proc, "start_time", None)
+        end_time = getattr(proc, "end_time", None)
+        if start_time is None or end_time is None:
+            continue
+        runtimes.setdefault(proc.cmd, []).append(end_time - start_time)
+    for values in runtimes.values():
+        values.sort()
+    return runtimes
+
+
+def find_stragglers(root_dag, candidates, elapsed=None, now=None,
+                    slowdown=SLOWDOWN, min_samples=MIN_SAMPLES):
+    """
+    Finds the stragglers among running processes.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @param candidates: Running processes that may be copied
+    @type candidates: list
+    @param elapsed: Optional function returning the seconds a process has
+     been running, or None if it is unknown. Default: time since
+     proc.start_time
+    @type elapsed: function
+    @param now: Epoch time. Default: current time
+    @type now: float
+    @param slowdown: Factor of the median runtime after which a process
+     is a straggler
+    @type slowdown: float
+    @param min_samples: Number of finished siblings needed
+    @type min_samples: int
+    @return: Stragglers, slowest first
+    @rtype: list
+    """
+    import time
+    if now is None:
+        now = time.time()
+    if elapsed is None:
+        def elapsed(proc):
+            if getattr(proc, "start_time", None) is None:
+                return None
+            return now - proc.start_time
+
+    runtimes = sibling_runtimes(root_dag)
+    stragglers = []
+    for proc in candidates:
+        samples = runtimes.get(proc.cmd, [])
+        if len(samples) < min_samples or not can_speculate(proc):
+            continue
+        median = samples[len(samples) // 2]
+        threshold = max(slowdown * median, median + MIN_OVERRUN)
+        seconds = elapsed(proc)
+        if seconds is not None and seconds > threshold:
+            stragglers.append((seconds / max(median, 1.0), proc))
+    stragglers.sort(key=lambda pair: pair[0], reverse=True)
+    return [proc for (_, proc) in stragglers]
+
+
+def make_scratch(proc):
+    """
+    Creates the scratch directory of the copy of a process, with links to
+    its input files and the directories of its output files.
+
+    @param proc: Process to be copied
+    @type proc: dag.Process
+    @return: Path to the scratch directory
+    @rtype: str
+    """
+    import os
+    import os.path as OP
+    scratch = scratch_directory(proc)
+    discard_scratch(proc)
+    os.makedirs(scratch)
+    for f in proc.input_files:
+        path = OP.normpath(f.full_path())
+        link = OP.join(scratch, path)
+        if not OP.isdir(OP.dirname(link)):
+            os.makedirs(OP.dirname(link))
+        if not OP.lexists(link):
+            os.symlink(OP.abspath(path), link)
+    for f in proc.output_files:
+        directory = OP.join(scratch, OP.dirname(OP.normpath(f.full_path())))
+        if not OP.isdir(directory):
+            os.makedirs(directory)
+    return scratch
+
+
+def install_outputs(proc):
+    """
+    Renames the output files of the copy of a process over those of the
+    original and removes the scratch directory. The original must have
+    stopped.
+
+    @param proc: Process whose copy succeeded
+    @type proc: dag.Process
+    @return: Whether or not every output file was installed
+    @rtype: bool
+    """
+    import os
+    import os.path as OP
+    scratch = scratch_directory(proc)
+    paths = [OP.normpath(f.full_path()) for f in proc.output_files]
+    missing = [path for path in paths
+               if not OP.lexists(OP.join(scratch, path))]
+    if missing:
+        L.warning("Copy of %s did not write %s"
+                  % (proc.workunit_name, ", ".join(missing)))
+        discard_scratch(proc)
+        return False
+    for path in paths:
+        if OP.dirname(path) and not OP.isdir(OP.dirname(path)):
+            os.makedirs(OP.dirname(path))
+        os.rename(OP.join(scratch, path), path)
+    discard_scratch(proc)
+    return True
+
+
+def discard_scratch(proc):
+    """
+    Removes the scratch directory of the copy of a process, if it exists.
+
+    @param proc: Process
+    @type proc: dag.Process
+    """
+    import shutil
+    shutil.rmtree(scratch_directory(proc), ignore_errors=True)
@@ -0,0 +1,215 @@
+"""
+dag.tempfiles
+=============
+
+@author: David Coss, PhD
+@date: October 19, 2026
+@license: GPL version 3 (see COPYING or
+ http://www.gnu.org/licenses/gpl.html for details)
+
+Eager removal of temporary files. A file is temporary if any process
+lists it with temp_file set (see dag.File). Its consumers are the
+processes that list it as an input file or in their temp_files. Each
+temporary file is reference counted by its consumers that have not yet
+succeeded, and it is deleted as soon as the count drops to zero, rather
+than when its processes are removed or reset. Files without consumers,
+e.g. final outputs that are marked temporary by mistake, are kept.
+
+Files are deleted by a thread, so that removing large files never holds
+up the dispatch of processes. The thread does not log, since the shell
+engine forks while it runs. Deletions are reported by the collector in
+the calling thread.
+
+The bytes of temporary files on disk are measured when their producers
+succeed. The current, peak and freed totals are kept in the temp_usage
+dict of the DAG, which "update_dag tempfiles" prints.
+
+A consumer that is reset after its temporary inputs were deleted cannot
+run until their producers are reset too.
+"""
+import logging
+
+L = logging.getLogger("dag.tempfiles")
+
+USAGE_KEYS = ("current", "peak", "freed", "deleted")
+
+
+class TempFileCollector(object):
+    """
+    Reference counts of the temporary files of a DAG.
+
+    @ivar holders: Map of processes that have not succeeded to the paths
+     of the temporary files they consume
+    @type holders: dict
+    @ivar references: Map of paths to their number of holders
+    @type references: dict
+    @ivar unmeasured: Map of paths that have not been measured to their
+     producers
+    @type unmeasured: dict
+    @ivar usage: Bytes of temporary files ("current", "peak" and "freed")
+     and the number of files deleted ("deleted")
+    @type usage: dict
+    """
+    def __init__(self, root_dag):
+        """
+        @param root_dag: DAG, whose temp_usage is continued
+        @type root_dag: dag.DAG
+        """
+        from dag import States
+        self.root_dag = root_dag
+        self.holders = {}
+        self.references = {}
+        self.unmeasured = {}
+        self.usage = dict((key, 0) for key in USAGE_KEYS)
+        self.usage.update(getattr(root_dag, "temp_usage", None) or {})
+        self.requests = None  # Queue of paths for the deleting thread
+        self.results = None
+        self.thread = None
+
+        temporary = set()
+        for proc in root_dag.processes:
+            for f in proc.input_files + proc.output_files + proc.temp_files:
+                if f.temp_file:
+                    temporary.add(f.full_path())
+        if not temporary:
+            return
+        consumed = set()
+        for proc in root_dag.processes:
+            paths = set([f.full_path()
+                         for f in proc.input_files + proc.temp_files
+                         if f.full_path() in temporary])
+            consumed.update(paths)
+            if paths and proc.state != States.SUCCESS:
+                self.holders[proc] = paths
+                for path in paths:
+                    self.references[path] = self.references.get(path, 0) + 1
+            for f in proc.output_files:
+                if f.full_path() in temporary:
+                    self.unmeasured.setdefault(f.full_path(), []).append(proc)
+        for path in consumed:
+            # Consumed before this collector existed
+            if not self.references.get(path):
+                self.delete(path)
+
+    def update(self):
+        """
+        Measures the temporary files whose producers have succeeded and
+        deletes those whose consumers have all succeeded. Deletions that
+        have finished are added to the usage of the DAG.
+        """
+        import os.path as OP
+        from dag import States
+        for (path, producers) in list(self.unmeasured.items()):
+            if any([proc.state != States.SUCCESS for proc in producers]):
+                continue
+            del self.unmeasured[path]
+            if OP.isfile(path):
+                self.usage["current"] += OP.getsize(path)
+        self.usage["peak"] = max(self.usage["peak"], self.usage["current"])
+        for (proc, paths) in list(self.holders.items()):
+            if proc.state != States.SUCCESS:
+                continue
+            del self.holders[proc]
+            for path in paths:
+                self.references[path] -= 1
+                if not self.references[path]:
+                    self.delete(path)
+        self.drain()
+
+    def delete(self, path):
+        """
+        Queues a file to be deleted by the thread, which is started if
+        needed.
+
+        @param path: Path of the file
+        @type path: str
+        """
+        import collections
+        import os
+        import os.path as OP
+        import threading
+        import Queue
+
+        if self.thread is None:
+            requests = Queue.Queue()
+            results = collections.deque()
+
+            def delete_files():
+                while True:
+                    filename = requests.get()
+                    if filename is None:
+                        return
+                    try:
+                        size = 0
+                        if OP.isfile(filename):
+                            size = OP.getsize(filename)
+                            os.unlink(filename)
+                        results.append((filename, size, None))
+                    except OSError as e:
+                        results.append((filename, 0, e))
+
+            self.requests = requests
+            self.results = results
+            self.thread = threading.Thread(target=delete_files,
+                                           name="dag.tempfiles")
+            self.thread.daemon = True
+            self.thread.start()
+        self.references.pop(path, None)
+        self.requests.put(path)
+
+    def drain(self):
+        """
+        Adds the files deleted by the thread to the usage and stores it in
+        the DAG.
+
+        @return: Number of files deleted since the last call
+        @rtype: int
+        """
+        count = 0
+        while self.results:
+            (path, size, error) = self.results.popleft()
+            if error is not None:
+                L.warning("Could not delete temporary file %s: %s"
+                          % (path, error))
+                continue
+            if path in self.unmeasured:  # Deleted before it was measured
+                del self.unmeasured[path]
+                self.usage["peak"] = max(self.usage["peak"],
+                                         self.usage["current"] + size)
+            else:
+                self.usage["current"] = max(self.usage["current"] - size, 0)
+            if size:
+                L.info("Deleted temporary file %s (%d bytes)" % (path, size))
+                self.usage["freed"] += size
+                self.usage["deleted"] += 1
+                count += 1
+        self.root_dag.temp_usage = self.usage
+        return count
+
+    def close(self):
+        """
+        Waits for queued deletions to finish and stops the thread.
+        """
+        if self.thread is not None:
+            self.requests.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.results is not None:
+            self.drain()
+
+
+def usage_report(root_dag):
+    """
+    Describes the disk usage of the temporary files of a DAG.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @rtype: str
+    """
+    from dag.util import format_bytes
+    usage = dict((key, 0) for key in USAGE_KEYS)
+    usage.update(getattr(root_dag, "temp_usage", None) or {})
+    return ("Temporary files: %s on disk, peak %s. Deleted %d files,"
+            " freeing %s." % (format_bytes(usage["current"]),
+                              format_bytes(usage["peak"]),
+                              usage["deleted"], format_bytes(usage["freed"])))
@@ -13,33 +13,74 @@ Utility function for DAG files.
 import dag
 
 command_help = {
-    "attach": ("Attaches a SHELL process to a process id (PID)."
-               " Usage: attach <workunit name> <PID>"),
-    "cancel": "Stops a workunit.",
+    "attach": ("Attaches a SHELL process to process ids (PIDs). Processes"
+               " waiting to run are started once every PID has exited."
+               " Usage: attach <workunit name> <PID> [PID ...]"),
+    "bundle": ("Applies the results of a finished bundle or chain of"
+               " processes to the DAG. With --partial, only the members"
+               " that have finished are updated, while the rest keep"
+               " running. Usage: bundle <bundle name> [--partial]"),
+    "cancel": ("Stops workunits. With the SHELL engine, each process and"
+               " everything it started is sent SIGTERM, and SIGKILL if it"
+               " has not stopped after 10 seconds. Accepts selectors"
+               " (see 'help select')."),
+    "eta": ("Estimates the time remaining until all processes have"
+            " finished, using the run history."),
     "help": "Displays help for commands. Usage: help <cmd>",
-    "list": "Lists all processes.",
+    "list": ("Lists all processes. Accepts the report options"
+             " --limit N, --offset N and --ndjson."),
+    "log": ("Prints the standard output of a process, or its standard"
+            " error with --stderr, from the log store of the DAG or from"
+            " its output files. Usage: log <workunit name> [--stderr]"),
     "print": ("Print information about a process. If a workunit"
-              " name is not given, all processes are listed."),
+              " name is not given, all processes are listed. Accepts the"
+              " report options --limit N, --offset N and --ndjson."),
     "recreate": ("Regenerates specified temporary files."
                  " Options are: 'result_template'"),
-    "reset": ("Clears generated values, such as workunit name,"
-              " and moves process to CREATED state."),
+    "reset": ("Clears generated values, such as workunit name and"
+              " the number of retries, and moves process to CREATED state."
+              " Accepts selectors (see 'help select')."),
     "remove": ("Removes a workunit. 'all' can be supplied instead"
-               " of a workunit name to remove ALL of the workunits."),
+               " of a workunit name to remove ALL of the workunits."
+               " Accepts selectors (see 'help select')."),
     "run": ("Stars a specific process, by workunit name. This should be run"
-            " after 'stage'"),
+            " after 'stage'. Accepts selectors (see 'help select')."),
+    "select": ("Lists the processes matching selectors. Selectors are"
+               " state=NAME, name=PATTERN, cmd=PATTERN or uuid=UUID."
+               " Patterns may contain wildcards. Terms joined by commas"
+               " must all match, e.g. state=FAIL,cmd=trident. cancel,"
+               " remove, reset, run and stage accept selectors in place of"
+               " workunit names and save the DAG once."),
+    "serve": ("Keeps the DAG loaded in a resident server, to which the"
+              " update_dag script forwards commands (see dag.resident)."
+              " The server exits after SECONDS without a request. 0 means"
+              " never. Usage: serve [SECONDS] (Default: 600)"),
+    "speculated": ("Applies the result of a speculative copy of a"
+                   " straggler to the DAG. Run by the notifier of the copy."
+                   " LSF only. Usage: speculated <copy name>"),
     "stage": ("Copies necessary files to their required locations"
-              " on the server."),
+              " on the server. Accepts selectors (see 'help select')."),
     "start": "Starts ALL processes",
+    "stragglers": ("Submits copies of running processes that have run"
+                   " much longer than finished processes with the same"
+                   " command. Whichever copy succeeds first is kept."
+                   " LSF only. The SHELL engine does this itself, if the"
+                   " DAG was created with gsub --speculate."),
     "state": ("Prints processes in a given state. The optional \"--count\""
               " flag may be used to show only a count of the number "
               "of processes in that state. States are: {0}"
               .format(", ".join([dag.strstate(i)
                                  for i in range(0, dag.States.NUM_STATES)]))),
+    "tempfiles": ("Prints the bytes of temporary files on disk, their peak"
+                  " and the bytes freed by deleting temporary files once"
+                  " the processes that use them have succeeded."),
     "update": "Update the state of a workunit.",
     "uuid": "Gets UUID for a work unit."
     }
 
+# Commands whose output is produced by report_lines
+REPORT_COMMANDS = ["list", "print", "state"]
+
 
 def get_help_string(command=None):
     """
@@ -56,6 +97,194 @@ def get_help_string(command=None):
     return "%s -- %s" % (command, command_help[command])
 
 
+def parse_report_options(cmd_args):
+    """
+    Separates the report options (--count, --limit N, --offset N and
+    --ndjson) from the other arguments of a report command.
+
+    @param cmd_args: Arguments of the command
+    @type cmd_args: list
+    @return: Remaining arguments and a dict of options
+    @rtype: tuple
+    @raise dag.DagException: If a limit or offset is not a number
+    """
+    from dag import DagException
+    options = {"count": False, "limit": None, "offset": 0, "ndjson": False}
+    args = []
+    idx = 0
+    while idx < len(cmd_args):
+        arg = cmd_args[idx]
+        if arg == "--count":
+            options["count"] = True
+        elif arg == "--ndjson":
+            options["ndjson"] = True
+        elif arg in ["--limit", "--offset"]:
+            idx += 1
+            try:
+                options[arg[2:]] = int(cmd_args[idx])
+            except (IndexError, ValueError):
+                raise DagException("%s requires a number" % arg)
+        else:
+            args.append(arg)
+        idx += 1
+    return (args, options)
+
+
+def process_record(root_dag, proc, parents=None):
+    """
+    Creates a dict describing a process, for machine readable output.
+
+    @param root_dag: DAG containing the process
+    @type root_dag: dag.DAG
+    @param proc: Process
+    @type proc: dag.Process
+    @param parents: Optional parent map from DAG.dependency_map. If it is
+     given, dependencies are included.
+    @type parents: dict
+    @rtype: dict
+    """
+    from dag import File, Process, strstate
+    record = {"workunit_name": proc.workunit_name,
+              "cmd": proc.cmd,
+              "state": strstate(proc.state),
+              "uuid": str(proc.uuid)}
+    if getattr(proc, "retries", 0):
+        record["attempts"] = getattr(proc, "attempts", 0)
+        record["retries"] = proc.retries
+    if getattr(proc, "failure_reason", None):
+        record["failure_reason"] = proc.failure_reason
+    if parents is None:
+        return record
+    record["input_files"] = [f.full_path() for f in proc.input_files]
+    record["output_files"] = [f.full_path() for f in proc.output_files]
+    record["depends_on"] = [p.workunit_name for p in parents.get(proc, [])]
+    unfinished = []
+    for prereq in root_dag.incomplete_prereqs(proc, parents):
+        if isinstance(prereq, File):
+            unfinished.append(prereq.full_path())
+        elif isinstance(prereq, Process):
+            unfinished.append(prereq.workunit_name)
+    record["unfinished"] = unfinished
+    return record
+
+
+def report_lines(root_dag, cmd, cmd_args):
+    """
+    Generates the output of the print, list and state commands. Output is
+    produced one process at a time, so that reports of large DAGs may be
+    written as they are created. Dependencies are computed once per
+    report.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @param cmd: Command, one of REPORT_COMMANDS
+    @type cmd: str
+    @param cmd_args: Arguments of the command, including report options
+    @type cmd_args: list
+    @return: Generator of strings
+    @rtype: generator
+    @raise dag.DagException: If the arguments are invalid
+    """
+    import json
+    from itertools import islice
+    from dag import DagException, States, intstate, strstate
+
+    (args, options) = parse_report_options(cmd_args)
+    stop = None
+    if options["limit"] is not None:
+        stop = options["offset"] + options["limit"]
+
+    def window(processes):
+        return islice(processes, options["offset"], stop)
+
+    if cmd == "print":
+        if args:
+            proc = root_dag.get_process(args[0])
+            if not proc:
+                yield "No such process found: {0}\n".format(args[0])
+            elif options["ndjson"]:
+                parents = root_dag.dependency_map()[0]
+                yield "%s\n" % json.dumps(process_record(root_dag, proc,
+                                                         parents))
+            else:
+                yield "%s\n" % proc
+        elif options["ndjson"]:
+            parents = root_dag.dependency_map()[0]
+            for proc in window(root_dag.processes):
+                yield "%s\n" % json.dumps(process_record(root_dag, proc,
+                                                         parents))
+        elif root_dag.is_empty():
+            yield "Empty\n"
+        else:
+            for report in root_dag.report(window(root_dag.processes)):
+                yield report
+            yield "\n"
+    elif cmd == "list":
+        for proc in window(root_dag.processes):
+            if options["ndjson"]:
+                yield "%s\n" % json.dumps(process_record(root_dag, proc))
+            else:
+                yield "%s: %s\n" % (proc.workunit_name, proc.cmd)
+    elif cmd == "state":
+        all_states = [strstate(i) for i in range(0, States.NUM_STATES)]
+        if not args:
+            raise DagException("Missing state name.")
+        states_to_view = args[0]
+        if states_to_view == "all":
+            states_to_view = ",".join(all_states)
+
+        states = []
+        for state_name in states_to_view.split(","):
+            state = intstate(state_name.upper())
+            if state is None:
+                raise DagException("%s is not a valid state. States are %s"
+                                   % (state_name, ", ".join(all_states)))
+            states.append(state)
+
+        if options["count"]:
+            counts = dict([(state, 0) for state in states])
+            for proc in root_dag.processes:
+                if proc.state in counts:
+                    counts[proc.state] += 1
+            for state in states:
+                if options["ndjson"]:
+                    yield "%s\n" % json.dumps({"state": strstate(state),
+                                               "count": counts[state]})
+                else:
+                    yield "%s: %d\n" % (strstate(state), counts[state])
+            return
+
+        selected = (proc for state in states for proc in root_dag.processes
+                    if proc.state == state)
+        for proc in window(selected):
+            if options["ndjson"]:
+                yield "%s\n" % json.dumps(process_record(root_dag, proc))
+            else:
+                yield "%s\n" % proc
+    else:
+        raise DagException("%s is not a report command" % cmd)
+
+
+def select_processes(root_dag, selectors):
+    """
+    Finds the processes matching a list of workunit names or selectors.
+
+    @param root_dag: DAG
+    @type root_dag: dag.DAG
+    @param selectors: Workunit names or selectors (see dag.DAG.select)
+    @type selectors: list
+    @return: Matching processes
+    @rtype: list
+    @raise dag.DagException: If a selector matches no process
+    """
+    from dag import DagException
+    unmatched = []
+    processes = root_dag.select(selectors, unmatched)
+    if unmatched:
+        raise DagException("No process matches %s" % ", ".join(unmatched))
+    return processes
+
+
 def create_work(root_dag, dagpath, show_progress, num_cores=None):
     """
     Takes a DAG and starts processes that are able to be started.
@@ -197,13 +426,26 @@ def update_state(cmd_args, root_dag):
                                " to run update")
         new_state = cmd_args[1].upper()
         proc.state = dag.intstate(new_state)
+        if proc.state == dag.States.SUCCESS:
+            from dag.fingerprint import record
+            record(proc, getattr(root_dag, "history_filename", None))
         root_dag.save()
     elif root_dag.engine == Engine.LSF:
-        from lsf import get_state
+        from lsf import get_state, record_run
         if len(cmd_args) == 2:
             proc.state = dag.intstate(cmd_args[1].upper())
         else:
             proc.state = get_state(proc)
+        if (proc.state in dag.FINISHED_STATES
+                and getattr(proc, "speculative_copy", None)):
+            from lsf import original_ended
+            original_ended(proc)
+        history_filename = getattr(root_dag, "history_filename", None)
+        if proc.state in dag.FINISHED_STATES:
+            record_run(proc, history_filename)
+        if proc.state == dag.States.SUCCESS:
+            from dag.fingerprint import record
+            record(proc, history_filename)
         root_dag.save()
     elif root_dag.engine == Engine.SHELL:
         proc.state = dag.intstate(cmd_args[1].upper())
@@ -232,10 +474,10 @@ def modify_dag(root_dag, cmd, cmd_args, debug=False):
     return_message = ""
     if cmd == "attach":
         from dag.shell import Waiter
-        if len(cmd_args) != 2:
+        if len(cmd_args) < 2:
             raise Exception("Attach requires a workunit name"
-                            " and a process id number (PID).")
-        new_process = Waiter(cmd_args[0], [cmd_args[1], ])
+                            " and process id numbers (PIDs).")
+        new_process = Waiter(cmd_args[0], cmd_args[1:])
         for process in root_dag.processes:
             if (process.state in [dag.States.CREATED, dag.States.STAGED]
                 and not isinstance(process, Waiter)):
@@ -243,82 +485,87 @@ def modify_dag(root_dag, cmd, cmd_args, debug=False):
         root_dag.processes.append(new_process)
         root_dag.save()
         return "Attached %s" % cmd_args[0]
-    elif cmd == "print":
-        if len(cmd_args) == 0:
-            return_message += "%s\n" % root_dag
-        else:
-            proc = root_dag.get_process(cmd_args[0])
-            if proc:
-                return_message += "%s\n" % proc
-            else:
-                return_message += "No such process found: {0}\n".format(cmd_args[0])
-            return return_message
+    elif cmd in REPORT_COMMANDS:
+        return "".join(report_lines(root_dag, cmd, cmd_args))
     elif cmd == "help":
         if not cmd_args:
             return get_help_string(None)
         else:
             return get_help_string(cmd_args[0])
-    elif cmd == "list":
-        for proc in root_dag.processes:
-            return_message += "%s: %s\n" % (proc.workunit_name, proc.cmd)
-        return return_message
     elif cmd in ["remove", "run", "stage"]:
         if len(cmd_args) == 0:
-            raise Exception("%s requires at least one workunit name" % cmd)
-        for wuname in cmd_args:
-            proc = root_dag.get_process(wuname)
-            if cmd == "remove":
-                if wuname == "all":
-                    from sys import stdin
-                    print("Are you sure you want to remove ALL workunits"
-                          " (yes or no)?")
-                    if (not stdin.readline().strip()
-                       in ["y", "Y", "yes", "Yes", "YES"]):
-                        # Cancel workunit
-                        print("Canceled.")
-                        exit(1)
-                    count = 0
-                    progress_bar = None
-                    if not debug:
-                        from progressbar import ProgressBar, Percentage, Bar
-                        num_processes = len(root_dag.processes)
-                        if num_processes:
-                            progress_bar = ProgressBar(widgets = [Percentage(), Bar()], maxval = num_processes).start()
-                    for proc in root_dag.processes:
-                        if debug:
-                            print("Removing %s" % proc.workunit_name)
-                        clean_workunit(root_dag, proc)
-                        count += 1
-                        if progress_bar:
-                            progress_bar.update(count)
-                    if progress_bar:
-                        print("")  # reset line return
-                    root_dag.processes = []  # clear process list
-                else:
+            raise Exception("%s requires at least one workunit name"
+                            " or selector" % cmd)
+        if cmd == "remove" and "all" in cmd_args:
+            from sys import stdin
+            print("Are you sure you want to remove ALL workunits"
+                  " (yes or no)?")
+            if (not stdin.readline().strip()
+               in ["y", "Y", "yes", "Yes", "YES"]):
+                # Cancel workunit
+                print("Canceled.")
+                exit(1)
+            count = 0
+            progress_bar = None
+            if not debug:
+                from progressbar import ProgressBar, Percentage, Bar
+                num_processes = len(root_dag.processes)
+                if num_processes:
+                    progress_bar = ProgressBar(widgets = [Percentage(), Bar()], maxval = num_processes).start()
+            for proc in root_dag.processes:
+                if debug:
+                    print("Removing %s" % proc.workunit_name)
+                clean_workunit(root_dag, proc)
+                count += 1
+                if progress_bar:
+                    progress_bar.update(count)
+            if progress_bar:
+                print("")  # reset line return
+            root_dag.processes = []  # clear process list
+            root_dag.save()
+            print("updated dagfile")
+            return return_message
+
+        processes = select_processes(root_dag, cmd_args)
+        parents = None
+        if cmd == "run":
+            parents = root_dag.dependency_map()[0]
+        try:
+            for proc in processes:
+                wuname = proc.workunit_name
+                if cmd == "remove":
                     if debug:
                         print("Removing %s" % wuname)
                     clean_workunit(root_dag, proc)
-                    root_dag.processes.remove(proc)  # remove process
                     return_message += "Removed %s\n" % wuname
-            if cmd in ["run", "stage"]:
+                    continue
                 print("Staging %s" % wuname)
                 stage_files(root_dag, proc)
                 if proc.state == dag.States.CREATED:
                     proc.state = dag.States.STAGED
                 if cmd == "run":
                     return_message += "Starting %s\n" % wuname
-                    if root_dag.incomplete_prereqs(proc):
+                    if root_dag.incomplete_prereqs(proc, parents):
                         raise Exception("Cannot start %s."
-                                        " Missing dependencies.")
+                                        " Missing dependencies." % wuname)
                     schedule_work(root_dag, proc, root_dag.filename)
                     if isinstance(proc, dag.InternalProcess):
                         proc.state = dag.States.SUCCESS
                         return_message += "Finished %s" % wuname
                     else:
                         proc.state = dag.States.RUNNING
-            #save dag
+        finally:
+            if cmd == "remove":
+                removed = set(processes)
+                root_dag.processes = [proc for proc in root_dag.processes
+                                      if proc not in removed]
+            # Changes are saved once, even if a process could not start.
             root_dag.save()
             print("updated dagfile")
+    elif cmd == "select":
+        for proc in select_processes(root_dag, cmd_args):
+            return_message += "%s: %s\n" % (proc.workunit_name, proc.cmd)
+        return return_message
     elif cmd == "start":
         start_processes(root_dag, OP.abspath(root_dag.filename),
                         True, root_dag.num_cores)
@@ -340,18 +587,23 @@ def modify_dag(root_dag, cmd, cmd_args, debug=False):
             print("Do not know how to recreate: '%s'" % cmd_args[0])
         return_message += "Recreated %s\n" % cmd_args[0]
     elif cmd == "reset":
-        for wuname in cmd_args:
-            proc = root_dag.get_process(wuname)
-            if not proc:
-                return_message += "No such workunit: %s\n" % wuname
-                continue
+        unmatched = []
+        processes = root_dag.select(cmd_args, unmatched)
+        for selector in unmatched:
+            return_message += "No such workunit: %s\n" % selector
+        for proc in processes:
+            wuname = proc.workunit_name
             clean_workunit(root_dag, proc)
             proc.workunit_name = None
             proc.workunit_template = None
             proc.result_template = None
             proc.state = dag.States.CREATED
+            proc.attempts = 0
+            proc.cancelled = False
+            proc.failure_reason = None
+            return_message += "Reset %s\n" % wuname
+        if processes:
             root_dag.save()
-            return_message += "Reset %s" % wuname
     elif cmd == "cancel":
         if root_dag.engine == dag.Engine.LSF:
             raise dag.DagException("Cannot yet cancel LSF jobs.")
@@ -359,46 +611,85 @@ def modify_dag(root_dag, cmd, cmd_args, debug=False):
             if not hasattr(root_dag, "message_queue"):
                 raise dag.DagException("Cannot stop shell process "
                                        "without message queue")
-        
-        proc_list = [root_dag.get_process(wuname) for wuname in cmd_args]
+
+        unmatched = []
+        proc_list = root_dag.select(cmd_args, unmatched)
+        for selector in unmatched:
+            return_message += "No such workunit: %s\n" % selector
+        count = len(proc_list)
         if root_dag.engine == dag.Engine.BOINC:
             dag.boinc.cancel_workunits(proc_list)
         elif root_dag.engine == dag.Engine.SHELL:
-            dag.shell.cancel_workunits(root_dag, proc_list)
+            count = dag.shell.cancel_workunits(root_dag, proc_list)
         root_dag.save()
-        return_message += "Cancelled %s" % ", ".join(cmd_args)
+        return_message += "Cancelled %d processes" % count
     elif cmd == "update":
+        from dag.retry import can_retry
         update_state(cmd_args, root_dag)
-        if root_dag.engine == dag.Engine.LSF:
+        # BOINC processes held back by a full pool (see dag.pools) are
+        # submitted once a member of the pool has ended, and failures
+        # with retries left are submitted again (see dag.retry).
+        proc = root_dag.get_process(cmd_args[0])
+        if (root_dag.engine == dag.Engine.LSF
+                or (root_dag.engine == dag.Engine.BOINC
+                    and (getattr(root_dag, "pools", None)
+                         or (proc.state == dag.States.FAIL
+                             and can_retry(proc))))):
             start_processes(root_dag, root_dag.filename, False)
         return_message += "Updated process"
-    elif cmd == "state":
-        count_only = False
-        if "--count" in cmd_args:
-            count_only = True
-
-        if not cmd_args:
-            raise dag.DagException("Missing state name.")
-        states_to_view = cmd_args[0]
-        if states_to_view == "all":
-            states_to_view = ",".join([dag.strstate(i)
-                                       for i in range(0,
-                                                      dag.States.NUM_STATES)])
-
-        for state_name in states_to_view.split(","):
-            state = dag.intstate(state_name.upper())
-            if state is None:
-                print("%s is not a valid state." % state_name)
-                print("States are %s"
-                      % ", ".join([dag.strstate(i)
-                                   for i in range(0, dag.States.NUM_STATES)]))
-                raise dag.DagException("Invalid State")
-            proc_list = root_dag.get_processes_by_state(state)
-            if count_only:
-                return_message += "%s: %d\n" % (dag.strstate(state), len(proc_list))
-            else:
-                for i in proc_list:
-                    return_message += "%s" % i
+    elif cmd == "bundle":
+        from dag.bundle import apply_results
+        partial = "--partial" in cmd_args
+        cmd_args = [arg for arg in cmd_args if arg != "--partial"]
+        if len(cmd_args) != 1:
+            raise dag.DagException("bundle requires a bundle name.")
+        members = apply_results(root_dag, "%s.manifest" % cmd_args[0],
+                                "%s.results" % cmd_args[0], partial)
+        root_dag.save()
+        if root_dag.engine == dag.Engine.LSF and not partial:
+            start_processes(root_dag, root_dag.filename, False)
+        return_message += ("Updated %d processes of %s"
+                           % (len(members), cmd_args[0]))
+    elif cmd == "tempfiles":
+        from dag.tempfiles import usage_report
+        return_message += usage_report(root_dag)
+    elif cmd == "stragglers":
+        if root_dag.engine != dag.Engine.LSF:
+            raise dag.DagException("stragglers is only used with LSF.")
+        import dag.lsf
+        copied = dag.lsf.speculate(root_dag)
+        root_dag.save()
+        return_message += ("Copied %d stragglers%s"
+                           % (len(copied),
+                              "".join([" %s" % proc.workunit_name
+                                       for proc in copied])))
+    elif cmd == "speculated":
+        if root_dag.engine != dag.Engine.LSF:
+            raise dag.DagException("speculated is only used with LSF.")
+        import dag.lsf
+        if len(cmd_args) != 1:
+            raise dag.DagException("speculated requires a copy name.")
+        dag.lsf.copy_ended(root_dag, cmd_args[0])
+        root_dag.save()
+        return_message += "Updated copy %s" % cmd_args[0]
+    elif cmd == "log":
+        from dag.logstore import read_output
+        stream = "stdout"
+        if "--stderr" in cmd_args:
+            stream = "stderr"
+            cmd_args = [arg for arg in cmd_args if arg != "--stderr"]
+        if len(cmd_args) != 1:
+            raise dag.DagException("log requires a workunit name.")
+        output = read_output(cmd_args[0], stream,
+                             getattr(root_dag, "log_store", None))
+        if output is None:
+            raise dag.DagException("No %s found for %s"
+                                   % (stream, cmd_args[0]))
+        return_message += output
+    elif cmd == "eta":
+        from dag.history import estimate_completion, format_duration
+        return_message += ("Estimated time remaining: %s"
+                           % format_duration(estimate_completion(root_dag)))
     elif cmd == "uuid":
         proc = root_dag.get_process(cmd_args[0])
         return_message += str(proc.uuid)
@@ -450,6 +741,16 @@ def update_dag(cmd, cmd_args, dagfile=dag.DEFAULT_DAGFILE_NAME, debug=False,
     if debug:
         print("Running command: %s" % cmd)
 
+    if cmd == "serve":
+        from dag.resident import serve, DEFAULT_IDLE_TIMEOUT
+        idle_timeout = DEFAULT_IDLE_TIMEOUT
+        if cmd_args:
+            idle_timeout = float(cmd_args[0])
+        if not OP.isfile(dagfile):
+            raise Exception("Could not open '%s'" % dagfile)
+        serve(dagfile, idle_timeout)
+        return
+
     # If the dag is needed (probably), load it.
     root_dag = None
     if needs_dagfile(cmd):
@@ -460,4 +761,10 @@ def update_dag(cmd, cmd_args, dagfile=dag.DEFAULT_DAGFILE_NAME, debug=False,
     if num_cores:
         root_dag.num_cores = num_cores
 
+    if cmd in REPORT_COMMANDS:
+        from sys import stdout
+        for line in report_lines(root_dag, cmd, cmd_args):
+            stdout.write(line)
+        return
+
     print(modify_dag(root_dag, cmd, cmd_args, debug))
\ No newline at end of file
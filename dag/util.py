@@ -66,3 +66,63 @@ def open_user_init():
         return None
 
     return open(file_path, "r")
+
+
+def parse_memory(value):
+    """
+    Converts a memory size to a number of bytes. The size may be given
+    as an integer or as a string with an optional K, M, G or T suffix,
+    e.g. "512M" or "40G".
+
+    @param value: Memory size
+    @type value: str
+    @return: Number of bytes
+    @rtype: int
+    @raise dag.DagException: If the size cannot be parsed.
+    """
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    text = str(value).strip().upper()
+    if text.endswith("B"):
+        text = text[:-1]
+    multiplier = 1
+    if text and text[-1] in units:
+        multiplier = units[text[-1]]
+        text = text[:-1]
+    try:
+        return int(float(text) * multiplier)
+    except ValueError:
+        raise dag.DagException("Invalid memory size: '%s'" % value)
+
+
+def format_bytes(nbytes):
+    """
+    Formats a number of bytes with the suffixes of parse_memory, e.g. "1.5G".
+
+    @param nbytes: Number of bytes
+    @type nbytes: int
+    @rtype: str
+    """
+    value = float(nbytes)
+    for suffix in ["", "K", "M", "G"]:
+        if abs(value) < 1024:
+            return ("%d%s" if not suffix else "%.1f%s") % (value, suffix)
+        value /= 1024
+    return "%.1fT" % value
+
+
+def get_header_value(header_map, key):
+    """
+    Returns the value of a header key. Values set by "%define" lines
+    are lists of strings, in which case the first string is returned.
+
+    @param header_map: Keyword map populated by the submission script
+    @type header_map: dict
+    @param key: Key to be found
+    @type key: str
+    @return: Value of the key
+    @rtype: object
+    """
+    value = header_map[key]
+    if isinstance(value, list):
+        value = value[0]
+    return value
@@ -15,6 +15,14 @@ class Tester(Command):
         fh = logging.FileHandler('test/debug.log')
         fh.setLevel(logging.DEBUG)
         logger.addHandler(fh)
+        # Test runs are kept out of the history of the user.
+        import atexit
+        import shutil
+        import tempfile
+        from dag.history import HISTORY_VARIABLE
+        history_dir = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, history_dir, True)
+        os.environ[HISTORY_VARIABLE] = os.path.join(history_dir, "history.db")
 
     def finalize_options(self):
         pass
@@ -42,16 +50,194 @@ class Tester(Command):
             print("Failure")
             exit(1)
 
+        print("Testing a shell DAG to completion")
+        if test.test_shell_completion():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing resource packing")
+        if test.test_resource_packing():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing critical path ordering")
+        if test.test_critical_path():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing run history")
+        if test.test_run_history():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing incremental execution")
+        if test.test_incremental():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing process selectors")
+        if test.test_select():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing parametric sweeps")
+        if test.test_sweep():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing bundling of short processes")
+        if test.test_bundling():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing fusion of linear chains")
+        if test.test_chain_fusion():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing validation of dependencies")
+        if test.test_validation():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing log store")
+        if test.test_log_store():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing reattaching to running children")
+        if test.test_reattach():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing retries of failed processes")
+        if test.test_retry():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing speculative copies of stragglers")
+        if test.test_speculation():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing cancellation of process groups")
+        if test.test_cancellation():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing waiting on processes")
+        if test.test_waiter():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing limits of shell processes")
+        if test.test_limits():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing placement on CPUs")
+        if test.test_placement():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing concurrency pools")
+        if test.test_pools():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing removal of temporary files")
+        if test.test_temp_files():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing agent token")
+        if test.test_agent_token():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing forked children")
+        if test.test_child_exit():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing concurrent saves")
+        if test.test_save_conflict():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
+        print("Testing file cache")
+        if test.test_file_cache():
+            print("Success")
+        else:
+            print("Failure")
+            exit(1)
+
         print("Testing progress bar")
         test.test_progress_bar()
         print("Did you see a progress bar?")
 
 
+def read_version():
+    """
+    Reads __version__ from dag/__init__.py without importing dag.
+    """
+    import re
+    with open("dag/__init__.py") as init:
+        return re.search(r'^__version__ = "([^"]+)"', init.read(),
+                         re.MULTILINE).group(1)
+
+
 thescripts = ["scripts/gsub", "scripts/update_dag",
-              "scripts/shell_update"]
+              "scripts/shell_update", "scripts/dag_agent"]
 
 setup(name='dag',
-      version='1.7.0',
+      version=read_version(),
       description='DAG Batch Job Creator for BOINC',
       author='David Coss, PhD',
       author_email='David.Coss@stjude.org',
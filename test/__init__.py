@@ -100,6 +100,971 @@ def test_shell_processes():
     return True
 
 
+def test_shell_completion():
+    import os
+    import os.path as OP
+    import shutil
+    import tempfile
+    from dag import gsub, Engine, States
+    from dag.shell import create_work
+
+    init_filename = OP.abspath("test/dagrc")
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    try:
+        with open("two.sub", "w") as subfile:
+            subfile.write("@first echo one\n@second echo two\n"
+                          "%dependency first second\n")
+        test_dag = gsub.gsub("two.sub", start_jobs=False,
+                             init_filename=init_filename, engine=Engine.SHELL)
+        test_dag.history_filename = OP.join(workdir, "history.db")
+        test_dag.save()
+        # Runs until the DAG is complete.
+        create_work(test_dag, OP.abspath(test_dag.filename))
+        states = [proc.state for proc in test_dag.processes]
+        if states != [States.SUCCESS, States.SUCCESS]:
+            print("DAG did not complete: %s" % states)
+            return False
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+    return True
+
+
+def test_resource_packing():
+    from dag.shell import ShellProcess, pack_processes
+
+    gigabyte = 1024 ** 3
+    small = [ShellProcess("small", []) for i in range(4)]
+    aligner = ShellProcess("aligner", [])
+    aligner.cores = 6
+    assembler = ShellProcess("assembler", [])
+    assembler.cores = 2
+    assembler.memory = 40 * gigabyte
+    for (count, proc) in enumerate(small + [aligner, assembler]):
+        proc.workunit_name = "%s-%d" % (proc.cmd, count)
+
+    # Assembler does not fit in the free memory. Aligner is placed next,
+    # then the small processes fill the remaining cores.
+    chosen = pack_processes([assembler, aligner] + small, 8, 32 * gigabyte,
+                            8, 64 * gigabyte)
+    if aligner not in chosen or assembler in chosen or len(chosen) != 3:
+        print("Unexpected packing: %s"
+              % [proc.workunit_name for proc in chosen])
+        return False
+
+    # Requests larger than the machine still run once it is idle.
+    aligner.cores = 16
+    chosen = pack_processes([aligner], 8, None, 8, None)
+    if chosen != [aligner]:
+        print("Oversized request was not clamped to the machine size")
+        return False
+
+    return True
+
+
+def test_critical_path():
+    import dag
+    from dag.shell import ShellProcess
+
+    # short -> long_a -> long_b is the critical path. quick has no children.
+    d = dag.DAG(dag.Engine.SHELL)
+    d.history_filename = ":memory:"
+    procs = {}
+    for name in ["quick", "short", "long_a", "long_b"]:
+        procs[name] = d.add_process(ShellProcess(name, []))
+        procs[name].workunit_name = name
+    procs["short"].children.append(procs["long_a"])
+    procs["long_a"].children.append(procs["long_b"])
+
+    order = [proc.workunit_name for proc in d.generate_runnable_list()]
+    if order != ["short", "quick"]:
+        print("Expected critical path first. Have: %s" % order)
+        return False
+
+    procs["quick"].priority = 1
+    order = [proc.workunit_name for proc in d.generate_runnable_list()]
+    if order != ["quick", "short"]:
+        print("Expected priority to override critical path. Have: %s"
+              % order)
+        return False
+
+    return True
+
+
+def test_run_history():
+    import os
+    import tempfile
+    import dag
+    from dag.shell import ShellProcess
+    from dag.history import History, HISTORY_VARIABLE
+
+    (handle, history_filename) = tempfile.mkstemp(suffix=".db")
+    os.close(handle)
+    previous = os.environ.get(HISTORY_VARIABLE)
+    try:
+        os.environ[HISTORY_VARIABLE] = history_filename
+        history = History()
+        if history.filename != history_filename:
+            print("%s was not used" % HISTORY_VARIABLE)
+            return False
+        finished = ShellProcess("trident", ["segmented-1"])
+        finished.workunit_name = "trident-1"
+        history.record(finished, 100.0, 130.0, 0)
+        history.record(finished, 200.0, 250.0, 0)
+        history.record(finished, 300.0, 301.0, 1)  # Failures are ignored
+        history.close()
+
+        d = dag.DAG(dag.Engine.SHELL)
+        d.history_filename = history_filename
+        waiting = d.add_process(ShellProcess("trident", ["segmented-2"]))
+        estimate = d.estimate_runtime(waiting)
+        if estimate != 40.0:
+            print("Expected estimate of 40 seconds. Have %s" % estimate)
+            return False
+    finally:
+        if previous is None:
+            del os.environ[HISTORY_VARIABLE]
+        else:
+            os.environ[HISTORY_VARIABLE] = previous
+        os.unlink(history_filename)
+
+    return True
+
+
+def test_incremental():
+    import os
+    import os.path as OP
+    import shutil
+    import tempfile
+    import dag
+    from dag.shell import ShellProcess
+    from dag.fingerprint import record
+
+    workdir = tempfile.mkdtemp()
+
+    def make_dag():
+        d = dag.DAG(dag.Engine.SHELL)
+        d.history_filename = OP.join(workdir, "history.db")
+        proc = d.add_process(ShellProcess("sort", ["input.txt"]))
+        proc.workunit_name = "sort"
+        proc.input_files = [dag.File(OP.join(workdir, "input.txt"))]
+        proc.output_files = [dag.File(OP.join(workdir, "output.txt"))]
+        return (d, proc)
+
+    try:
+        for name in ["input.txt", "output.txt"]:
+            with open(OP.join(workdir, name), "w") as outfile:
+                outfile.write("b\na\n")
+        (d, proc) = make_dag()
+        proc.state = dag.States.SUCCESS
+        record(proc, d.history_filename)
+
+        # Same inputs and outputs. Process should be skipped.
+        (d, proc) = make_dag()
+        if d.generate_runnable_list() or proc.state != dag.States.SUCCESS:
+            print("Up to date process was not skipped")
+            return False
+
+        # Changed input. Process should run.
+        with open(OP.join(workdir, "input.txt"), "w") as outfile:
+            outfile.write("c\nb\na\n")
+        (d, proc) = make_dag()
+        if d.generate_runnable_list() != [proc]:
+            print("Out of date process was skipped")
+            return False
+
+        # A chain of up to date processes is skipped in one call, up to
+        # the step whose output is missing.
+        def make_chain():
+            d = dag.DAG(dag.Engine.SHELL)
+            d.history_filename = OP.join(workdir, "history.db")
+            steps = []
+            for i in range(5):
+                step = ShellProcess("cp", ["step-%d" % i, "step-%d" % (i + 1)])
+                step.workunit_name = "cp-%d" % i
+                step.input_files = [dag.File(OP.join(workdir, "step-%d" % i))]
+                step.output_files = [dag.File(OP.join(workdir,
+                                                      "step-%d" % (i + 1)))]
+                steps.append(d.add_process(step))
+            return (d, steps)
+
+        for i in range(6):
+            with open(OP.join(workdir, "step-%d" % i), "w") as outfile:
+                outfile.write("%d\n" % i)
+        (d, steps) = make_chain()
+        for step in steps:
+            step.state = dag.States.SUCCESS
+            record(step, d.history_filename)
+        os.unlink(OP.join(workdir, "step-5"))
+        (d, steps) = make_chain()
+        if d.generate_runnable_list() != [steps[-1]]:
+            print("Up to date chain was not skipped")
+            return False
+        if [step.state for step in steps[:-1]] != [dag.States.SUCCESS] * 4:
+            print("Up to date steps were not marked SUCCESS")
+            return False
+    finally:
+        shutil.rmtree(workdir)
+
+    return True
+
+
+def test_select():
+    import dag
+    from dag.shell import ShellProcess
+
+    d = dag.DAG(dag.Engine.SHELL)
+    d.history_filename = ":memory:"
+    for i in range(6):
+        cmd = "trident" if i % 2 else "sort"
+        proc = d.add_process(ShellProcess(cmd, [str(i)]))
+        proc.workunit_name = "chunk-%d" % i
+        if i < 4:
+            proc.state = dag.States.FAIL
+
+    def names(selectors, unmatched=None):
+        return [proc.workunit_name
+                for proc in d.select(selectors, unmatched)]
+
+    if names(["state=FAIL,cmd=trident"]) != ["chunk-1", "chunk-3"]:
+        print("Combined selector failed")
+        return False
+    unmatched = []
+    if (names(["chunk-5", "name=chunk-[01]", "missing"], unmatched)
+            != ["chunk-0", "chunk-1", "chunk-5"]
+            or unmatched != ["missing"]):
+        print("Name selectors failed")
+        return False
+    try:
+        d.select(["size=big"])
+        print("Invalid selector accepted")
+        return False
+    except dag.DagException:
+        pass
+    return True
+
+
+def test_sweep():
+    import cPickle
+    import dag
+    from dag.shell import SweepProcess, expand_sweeps
+
+    d = dag.DAG(dag.Engine.SHELL)
+    d.history_filename = ":memory:"
+    sweep = d.add_process(SweepProcess("segment", ["chunk-$N.fa"],
+                                       "N", ["1..4", "last"]))
+    sweep.workunit_name = "segment"
+
+    instances = expand_sweeps(d.generate_runnable_list(), 3)
+    if [proc.args for proc in instances] != [["chunk-1.fa"], ["chunk-2.fa"],
+                                             ["chunk-3.fa"]]:
+        print("Wrong sweep instances")
+        return False
+    for proc in instances:
+        proc.state = dag.States.RUNNING
+    if sweep.state != dag.States.CREATED:
+        print("Sweep with unstarted instances is not waiting")
+        return False
+
+    instances = expand_sweeps(d.generate_runnable_list(), 3)
+    if [proc.workunit_name for proc in instances] != ["segment[3]",
+                                                      "segment[4]"]:
+        print("Wrong remaining sweep instances")
+        return False
+    for proc in instances:
+        proc.state = dag.States.RUNNING
+    if sweep.state != dag.States.RUNNING:
+        print("Started sweep is not running")
+        return False
+
+    for index in range(5):
+        sweep.set_instance_state(index, dag.States.SUCCESS)
+    sweep = cPickle.loads(cPickle.dumps(sweep, cPickle.HIGHEST_PROTOCOL))
+    if (sweep.state != dag.States.SUCCESS
+            or list(sweep.instance_states) != [dag.States.SUCCESS] * 5):
+        print("Finished sweep did not succeed")
+        return False
+
+    # Other engines expand sweeps into processes, up to a limit.
+    from dag.gsub import sweep_arguments
+    if sweep_arguments(["-n", "$N"], ("N", ["1..3"])) != [["-n", "1"],
+                                                        ["-n", "2"],
+                                                        ["-n", "3"]]:
+        print("Wrong sweep arguments")
+        return False
+    try:
+        sweep_arguments(["$N"], ("N", ["1..3"]), limit=2)
+        print("Sweep beyond the limit was expanded")
+        return False
+    except dag.DagException:
+        pass
+    return True
+
+
+def test_bundling():
+    import dag
+    from dag.shell import ShellProcess
+    from dag.bundle import make_bundles
+
+    d = dag.DAG(dag.Engine.SHELL)
+    d.history_filename = ":memory:"
+    for i in range(6):
+        proc = d.add_process(ShellProcess("short", [str(i)]))
+        proc.workunit_name = "short-%d" % i
+    big = d.add_process(ShellProcess("short", ["big"]))
+    big.workunit_name = "big"
+    big.memory = 1024 ** 3
+
+    def names(bundles):
+        return [[proc.workunit_name for proc in bundle]
+                for bundle in bundles]
+
+    runnable = d.processes[0:6]
+    # Default estimate is 60 seconds, so three fit in 180 seconds.
+    if names(make_bundles(d, runnable, 180)) != [
+            ["short-0", "short-1", "short-2"],
+            ["short-3", "short-4", "short-5"]]:
+        print("Bundles do not follow the target duration")
+        return False
+    # Bundles are split, so that six slots are not left idle.
+    if len(make_bundles(d, runnable, 3600, slots=6)) != 6:
+        print("Bundles leave slots idle")
+        return False
+    # Different requirements are not bundled. Long processes are not
+    # bundled.
+    if names(make_bundles(d, d.processes, 3600)) != [
+            ["short-0", "short-1", "short-2", "short-3", "short-4",
+             "short-5"], ["big"]]:
+        print("Processes with different requirements were bundled")
+        return False
+    if len(make_bundles(d, runnable, 30)) != 6:
+        print("Long processes were bundled")
+        return False
+    return True
+
+
+def test_chain_fusion():
+    import dag
+    from dag.shell import ShellProcess
+    from dag.bundle import plan_units
+
+    # a -> b -> c is a chain. d has two children, so it ends its chain.
+    d = dag.DAG(dag.Engine.SHELL)
+    d.history_filename = ":memory:"
+    procs = {}
+    for name in ["a", "b", "c", "d", "e", "f"]:
+        procs[name] = d.add_process(ShellProcess(name, []))
+        procs[name].workunit_name = name
+    procs["a"].children.append(procs["b"])
+    procs["b"].children.append(procs["c"])
+    procs["d"].children.extend([procs["e"], procs["f"]])
+
+    units = [([proc.workunit_name for proc in members], chain)
+             for (members, chain) in plan_units(d, [procs["a"], procs["d"]],
+                                                fuse=True)]
+    if units != [(["a", "b", "c"], True), (["d"], False)]:
+        print("Chains were not fused. Have: %s" % units)
+        return False
+    procs["c"].state = dag.States.SUCCESS
+    units = plan_units(d, [procs["a"]], fuse=True)
+    if [proc.workunit_name for proc in units[0][0]] != ["a", "b"]:
+        print("Finished processes were fused")
+        return False
+
+    # A step whose input file does not exist yet ends the chain.
+    procs["c"].state = dag.States.CREATED
+    procs["b"].input_files = [dag.File("/nonexistent/b.input")]
+    units = plan_units(d, [procs["a"]], fuse=True)
+    if [proc.workunit_name for proc in units[0][0]] != ["a"]:
+        print("Step with a missing input was fused")
+        return False
+    return True
+
+
+def test_validation():
+    import dag
+    from dag.shell import ShellProcess
+
+    # root -> a -> b -> a is a cycle, which c depends on.
+    d = dag.DAG(dag.Engine.SHELL)
+    d.history_filename = ":memory:"
+    procs = {}
+    for name in ["root", "a", "b", "c", "orphan"]:
+        procs[name] = d.add_process(ShellProcess(name, []))
+        procs[name].workunit_name = name
+    procs["root"].children.append(procs["a"])
+    procs["a"].children.append(procs["b"])
+    procs["b"].children.extend([procs["a"], procs["c"]])
+    procs["orphan"].input_files.append(dag.File("no-such-input-file"))
+
+    problems = d.validate()
+    if [[proc.workunit_name for proc in cycle]
+            for cycle in problems["cycles"]] != [["a", "b"]]:
+        print("Cycle not found. Have: %s" % problems["cycles"])
+        return False
+    if problems["dead_ends"] != [procs["c"]]:
+        print("Dead end not found. Have: %s" % problems["dead_ends"])
+        return False
+    if list(problems["orphan_inputs"]) != [procs["orphan"]]:
+        print("Orphan input not found")
+        return False
+    if procs["root"].level != 0 or procs["c"].level is not None:
+        print("Wrong levels")
+        return False
+
+    procs["b"].children.remove(procs["a"])
+    if d.validate(check_files=False)["cycles"] or procs["c"].level != 3:
+        print("Levels not set after the cycle was removed")
+        return False
+    return True
+
+
+def test_log_store():
+    import shutil
+    import tempfile
+    from dag.logstore import LogStore, open_outputs, close_outputs
+
+    directory = tempfile.mkdtemp()
+    try:
+        store = LogStore.create(directory, cap=1000, segment_size=100)
+        for i in range(3):
+            outputs = open_outputs("job-%d" % i, directory)
+            outputs[0].write("output of job %d\n" % i)
+            outputs[1].write("x" * 5000)
+            close_outputs("job-%d" % i, outputs, directory)
+        if store.read("job-1") != "output of job 1\n":
+            print("Wrong output: %s" % store.read("job-1"))
+            return False
+        stderr = store.read("job-2", "stderr")
+        if not stderr.startswith("x" * 1000) or "4000 bytes" not in stderr:
+            print("Output was not capped")
+            return False
+        if store.current_segment() < 2:
+            print("Segments were not rotated")
+            return False
+        if store.read("job-3") is not None:
+            print("Found output of a process that did not run")
+            return False
+    finally:
+        shutil.rmtree(directory)
+    return True
+
+
+def test_reattach():
+    import os
+    import subprocess
+    import tempfile
+    import dag
+    import dag.shell
+    from dag.shell import ShellProcess, save_running_table, reattach
+
+    d = dag.DAG(dag.Engine.SHELL)
+    d.history_filename = ":memory:"
+    procs = {}
+    for name in ["survivor", "lost", "waiting"]:
+        procs[name] = d.add_process(ShellProcess("sleep", ["30"]))
+        procs[name].workunit_name = name
+    procs["survivor"].state = dag.States.RUNNING
+    procs["lost"].state = dag.States.RUNNING
+
+    child = subprocess.Popen(["sleep", "30"])
+    (handle, table_filename) = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        # The table of a master that died
+        dag.shell.running_children[:] = [("survivor", child.pid),
+                                         ("lost", 2 ** 22 + 1)]
+        save_running_table(table_filename)
+        dag.shell.running_children[:] = []
+        (reattached, lost) = reattach(d, table_filename, 2, None)
+        if reattached != [procs["survivor"]] or lost != ["lost"]:
+            print("Wrong processes reattached: %s, lost: %s"
+                  % (reattached, lost))
+            return False
+        if (dag.shell.running_children != [("survivor", child.pid)]
+                or procs["lost"].state != dag.States.CREATED):
+            print("Lost process was not returned to CREATED")
+            return False
+    finally:
+        child.kill()
+        child.wait()
+        os.unlink(table_filename)
+        dag.shell.running_children[:] = []
+        dag.shell.reserved_resources.clear()
+        dag.shell.adopted_pids.clear()
+    return True
+
+
+def test_retry():
+    import time
+    import dag
+    from dag.retry import requeue_failures
+    from dag.shell import ShellProcess
+
+    d = dag.DAG(dag.Engine.SHELL)
+    d.history_filename = ":memory:"
+    proc = d.add_process(ShellProcess("false", []))
+    proc.retries = 2
+    proc.retry_delay = 10
+    now = time.time()
+    for delay in [10, 20]:
+        proc.state = dag.States.FAIL
+        requeue_failures(d, now)
+        if proc.state != dag.States.RETRY or proc.retry_after != now + delay:
+            print("Not waiting %d seconds to retry" % delay)
+            return False
+        if d.generate_runnable_list():
+            print("Started before the retry delay")
+            return False
+        requeue_failures(d, now + delay)
+        if proc.state != dag.States.CREATED:
+            print("Not released after the retry delay")
+            return False
+    proc.state = dag.States.FAIL
+    if requeue_failures(d, now) != ([], []) or proc.attempts != 2:
+        print("Retried after the budget was spent")
+        return False
+    return True
+
+
+def test_speculation():
+    import os
+    import shutil
+    import tempfile
+    import dag
+    from dag.shell import ShellProcess
+    from dag.speculate import find_stragglers, make_scratch, install_outputs
+
+    d = dag.DAG(dag.Engine.SHELL)
+    d.history_filename = ":memory:"
+    procs = []
+    for i in range(5):
+        proc = d.add_process(ShellProcess("align", []))
+        proc.workunit_name = "align-%d" % i
+        proc.input_files = [dag.File("in-%d.txt" % i)]
+        proc.output_files = [dag.File("out/out-%d.txt" % i)]
+        proc.start_time = 1000.0
+        proc.end_time = 1100.0
+        proc.state = dag.States.SUCCESS
+        procs.append(proc)
+    (slow, fast) = (procs[3], procs[4])
+    for proc in [slow, fast]:
+        proc.state = dag.States.RUNNING
+        proc.end_time = None
+    fast.start_time = 1500.0
+    if find_stragglers(d, [slow, fast], now=1600.0) != [slow]:
+        print("Straggler not found")
+        return False
+
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp()
+    try:
+        os.chdir(directory)
+        os.mkdir("out")
+        with open("in-3.txt", "w") as infile:
+            infile.write("input")
+        scratch = make_scratch(slow)
+        with open(os.path.join(scratch, "in-3.txt"), "r") as infile:
+            if infile.read() != "input":
+                print("Input not linked in scratch directory")
+                return False
+        with open(os.path.join(scratch, "out", "out-3.txt"), "w") as outfile:
+            outfile.write("copy")
+        with open(os.path.join("out", "out-3.txt"), "w") as outfile:
+            outfile.write("partial")
+        if not install_outputs(slow) or os.path.exists(scratch):
+            print("Outputs of copy not installed")
+            return False
+        with open(os.path.join("out", "out-3.txt"), "r") as outfile:
+            if outfile.read() != "copy":
+                print("Output of original not replaced")
+                return False
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+    return True
+
+
+def test_cancellation():
+    import os
+    import time
+    from dag import shell
+
+    # The command and its child ignore SIGTERM, so SIGKILL is needed.
+    pid = shell.fork_child()
+    if not pid:
+        os.execvp("sh", ["sh", "-c", "trap '' TERM; sleep 30 & wait"])
+    time.sleep(0.2)
+    shell.send_kill_signal("ignores-term", pid, None, grace_period=0.5)
+    deadline = time.time() + 5
+    while ((pid in shell.forked_pids or shell.signal_group(pid, 0))
+           and time.time() < deadline):
+        shell.reap_children()
+        time.sleep(0.1)
+    if pid in shell.forked_pids or shell.signal_group(pid, 0):
+        print("Process group still running")
+        return False
+    return True
+
+
+def test_waiter():
+    import subprocess
+    import time
+    from dag import States
+    from dag.shell import Waiter
+
+    children = [subprocess.Popen(["sleep", str(seconds)])
+                for seconds in (0.3, 0.6)]
+    waiter = Waiter("attached", [str(child.pid) for child in children])
+    start = time.time()
+    waiter.start()
+    elapsed = time.time() - start
+    for child in children:
+        child.wait()
+    if elapsed < 0.5 or elapsed > 5 or waiter.state == States.FAIL:
+        print("Waited %f seconds" % elapsed)
+        return False
+
+    # A process that started after the waiter was created is not waited for.
+    child = subprocess.Popen(["sleep", "30"])
+    try:
+        waiter = Waiter("reused", [str(child.pid)])
+        waiter.start_times = [0]
+        start = time.time()
+        waiter.start()
+        if time.time() - start > 1:
+            print("Waited on a reused PID")
+            return False
+    finally:
+        child.kill()
+        child.wait()
+    return True
+
+
+def test_limits():
+    import os
+    import shutil
+    import tempfile
+    import time
+    from dag import States
+    from dag import shell
+
+    class Quiet(object):
+        """Message queue without messages"""
+        def has_message(self, name):
+            return False
+
+    # Output files are written to the working directory.
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    try:
+        proc = shell.ShellProcess("sleep", ["30"])
+        proc.workunit_name = "past-deadline"
+        proc.message_queue = Quiet()
+        proc.deadline = 0.5
+        start = time.time()
+        proc.start()
+        if (proc.state != States.FAIL
+                or proc.failure_reason != shell.REASON_DEADLINE
+                or time.time() - start > 5):
+            print("Deadline was not enforced")
+            return False
+        if (shell.parse_state_message(shell.state_message(proc))
+                != (States.FAIL, shell.REASON_DEADLINE)):
+            print("Failure reason was not sent")
+            return False
+
+        proc = shell.ShellProcess("sh", ["-c", "while :; do :; done"])
+        proc.workunit_name = "cpu-bound"
+        proc.message_queue = Quiet()
+        proc.cpu_limit = 1
+        proc.start()
+        if proc.failure_reason != shell.REASON_CPU_LIMIT:
+            print("CPU limit was not enforced")
+            return False
+
+        # Bundle members and agents get the same limits.
+        from dag.agent import AgentProcess
+        from dag.bundle import member_entry, run_member
+        proc = shell.ShellProcess("sh", ["-c", "while :; do :; done"])
+        proc.workunit_name = "bundled-cpu-bound"
+        proc.cpu_limit = 1
+        result = run_member(member_entry(proc, workdir))
+        if result["failure_reason"] != shell.REASON_CPU_LIMIT:
+            print("CPU limit was not enforced in a bundle")
+            return False
+        agent_proc = AgentProcess({"workunit_name": "agent-past-deadline",
+                                   "cmd": "sleep", "args": ["30"],
+                                   "cwd": workdir, "deadline": 0.5})
+        start = time.time()
+        result = agent_proc.poll()
+        while result is None and time.time() - start < 5:
+            time.sleep(0.1)
+            result = agent_proc.poll()
+        if result is None or result["failure_reason"] != shell.REASON_DEADLINE:
+            print("Deadline was not enforced by an agent")
+            return False
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+    return True
+
+
+def test_placement():
+    import os
+    from dag import placement
+    from dag.shell import fork_child, forked_pids
+
+    if placement.parse_cpu_list("0-3,8,10-11\n") != [0, 1, 2, 3, 8, 10, 11]:
+        print("Could not parse CPU list")
+        return False
+
+    # Two nodes of four CPUs. Processes stay within a node if they fit.
+    pool = placement.CorePool([[0, 1, 2, 3], [4, 5, 6, 7]])
+    if (pool.allocate("a", 2) != [0, 1] or pool.allocate("b", 3) != [4, 5, 6]
+            or pool.allocate("c", 2) != [2, 3]
+            or pool.allocate("d", 2) is not None):
+        print("Wrong placement: %s" % pool.assigned)
+        return False
+    pool.release("a")
+    pool.release("b")
+    if pool.allocate("e", 6) != [4, 5, 6, 7, 0, 1]:
+        print("Wrong placement across nodes: %s" % pool.assigned)
+        return False
+
+    cpu = placement.get_affinity()[0]
+    pid = fork_child([cpu])
+    if not pid:
+        os._exit(int(placement.get_affinity() != [cpu]))
+    (pid, status) = os.waitpid(pid, 0)
+    forked_pids.discard(pid)
+    if status:
+        print("Child was not pinned")
+        return False
+    return True
+
+
+def test_pools():
+    import dag
+    from dag.gsub import preprocess_line
+    from dag.pools import admit
+    from dag.shell import ShellProcess, SweepProcess
+
+    kmap = {}
+    preprocess_line("%pool disk 2", kmap, {})
+    if kmap.get("pool") != "disk" or kmap.get("pool_caps") != {"disk": 2}:
+        print("Could not parse pool line")
+        return False
+    preprocess_line("%pool none", kmap, {})
+    if "pool" in kmap:
+        print("Pool was not ended")
+        return False
+
+    d = dag.DAG(dag.Engine.SHELL)
+    d.history_filename = ":memory:"
+    d.pools = {"disk": 2}
+    copies = [d.add_process(ShellProcess("cp", [str(i)])) for i in range(4)]
+    others = [d.add_process(ShellProcess("echo", [str(i)])) for i in range(2)]
+    for proc in copies:
+        proc.pool = "disk"
+    copies[0].state = dag.States.RUNNING
+    admitted = admit(d, copies[1:] + others)
+    if admitted != [copies[1]] + others:
+        print("Pool cap not respected: %s"
+              % [proc.args for proc in admitted])
+        return False
+
+    # A pooled sweep is not resolved while it waits on its parent.
+    d = dag.DAG(dag.Engine.SHELL)
+    d.history_filename = ":memory:"
+    d.pools = {"disk": 2}
+    parent = ShellProcess("split", [])
+    parent.output_files = [dag.File("chunks")]
+    d.add_process(parent)
+    sweep = SweepProcess("cp", ["$X"], "X", ["1..3"])
+    sweep.input_files = [dag.File("chunks")]
+    sweep.pool = "disk"
+    d.add_process(sweep)
+    for (count, proc) in enumerate(d.processes):
+        proc.workunit_name = "%s-%d" % (proc.cmd, count)
+    if admit(d, d.generate_runnable_list()) != [parent]:
+        print("Waiting sweep was admitted")
+        return False
+    return True
+
+
+def test_temp_files():
+    import os
+    import shutil
+    import tempfile
+    import dag
+    from dag.tempfiles import TempFileCollector
+
+    directory = tempfile.mkdtemp()
+    chunk = dag.File(os.path.join(directory, "chunk"), temporary_file=True)
+    with open(chunk.full_path(), "w") as outfile:
+        outfile.write("x" * 1000)
+    d = dag.DAG(dag.Engine.SHELL)
+    d.history_filename = ":memory:"
+    producer = d.add_process(dag.Process())
+    producer.output_files = [chunk]
+    consumers = [d.add_process(dag.Process()) for i in range(2)]
+    for proc in consumers:
+        proc.input_files = [chunk]
+    try:
+        producer.state = dag.States.SUCCESS
+        consumers[0].state = dag.States.SUCCESS
+        collector = TempFileCollector(d)
+        collector.update()
+        if not os.path.isfile(chunk.full_path()):
+            print("Deleted before every consumer succeeded")
+            return False
+        consumers[1].state = dag.States.SUCCESS
+        collector.update()
+        collector.close()
+        if os.path.isfile(chunk.full_path()):
+            print("Not deleted after every consumer succeeded")
+            return False
+        if d.temp_usage != {"current": 0, "peak": 1000, "freed": 1000,
+                            "deleted": 1}:
+            print("Wrong usage: %s" % d.temp_usage)
+            return False
+    finally:
+        shutil.rmtree(directory)
+    return True
+
+
+def test_agent_token():
+    import json
+    import socket
+    import dag
+    from dag.agent import AgentServer
+
+    d = dag.DAG(dag.Engine.SHELL)
+    d.history_filename = ":memory:"
+    server = AgentServer(d, "127.0.0.1:0", token="secret")
+    address = server.listener.getsockname()
+    clients = []
+    try:
+        for token in ["wrong", "secret"]:
+            sock = socket.create_connection(address)
+            clients.append(sock)
+            sock.sendall((json.dumps({"type": "hello", "name": token,
+                                      "cores": 2, "token": token})
+                          + "\n").encode("utf-8"))
+        for i in range(20):
+            server.poll(0.1)
+            if len(server.agents) == 1 and server.agents[0].cores:
+                break
+        names = [agent.name for agent in server.agents]
+        if names != ["secret"]:
+            print("Wrong agents accepted: %s" % names)
+            return False
+    finally:
+        for sock in clients:
+            sock.close()
+        server.close()
+    return True
+
+
+def test_child_exit():
+    import os
+    import tempfile
+    from dag.shell import exit_child, fork_child, forked_pids
+
+    # The child must not run the cleanup of its caller.
+    (handle, marker) = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        pid = fork_child()
+        if not pid:
+            exit_child(3)
+        (pid, status) = os.waitpid(pid, 0)
+        forked_pids.discard(pid)
+        if os.WEXITSTATUS(status) != 3:
+            print("Child exited with status %d" % os.WEXITSTATUS(status))
+            return False
+    finally:
+        os.unlink(marker)
+    return True
+
+
+def test_save_conflict():
+    import os
+    import shutil
+    import tempfile
+    import dag
+
+    workdir = tempfile.mkdtemp()
+    try:
+        d = dag.DAG(dag.Engine.SHELL)
+        d.add_process(dag.Process())
+        dag_filename = d.save(os.path.join(workdir, "jobs.dag"))
+        first = dag.load(dag_filename)
+        second = dag.load(dag_filename)
+        if first.version != 1 or dag.read_version(dag_filename) != 1:
+            print("Wrong version: %s" % first.version)
+            return False
+        first.processes[0].state = dag.States.SUCCESS
+        first.save()
+        second.processes[0].state = dag.States.FAIL
+        try:
+            second.save()
+            print("Saving over a newer version succeeded")
+            return False
+        except dag.DagException:
+            pass
+        if dag.load(dag_filename).processes[0].state != dag.States.SUCCESS:
+            print("Newer version was overwritten")
+            return False
+    finally:
+        shutil.rmtree(workdir)
+    return True
+
+
+def test_file_cache():
+    import os
+    import shutil
+    import tempfile
+    from dag.filecache import FileCache, network_mount_points
+
+    workdir = tempfile.mkdtemp()
+    try:
+        mounts_filename = os.path.join(workdir, "mounts")
+        with open(mounts_filename, "w") as mounts:
+            mounts.write("server:/home /home\\040dir nfs4 rw 0 0\n"
+                         "/dev/sda1 / ext4 rw 0 0\n")
+        if network_mount_points(mounts_filename) != ["/home dir"]:
+            print("Wrong network mounts")
+            return False
+
+        # Directory names need not be ASCII.
+        directory = os.path.join(workdir, "r\xc3\xa9sultats")
+        os.mkdir(directory)
+        path = os.path.join(directory, "out.txt")
+        for cache in [FileCache(), FileCache(ttl=0, use_inotify=False)]:
+            try:
+                if cache.isfile(path):
+                    print("Missing file found")
+                    return False
+                with open(path, "w") as outfile:
+                    outfile.write("x")
+                cache.refresh()
+                if not cache.isfile(path):
+                    print("New file not found (inotify: %s)"
+                          % (cache.inotify is not None))
+                    return False
+                os.unlink(path)
+            finally:
+                cache.close()
+    finally:
+        shutil.rmtree(workdir)
+    return True
+
+
 def test_progress_bar():
     from progressbar import ProgressBar, Percentage, Bar
     from time import sleep